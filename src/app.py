@@ -1,18 +1,22 @@
 import datetime
+import math
 import os
 import random
 import threading
 import time
 
-import pandas as pd
-
 from service_status import ServiceStatus
 
 is_development = os.environ.get("ENVIRONMENT") == "development"
 
 import schedule as schedule
-from flask import Flask, redirect, render_template
+from flask import Flask, abort, jsonify, redirect, render_template, request
+from markupsafe import Markup
 
+import http_cache
+import weather_data as wd
+from event_stream import EventStream
+from fragment_cache import FragmentCache
 import weather_repository as wr
 import plotting as plt
 import prediction as pred
@@ -34,6 +38,11 @@ index_template = "index.html"
 loading_template = "loading.html"
 default_refresh_interval = 60
 default_station = wr.get_stations()[0]
+plotly_js_bundle = None
+fragment_cache = FragmentCache()
+# Server-Sent Events of new measurements, predictions and plots, served on a separate port by a single thread
+event_stream_port = int(os.environ.get("EVENT_STREAM_PORT", 6541))
+event_stream = None
 show_current = ['air_temperature', 'water_temperature', 'barometric_pressure_qfe', 'humidity', 'windchill']
 
 
@@ -74,7 +83,9 @@ def before_request():
     Checks if the service is ready to serve requests
     Returns: Redirect to loading page if service is not ready
     """
-    if not service_ready:
+    if not service_ready and request.path != "/api/status":
+        if request.path.startswith("/api/"):
+            return jsonify(error="Service is not ready"), 503
         return render_template(loading_template)
 
 
@@ -86,19 +97,93 @@ def index():
 
 @app.route("/weatherstation/<station>")
 def weatherstation_station(station):
-    # Dashboard data (Current weather)
-    weather_data = pd.DataFrame()
-    try:
-        weather_query = wr.WeatherQuery(station=station)
-        weather_data = wr.run_query(weather_query)
+    if station not in wr.get_stations():
+        abort(404)
+
+    # The current weather and the predictions only change with new data, they are rendered once per data version
+    fragments = fragment_cache.get(station, get_fragment_key(station), lambda: render_station_fragments(station))
 
-        if weather_data is None:
-            weather_data = pd.DataFrame()
+    return render_template(index_template, subpage="station", station=station, plot_list=get_shuffled_plots(),
+                           station_list=wr.get_stations(), status=get_sanitized_service_status(),
+                           refresh_interval=default_refresh_interval, fragments=fragments,
+                           server_side_rendering=plt.server_side_rendering,
+                           event_stream_port=event_stream.port if event_stream is not None else None)
+
+
+def get_fragment_key(station):
+    """
+    Returns the key of all inputs of the data-dependent fragments of the station page: the last entry (watermark) of
+    the station, the id of the prediction snapshot and the service status.
+    """
+    snapshot = wr.get_latest_snapshot(station)
+    watermark = snapshot.watermark if snapshot is not None else None
+    return watermark, pred.get_prediction_snapshot_id(station), tuple(get_sanitized_service_status())
+
+
+def render_station_fragments(station):
+    """
+    Renders the data-dependent fragments of the station page (current weather and predictions).
+    Args:
+        station: The station
+
+    Returns: Dictionary with the fragment name as key and the rendered HTML as value and whether the fragments are
+    complete. Fragments without the current weather or the predictions must not be cached.
+    """
+    current_data = get_current_data(station)
+    prediction_data = get_prediction_data(station)
+
+    fragments = {
+        "current": Markup(render_template("current.html", current_list=current_data or {})),
+        "prediction": Markup(render_template("prediction.html", prediction=prediction_data or []))
+    }
+    return fragments, current_data is not None and prediction_data is not None
+
+
+def get_current_data(station):
+    """
+    Returns the current weather of the station, served from the snapshot of the latest measurement.
+    Args:
+        station: The station
+
+    Returns: Dictionary with the variable as key and its name, rounded value and unit as value or None if the
+    snapshot is not available.
+    """
+    try:
+        snapshot = wr.get_latest_snapshot(station)
     except Exception as e:
         logger.error(f"Error while loading dashboard data: {e}")
+        return None
 
-    # Prediction data
-    prediction_data = []
+    if snapshot is None:
+        return None
+
+    current_data = {}
+    for variable in show_current:
+        current_data[variable] = {
+                                    "name": variable.replace("_", " ").title(),
+                                    "value": snapshot.values.get(variable, None),
+                                    "unit": wr.get_unit(variable)
+                                 }
+
+        # Round all numbers to 2 decimal places
+        if isinstance(current_data[variable]["value"], float):
+            current_data[variable]["value"] = round(current_data[variable]["value"], 2)
+        elif current_data[variable]["value"] is None:
+            current_data[variable]["value"] = "-"
+
+    return current_data
+
+
+def get_prediction_data(station):
+    """
+    Returns the predictions of the station with the datetime of the first entry (the latest measurement) formatted
+    for the template.
+    Args:
+        station: The station
+
+    Returns: A list of dictionaries with the label as key and the wind speed and wind direction as value or None if
+    the predictions are not available.
+    """
     try:
         prediction_data = pred.get_predictions(station)
 
@@ -107,28 +192,162 @@ def weatherstation_station(station):
 
     except Exception as e:
         logger.error(f"Error while loading prediction data: {e}")
+        return None
+
+    return prediction_data
+
+
+def publish_station_update(station, data):
+    """
+    Data listener pushing the new current weather and predictions of the station to the connected dashboards.
+    Registered after the prediction listener, so the predictions are already updated.
+    """
+    current_data = get_current_data(station)
+    if current_data is not None:
+        event_stream.publish(station, "measurement", {
+            "values": {variable: current_data[variable]["value"] for variable in current_data},
+            "status": get_sanitized_service_status()
+        })
+
+    prediction_data = get_prediction_data(station)
+    if prediction_data is not None:
+        predictions = [{"label": label, "wind_speed": to_json_number(value[0]),
+                        "wind_direction": to_json_number(value[1])}
+                       for entry in prediction_data for label, value in entry.items()]
+        event_stream.publish(station, "prediction", {"predictions": predictions})
+
+
+def to_json_number(value):
+    """
+    Returns: The value as float or None if it is missing, JSON has no NaN.
+    """
+    value = float(value)
+    return None if math.isnan(value) else value
+
+
+def publish_plot_update(station, plot_type, version):
+    """
+    Plot listener pushing the new version of a plot to the connected dashboards.
+    """
+    event_stream.publish(station, "plot", {"plot_type": plot_type, "version": version})
+
+
+def get_event_stream_stats():
+    """
+    Returns: A dictionary with the number of connections, the number of events and the fan-out latency of the event
+    stream.
+    """
+    return event_stream.get_stats() if event_stream is not None else {}
+
+
+def get_fragment_cache_stats():
+    """
+    Returns: A dictionary with the hits, misses, hit rate and render times of the fragment cache.
+    """
+    return fragment_cache.get_stats()
 
-    current_data = {}
-    if weather_data is not None and not weather_data.empty:
-        for variable in show_current:
-            current_data[variable] = {
-                                        "name": variable.replace("_", " ").title(),
-                                        "value": weather_data[variable].iloc[-1],
-                                        "unit": wr.get_unit(variable)
-                                     }
-
-            # Round all numbers to 2 decimal places
-            if isinstance(current_data[variable]["value"], float):
-                current_data[variable]["value"] = round(current_data[variable]["value"], 2)
-
-    return render_template(index_template, subpage="station", station=station, plot_list=get_shuffled_plots(), data=weather_data,
-                           prediction=prediction_data, station_list=wr.get_stations(), status=get_sanitized_service_status(),
-                           refresh_interval=default_refresh_interval, current_list=current_data)
 
 @app.route("/weatherstation/<station>/plots/<plot_type>")
 def weatherstation_station_plots(station, plot_type):
     return render_template(index_template, subpage="plot", station=station, plot_list=get_shuffled_plots(), station_list=wr.get_stations(), status=get_sanitized_service_status(),
-                           refresh_interval=default_refresh_interval, plot_type=plot_type)
+                           refresh_interval=default_refresh_interval, plot_type=plot_type,
+                           server_side_rendering=plt.server_side_rendering)
+
+
+@app.route("/api/status")
+def api_status():
+    """
+    Returns the status of the service as JSON, also while the service is starting.
+    Contains whether the service is ready and live, the time of the last fetch, the state of the circuit breakers
+    of the upstream endpoints, the ingest lag of every station in seconds, the statistics of the query cache, the
+    fragment cache and the event stream, the last render time of every plot in seconds and the version and load time
+    of the prediction model.
+    """
+    is_live, last_fetch = ServiceStatus.get_status()
+    return jsonify(ready=service_ready,
+                   live=is_live,
+                   last_fetch=last_fetch.isoformat() if last_fetch is not None else None,
+                   breakers=ServiceStatus.get_breaker_states(),
+                   ingest_lag=ServiceStatus.get_ingest_lag(),
+                   query_cache=wr.get_query_cache_stats(),
+                   fragment_cache=get_fragment_cache_stats(),
+                   event_stream=get_event_stream_stats(),
+                   render_times=plt.get_render_times(),
+                   model=pred.get_model_info())
+
+
+@app.route("/api/stations/<station>/latest")
+def api_station_latest(station):
+    """
+    Returns the latest measurement of a station as compact JSON.
+    The ETag changes only when new data of the station arrives, polling clients receive 304 Not Modified otherwise.
+    """
+    snapshot = wr.get_latest_snapshot(station)
+    if snapshot is None:
+        return jsonify(error=f"No data for station {station}"), 404
+
+    return http_cache.create_response({"identity": snapshot.content}, "application/json", snapshot.etag)
+
+
+@app.route("/api/stations/latest")
+def api_stations_latest():
+    """
+    Returns the latest measurements of multiple stations as compact JSON.
+    The stations can be selected with the query parameter stations (comma separated), all stations are returned
+    otherwise. The ETag combines the ETags of the station snapshots.
+    """
+    stations = request.args.get("stations", None)
+    stations = stations.split(",") if stations else wr.get_stations()
+
+    snapshots = [wr.get_latest_snapshot(station) for station in stations]
+    if any(snapshot is None for snapshot in snapshots):
+        return jsonify(error="No data for one of the stations"), 404
+
+    content = b"[" + b",".join(snapshot.content for snapshot in snapshots) + b"]"
+    etag = http_cache.create_etag("/".join(snapshot.etag for snapshot in snapshots).encode())
+    return http_cache.create_response({"identity": content}, "application/json", etag)
+
+
+@app.route("/plots/<station>/<plot_type>.svg")
+def plot_file(station, plot_type):
+    """
+    Serves the rendered SVG of a plot. The precompressed brotli or gzip variant is sent if the client accepts it.
+    Supports strong ETags derived from the content (304 Not Modified).
+    """
+    svg = plt.get_plot_file(station, plot_type)
+    if svg is None:
+        return jsonify(error=f"Plot {plot_type} of station {station} not found"), 404
+
+    return http_cache.create_response(svg["variants"], "image/svg+xml", svg["etag"])
+
+
+@app.route("/api/stations/<station>/plots/<plot_type>")
+def api_station_plot(station, plot_type):
+    """
+    Returns the Plotly figure JSON of a plot for client-side rendering.
+    Supports ETags (304 Not Modified) and gzip compression.
+    """
+    figure = plt.get_plot_figure(station, plot_type)
+    if figure is None:
+        return jsonify(error=f"Plot {plot_type} of station {station} not found"), 404
+
+    return http_cache.create_response(figure["variants"], "application/json", figure["etag"])
+
+
+@app.route("/api/plotly.min.js")
+def plotly_js():
+    """
+    Serves the plotly.js bundle of the installed Plotly version for client-side rendering.
+    """
+    global plotly_js_bundle
+    if plotly_js_bundle is None:
+        from plotly.offline import get_plotlyjs
+
+        content = get_plotlyjs().encode()
+        plotly_js_bundle = {"etag": http_cache.create_etag(content), "variants": http_cache.compress(content)}
+
+    return http_cache.create_response(plotly_js_bundle["variants"], "application/javascript",
+                                      plotly_js_bundle["etag"], max_age=86400)
 
 def job_watcher():
     logger.info("Checking for pending jobs...")
@@ -160,6 +379,13 @@ if __name__ == '__main__':
         pred.init()
         logger.debug("Prediction initialized.")
 
+        # Push new data to the dashboards
+        event_stream = EventStream(stations=wr.get_stations(), port=event_stream_port)
+        event_stream.start()
+        wd.add_data_listener(wr.config, publish_station_update)
+        plt.add_plot_listener(publish_plot_update)
+        logger.debug("Event stream started.")
+
         # Plotting
         plt.init()
         logger.debug("Plotting initialized.")
@@ -0,0 +1,239 @@
+"""Backtesting of the prediction model
+
+Replays historical measurements through the recursive forecast of
+prediction.py and reports the mean absolute error per station, variable and
+horizon together with the inference throughput.
+
+Usage (from the src directory):
+
+    python backtest.py --csv ./csv/messwerte_mythenquai.csv ./csv/messwerte_tiefenbrunnen.csv
+    python backtest.py --csv ./measurements.csv --station mythenquai
+    python backtest.py --influx --days 30
+
+Every start time needs the measurement at the start time (the features) and
+the measurements of the following horizon steps (the targets), so a station
+needs at least horizon + 1 consecutive measurements.
+
+The model can be swapped with --model to compare accuracy and inference cost.
+"""
+
+import argparse
+import logging
+import os
+import re
+import time
+
+import numpy as np
+import pandas as pd
+
+import prediction
+from model_registry import ModelRegistry
+
+logger = logging.getLogger("app")
+
+interval = pd.Timedelta(minutes=10)
+# Measurements used as features and targets of the forecast
+columns = ['air_temperature', 'wind_speed_avg_10min', 'wind_direction']
+# Predicted variables in the order of the model output
+variables = ['wind_speed_avg_10min', 'wind_direction']
+
+
+def load_csv(file_name, station=None):
+    """
+    Loads the measurements of a CSV file in the format of the open data portal (see csv_import.py).
+    Args:
+        file_name: The CSV file.
+        station: The station of the measurements. If None, the station is taken from a 'station' column or from the
+            file name (messwerte_<station>*.csv).
+
+    Returns: A dictionary with the station as key and a DataFrame with a UTC DatetimeIndex as value.
+    """
+    data = pd.read_csv(file_name, encoding='utf-8-sig', na_values=['.', ''])
+    data.index = pd.to_datetime(data['timestamp_utc'], utc=True)
+
+    if station is None and 'station' not in data.columns:
+        match = re.match(r'messwerte_([a-z]+)', os.path.basename(file_name))
+        if match is None:
+            raise ValueError(f"Station of {file_name} unknown, pass it with --station")
+        station = match.group(1)
+
+    if station is not None:
+        return {station: data[columns]}
+
+    return {name: group[columns] for name, group in data.groupby('station')}
+
+
+def load_influx(config, stations, start_time, stop_time):
+    """
+    Loads the measurements of the stations from InfluxDB.
+    Args:
+        config: The Config containing the DB connection info.
+        stations: The stations to load.
+        start_time: The start of the time range (UTC).
+        stop_time: The stop of the time range (UTC).
+
+    Returns: A dictionary with the station as key and a DataFrame with a UTC DatetimeIndex as value.
+    """
+    import weather_data as wd
+    import weather_repository as wr
+
+    measurements = [wr.Measurement(column) for column in columns]
+    datasets = {}
+    for station in stations:
+        query = wr.WeatherQuery(station, measurements, start_time, stop_time)
+        data = wd.execute_query(config=config, station=station, query_string=query.create_query_string())
+        if data is not None and not data.empty:
+            datasets[station] = data[columns]
+
+    return datasets
+
+
+def create_samples(station, data, horizon_steps, max_start_times=None):
+    """
+    Creates the feature matrix and the observed targets for all start times of a station.
+    Args:
+        station: The station.
+        data: DataFrame with a UTC DatetimeIndex and the columns of the backtest.
+        horizon_steps: The number of 10 minute steps which are predicted.
+        max_start_times: The maximum number of start times. The start times are spread evenly over the data.
+
+    Returns: The features of shape (start times, len(prediction.feature_columns)) and the targets of shape
+    (start times, horizon_steps, 2). Missing targets are NaN.
+    """
+    if data.empty:
+        return np.empty((0, len(prediction.feature_columns))), np.empty((0, horizon_steps, 2))
+
+    data = data[~data.index.duplicated(keep='last')].sort_index()
+    data = data.reindex(pd.date_range(data.index[0].floor(interval), data.index[-1], freq=interval))
+    values = data[columns].to_numpy(dtype=np.float64)
+
+    starts = np.arange(len(data) - horizon_steps)
+    starts = starts[~np.isnan(values[starts]).any(axis=1)]
+    if max_start_times is not None and len(starts) > max_start_times:
+        starts = starts[np.linspace(0, len(starts) - 1, max_start_times).astype(int)]
+
+    times = data.index[starts]
+    features = np.column_stack([
+        np.full(len(starts), 0 if station == 'mythenquai' else 1),
+        values[starts, 0], values[starts, 1], values[starts, 2],
+        times.day, times.month, times.year
+    ]).astype(np.float64)
+
+    steps = starts[:, None] + np.arange(1, horizon_steps + 1)
+    targets = values[steps][:, :, 1:]
+
+    return features, targets
+
+
+def absolute_errors(predictions, targets):
+    """
+    Returns the absolute errors of the predictions. The error of the wind direction is the smallest angle between the
+    predicted and the observed direction.
+    """
+    errors = np.abs(predictions - targets)
+    errors[..., 1] = np.minimum(errors[..., 1] % 360, 360 - errors[..., 1] % 360)
+    return errors
+
+
+def run_backtest(datasets, horizon_steps=6, max_start_times=5000, batch_size=1024):
+    """
+    Runs the recursive forecast for all start times of all stations in batches.
+    Args:
+        datasets: Dictionary with the station as key and the measurements as value, see load_csv.
+        horizon_steps: The number of 10 minute steps which are predicted.
+        max_start_times: The maximum number of start times per station.
+        batch_size: The number of start times predicted with one model call per step.
+
+    Returns: A DataFrame with the MAE and the number of compared values per station, variable and horizon (minutes)
+    and a dictionary with the number of predictions, the inference time in seconds and the predictions per second.
+    Raises: ValueError if no station has a start time, i.e. horizon_steps + 1 consecutive measurements.
+    """
+    results = []
+    predictions_count = 0
+    inference_time = 0.0
+
+    for station, data in datasets.items():
+        features, targets = create_samples(station, data, horizon_steps, max_start_times)
+        if len(features) == 0:
+            logger.warning(f"No start times for {station}, at least {horizon_steps + 1} consecutive measurements "
+                           f"are needed")
+            continue
+
+        predictions = np.empty_like(targets)
+        for start in range(0, len(features), batch_size):
+            started = time.perf_counter()
+            predictions[start:start + batch_size] = prediction.predict_batch(features[start:start + batch_size],
+                                                                             horizon_steps)
+            inference_time += time.perf_counter() - started
+
+        predictions_count += len(features) * horizon_steps
+        errors = absolute_errors(predictions, targets)
+
+        for v, variable in enumerate(variables):
+            for step in range(horizon_steps):
+                step_errors = errors[:, step, v]
+                step_errors = step_errors[~np.isnan(step_errors)]
+                results.append({
+                    "station": station,
+                    "variable": variable,
+                    "horizon": (step + 1) * int(interval.total_seconds() // 60),
+                    "mae": step_errors.mean() if len(step_errors) > 0 else np.nan,
+                    "count": len(step_errors)
+                })
+
+    if not results:
+        raise ValueError(f"No start times found, the backtest needs at least {horizon_steps + 1} consecutive "
+                         f"measurements at {int(interval.total_seconds() // 60)} minute intervals per station")
+
+    stats = {
+        "predictions": predictions_count,
+        "seconds": inference_time,
+        "predictions_per_second": predictions_count / inference_time if inference_time > 0 else 0.0
+    }
+
+    return pd.DataFrame(results, columns=["station", "variable", "horizon", "mae", "count"]), stats
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format="[%(asctime)s] - [%(levelname)s] : %(message)s")
+
+    parser = argparse.ArgumentParser(description="Backtest the prediction model on historical measurements.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--csv", nargs="+", help="CSV files with the historical measurements.")
+    source.add_argument("--influx", action="store_true", help="Load the historical measurements from InfluxDB.")
+    parser.add_argument("--station", help="Station of the CSV files (default: from the file name).")
+    parser.add_argument("--days", type=int, default=30, help="Days of history loaded from InfluxDB (default: 30).")
+    parser.add_argument("--model", default="./weather_model.pkl", help="The pickled model (default: ./weather_model.pkl).")
+    parser.add_argument("--horizon", type=int, default=prediction.prediction_horizon_steps,
+                        help="Number of 10 minute steps to predict.")
+    parser.add_argument("--start-times", type=int, default=5000, help="Maximum number of start times per station.")
+    parser.add_argument("--batch-size", type=int, default=1024, help="Start times per model call.")
+    args = parser.parse_args()
+
+    prediction.model_registry = ModelRegistry(args.model)
+    prediction.model_registry.get()
+
+    if args.csv:
+        datasets = {}
+        for file_name in args.csv:
+            datasets.update(load_csv(file_name, args.station))
+    else:
+        import weather_data as wd
+
+        config = wd.Config()
+        config.db_host = os.environ.get("INFLUXDB_HOST", config.db_host)
+        config.db_port = int(os.environ.get("INFLUXDB_PORT", config.db_port))
+        wd.connect_db(config)
+        stop_time = pd.Timestamp.now("UTC")
+        datasets = load_influx(config, config.stations, stop_time - pd.Timedelta(days=args.days), stop_time)
+
+    try:
+        results, stats = run_backtest(datasets, args.horizon, args.start_times, args.batch_size)
+    except ValueError as e:
+        parser.error(str(e))
+
+    with pd.option_context("display.max_rows", None):
+        print(results.pivot_table(index=["station", "variable"], columns="horizon", values="mae").round(3))
+    print(f"Model version: {prediction.get_model_info()['version']}")
+    print(f"{stats['predictions']} predictions in {stats['seconds']:.2f}s "
+          f"({stats['predictions_per_second']:.0f} predictions/s)")
@@ -0,0 +1,292 @@
+import hashlib
+import json
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger("app")
+
+# Layout of the messwerte_<station>.csv files provided by data.stadt-zuerich.ch
+timestamp_column = 'timestamp_utc'
+timestamp_format = '%Y-%m-%dT%H:%M:%S%z'
+ignored_columns = ['timestamp_cet']
+na_values = ['.', '']
+
+# Number of bytes at the start of the file and before the checkpoint offset used for the fingerprint
+fingerprint_block_size = 65536
+
+
+def read_header(file_name):
+    """
+    Reads the column names of the given CSV file.
+    Args:
+        file_name: Path to the CSV file.
+
+    Returns: The list of column names.
+    """
+    with open(file_name, 'r', encoding='utf-8-sig') as f:
+        return f.readline().strip().split(',')
+
+
+def read_chunks(file_name, chunksize, columns=None):
+    """
+    Parses the given CSV file chunk-wise with explicit dtypes, NA tokens and a fixed timestamp format.
+    Missing values (represented as '.' or an empty cell) are parsed as NaN.
+    Args:
+        file_name: Path to the CSV file or an open file object.
+        chunksize: The number of rows per chunk.
+        columns: The column names of the file. Required if the file object does not start with the header.
+
+    Returns: A generator of DataFrames with a UTC DatetimeIndex and float64 columns.
+    """
+    if columns is None:
+        columns = read_header(file_name)
+
+    time_column = timestamp_column if timestamp_column in columns else 'timestamp'
+    field_columns = [column for column in columns if column != time_column and column not in ignored_columns]
+    dtypes = {column: np.float64 for column in field_columns}
+    dtypes[time_column] = object
+
+    # Paths start with the header, open file objects are positioned behind it
+    header_rows = 1 if isinstance(file_name, str) else 0
+    reader = pd.read_csv(file_name, delimiter=',', encoding='utf-8-sig', header=None, names=columns,
+                         skiprows=header_rows, usecols=[time_column] + field_columns, dtype=dtypes, na_values=na_values,
+                         keep_default_na=False, chunksize=chunksize)
+
+    for chunk in reader:
+        index = pd.to_datetime(chunk[time_column], format=timestamp_format, utc=True)
+        data = chunk[field_columns]
+        data.index = pd.DatetimeIndex(index, name='timestamp')
+        yield data
+
+
+def to_line_protocol(data, measurement):
+    """
+    Converts a DataFrame to InfluxDB line protocol. NaN values are omitted, rows without any value are dropped.
+    Args:
+        data: DataFrame with a UTC DatetimeIndex and float64 columns.
+        measurement: The name of the measurement (station) to write to.
+
+    Returns: A pandas Series of line protocol strings with second precision.
+    """
+    fields = pd.Series('', index=np.arange(len(data)), dtype=object)
+    for column in data.columns:
+        values = data[column].to_numpy(dtype=np.float64)
+        field = pd.Series(values.astype(str), dtype=object)
+        field = (column + '=' + field + ',').where(~np.isnan(values), '')
+        fields = fields + field
+
+    seconds = data.index.to_numpy(dtype='datetime64[ns]').astype('datetime64[s]').astype(np.int64)
+    lines = measurement + ' ' + fields.str[:-1] + ' ' + pd.Series(seconds.astype(str), dtype=object)
+
+    return lines[fields != '']
+
+
+def write_lines(config, lines):
+    """
+    Writes line protocol strings to the database in batches of config.historic_data_batchsize.
+    Args:
+        config: The Config containing the DB connection info.
+        lines: A list of line protocol strings.
+
+    Returns: None
+    """
+    for start in range(0, len(lines), config.historic_data_batchsize):
+        config.client.write(lines[start:start + config.historic_data_batchsize],
+                            params={'db': config.db_name, 'precision': 's'}, protocol='line')
+
+
+def fingerprint(file_name, offset):
+    """
+    Creates a fingerprint of the content of the given file up to the given byte offset.
+    The fingerprint hashes the start of the file and the block in front of the offset, which identifies the
+    yearly CSV file as long as new rows are only appended.
+    Args:
+        file_name: Path to the CSV file.
+        offset: The byte offset up to which the file is fingerprinted.
+
+    Returns: The fingerprint as hex string.
+    """
+    digest = hashlib.sha256(str(offset).encode())
+    with open(file_name, 'rb') as f:
+        digest.update(f.read(min(offset, fingerprint_block_size)))
+        f.seek(max(0, offset - fingerprint_block_size))
+        digest.update(f.read(min(offset, fingerprint_block_size)))
+
+    return digest.hexdigest()
+
+
+def complete_lines_offset(file_name):
+    """
+    Returns the byte offset behind the last complete line (terminated by a newline) of the given file.
+    Args:
+        file_name: Path to the CSV file.
+
+    Returns: The byte offset.
+    """
+    size = os.path.getsize(file_name)
+    with open(file_name, 'rb') as f:
+        position = size
+        while position > 0:
+            start = max(0, position - fingerprint_block_size)
+            f.seek(start)
+            block = f.read(position - start)
+            newline = block.rfind(b'\n')
+            if newline >= 0:
+                return start + newline + 1
+            position = start
+
+    return 0
+
+
+def load_checkpoints(checkpoint_file):
+    """
+    Loads the import checkpoints of all stations.
+    Args:
+        checkpoint_file: Path to the JSON file holding the checkpoints.
+
+    Returns: A dictionary with the station as key and the checkpoint as value.
+    """
+    try:
+        with open(checkpoint_file, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_checkpoint(checkpoint_file, station, checkpoint):
+    """
+    Saves the import checkpoint of a station. The file is replaced atomically.
+    Args:
+        checkpoint_file: Path to the JSON file holding the checkpoints.
+        station: The station the checkpoint belongs to.
+        checkpoint: The checkpoint containing the last imported timestamp, the file fingerprint and the byte offset.
+
+    Returns: None
+    """
+    checkpoints = load_checkpoints(checkpoint_file)
+    checkpoints[station] = checkpoint
+
+    os.makedirs(os.path.dirname(checkpoint_file) or '.', exist_ok=True)
+    temp_file = checkpoint_file + '.tmp'
+    with open(temp_file, 'w') as f:
+        json.dump(checkpoints, f, indent=2)
+    os.replace(temp_file, checkpoint_file)
+
+
+def get_valid_checkpoint(config, station, file_name, last_db_time):
+    """
+    Returns the checkpoint of the station if it still applies to the given file and database.
+    A checkpoint applies if the file content up to its offset is unchanged and the database holds data at least up
+    to its last imported timestamp.
+    Args:
+        config: The Config containing the checkpoint file location.
+        station: The station to get the checkpoint for.
+        file_name: Path to the CSV file.
+        last_db_time: Time of the last entry in the database (naive UTC) or None if there is no data.
+
+    Returns: The checkpoint or None.
+    """
+    checkpoint = load_checkpoints(config.historic_data_checkpoint_file).get(station, None)
+    if checkpoint is None or last_db_time is None:
+        return None
+
+    try:
+        last_timestamp = pd.Timestamp(checkpoint['last_timestamp']).tz_convert(None)
+        if last_timestamp > pd.Timestamp(last_db_time):
+            return None
+        if checkpoint['offset'] > os.path.getsize(file_name):
+            return None
+        if fingerprint(file_name, checkpoint['offset']) != checkpoint['fingerprint']:
+            return None
+    except (KeyError, TypeError, ValueError):
+        return None
+
+    return checkpoint
+
+
+def is_imported(config, station, file_name, last_db_time):
+    """
+    Checks if all complete lines of the given file were imported according to a valid checkpoint.
+    Args:
+        config: The Config containing the checkpoint file location.
+        station: The station the file belongs to.
+        file_name: Path to the CSV file.
+        last_db_time: Time of the last entry in the database (naive UTC) or None if there is no data.
+
+    Returns: True if there are no rows left to import.
+    """
+    checkpoint = get_valid_checkpoint(config, station, file_name, last_db_time)
+    return checkpoint is not None and checkpoint['offset'] >= complete_lines_offset(file_name)
+
+
+def import_csv_file(config, station, file_name, last_db_time=None, on_write=None):
+    """
+    Imports a CSV file into the database by converting whole chunks straight to line protocol.
+    If a valid checkpoint exists for the station, the rows that were already imported are skipped by seeking past
+    the checkpoint offset. A new checkpoint is saved after the import.
+    Args:
+        config: The Config containing the DB connection info.
+        station: The station (measurement) to write to.
+        file_name: Path to the CSV file.
+        last_db_time: Time of the last entry of the station in the database (naive UTC) or None.
+        on_write: Optional function called with the DataFrame of each written batch.
+
+    Returns: A tuple of the number of imported rows and the last imported row as DataFrame (or None).
+    """
+    rows = 0
+    last_entry = None
+    pending = []
+    pending_frames = []
+
+    def flush():
+        write_lines(config, pending)
+        if on_write is not None and pending_frames:
+            on_write(pd.concat(pending_frames))
+        pending.clear()
+        pending_frames.clear()
+
+    columns = read_header(file_name)
+    end_offset = complete_lines_offset(file_name)
+    checkpoint = get_valid_checkpoint(config, station, file_name, last_db_time)
+
+    if checkpoint is not None and checkpoint['offset'] >= end_offset:
+        logger.debug(f'CSV file of {station} has no new rows since the last import.')
+        return rows, last_entry
+
+    with open(file_name, 'rb') as f:
+        if checkpoint is not None:
+            logger.debug(f"Resume import of {station} after {checkpoint['last_timestamp']}")
+            f.seek(checkpoint['offset'])
+            chunks = read_chunks(f, config.historic_data_chunksize, columns=columns)
+        else:
+            chunks = read_chunks(file_name, config.historic_data_chunksize, columns=columns)
+
+        for data in chunks:
+            if checkpoint is not None:
+                data = data[data.index > pd.Timestamp(checkpoint['last_timestamp'])]
+            if data.empty:
+                continue
+
+            lines = to_line_protocol(data, station)
+            pending.extend(lines.tolist())
+            pending_frames.append(data)
+            rows += len(lines)
+            last_entry = data.tail(1)
+            logger.debug('Add ' + station + ' from ' + str(data.index[0]) + ' to ' + str(data.index[-1]))
+
+            if len(pending) >= config.historic_data_batchsize:
+                flush()
+
+    flush()
+
+    if last_entry is not None:
+        save_checkpoint(config.historic_data_checkpoint_file, station, {
+            'last_timestamp': last_entry.index[-1].isoformat(),
+            'fingerprint': fingerprint(file_name, end_offset),
+            'offset': end_offset
+        })
+
+    return rows, last_entry
@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+
+
+def lttb_indices(x, y, threshold):
+    """
+    Selects the points of a series with the Largest-Triangle-Three-Buckets algorithm.
+
+    The first and the last point are always kept. The points in between are split into threshold - 2 buckets and of
+    each bucket the point forming the largest triangle with the previously selected point and the average of the next
+    bucket is kept. This preserves peaks and the visual shape of the series.
+    Args:
+        x: The x values as array of numbers in ascending order.
+        y: The y values as array of numbers without NaN.
+        threshold: The number of points to keep.
+
+    Returns: The indices of the selected points in ascending order.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    # Boundaries of the buckets between the first and the last point
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+
+    # Average of each bucket, the average of the bucket after the last one is the last point
+    sums_x = np.add.reduceat(x[1:n - 1], edges[:-1] - 1)
+    sums_y = np.add.reduceat(y[1:n - 1], edges[:-1] - 1)
+    counts = np.diff(edges)
+    averages_x = np.append(sums_x[1:] / counts[1:], x[n - 1])
+    averages_y = np.append(sums_y[1:] / counts[1:], y[n - 1])
+
+    indices = np.empty(threshold, dtype=np.int64)
+    indices[0] = 0
+    indices[-1] = n - 1
+
+    a = 0
+    for bucket in range(threshold - 2):
+        start, stop = edges[bucket], edges[bucket + 1]
+        areas = np.abs((x[a] - averages_x[bucket]) * (y[start:stop] - y[a])
+                       - (x[a] - x[start:stop]) * (averages_y[bucket] - y[a]))
+        a = start + int(np.argmax(areas))
+        indices[bucket + 1] = a
+
+    return indices
+
+
+def downsample_series(series, threshold):
+    """
+    Downsamples a series with a DatetimeIndex to at most threshold points with LTTB. Series within the threshold are
+    returned unchanged, otherwise missing values are dropped before downsampling.
+    Args:
+        series: The series to downsample.
+        threshold: The maximum number of points (point budget).
+
+    Returns: The downsampled series.
+    """
+    if threshold is None or len(series) <= threshold:
+        return series
+
+    series = series.dropna()
+    if len(series) <= threshold:
+        return series
+
+    x = pd.DatetimeIndex(series.index).asi8
+    return series.iloc[lttb_indices(x, series.to_numpy(dtype=np.float64), threshold)]
@@ -0,0 +1,318 @@
+import json
+import logging
+import re
+import selectors
+import socket
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger("app")
+
+request_pattern = re.compile(r"^GET /stations/([A-Za-z0-9_-]+)/events(?:\?\S*)? HTTP/1\.[01]$")
+
+
+class _Client:
+    def __init__(self, sock):
+        self.sock = sock
+        self.station = None
+        self.request = bytearray()
+        self.output = bytearray()
+        self.writing = False
+        self.connected_at = time.monotonic()
+
+
+def format_event(event, data):
+    """
+    Formats an event in the Server-Sent Events format.
+    Args:
+        event: The name of the event.
+        data: The data of the event, serialized to compact JSON.
+
+    Returns: The event as bytes.
+    """
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n".encode()
+
+
+class EventStream:
+    """
+    Server-Sent Events server pushing station updates to the dashboards.
+
+    All connections are served by a single thread with a selector, idle clients do not need a thread each. Clients
+    subscribe to a station with GET /stations/<station>/events. Events are published from any thread with publish(),
+    the server thread writes them to the buffers of all subscribers of the station. Clients which do not read their
+    events and exceed max_buffer_size or fail are disconnected. After an unexpected error the loop is restarted, the
+    other connections stay open.
+    """
+
+    def __init__(self, stations, host="0.0.0.0", port=6541, heartbeat_interval=15, max_buffer_size=1024 * 1024,
+                 allowed_origin="*", retry=5000):
+        self.stations = set(stations)
+        self.host = host
+        self.port = port
+        self.heartbeat_interval = heartbeat_interval
+        self.max_buffer_size = max_buffer_size
+        self.allowed_origin = allowed_origin
+        self.retry = retry
+        self.clients = {}
+        self.pending = deque()
+        self.lock = threading.Lock()
+        self.selector = None
+        self.server = None
+        self.wakeup = None
+        self.thread = None
+        self.running = False
+        self.events = 0
+        self.fan_out_seconds = 0.0
+        self.max_fan_out_seconds = 0.0
+        self.restarts = 0
+        self.restart_delay = 1
+
+    def start(self):
+        """
+        Binds the server socket and starts the server thread.
+        Returns: None
+        """
+        self.server = socket.create_server((self.host, self.port))
+        self.server.setblocking(False)
+        self.port = self.server.getsockname()[1]
+        self.wakeup = socket.socketpair()
+        for sock in self.wakeup:
+            sock.setblocking(False)
+
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.server, selectors.EVENT_READ, "server")
+        self.selector.register(self.wakeup[0], selectors.EVENT_READ, "wakeup")
+
+        self.running = True
+        self.thread = threading.Thread(target=self.__run, name="EventStream", daemon=True)
+        self.thread.start()
+        logger.info(f"Event stream listening on port {self.port}.")
+
+    def stop(self):
+        """
+        Stops the server thread and closes all connections.
+        Returns: None
+        """
+        self.running = False
+        self.__wake()
+        if self.thread is not None:
+            self.thread.join(5)
+
+    def publish(self, station, event, data):
+        """
+        Publishes an event to all subscribers of the station. Can be called from any thread.
+        Args:
+            station: The station.
+            event: The name of the event.
+            data: The JSON serializable data of the event.
+
+        Returns: None
+        """
+        with self.lock:
+            self.pending.append((station, format_event(event, data), time.perf_counter()))
+        self.__wake()
+
+    def get_stats(self):
+        """
+        Returns: A dictionary with the number of connections, the number of published events, the mean and maximum
+        fan-out latency (time from publish() until the event was handed to the sockets of all subscribers) in seconds
+        and the number of restarts of the server loop.
+        """
+        with self.lock:
+            return {
+                "connections": len(self.clients),
+                "events": self.events,
+                "mean_fan_out_seconds": self.fan_out_seconds / self.events if self.events > 0 else 0.0,
+                "max_fan_out_seconds": self.max_fan_out_seconds,
+                "restarts": self.restarts
+            }
+
+    def __wake(self):
+        if self.wakeup is None:
+            return
+        try:
+            self.wakeup[1].send(b"\0")
+        except (BlockingIOError, OSError):
+            # A pending wakeup is sufficient
+            pass
+
+    def __run(self):
+        try:
+            while self.running:
+                try:
+                    self.__serve()
+                except Exception as e:
+                    # The connections stay open, the loop is restarted after a short pause
+                    logger.error(f"Event stream failed, restarting: {e}")
+                    self.restarts += 1
+                    time.sleep(self.restart_delay)
+        finally:
+            for client in list(self.clients.values()):
+                self.__close(client)
+            self.selector.close()
+            self.server.close()
+            for sock in self.wakeup:
+                sock.close()
+
+    def __serve(self):
+        next_heartbeat = time.monotonic() + self.heartbeat_interval
+        while self.running:
+            for key, mask in self.selector.select(timeout=max(0.0, next_heartbeat - time.monotonic())):
+                if key.data == "server":
+                    self.__accept()
+                elif key.data == "wakeup":
+                    self.__drain_wakeup()
+                else:
+                    try:
+                        if mask & selectors.EVENT_READ:
+                            self.__read(key.data)
+                        if mask & selectors.EVENT_WRITE and key.data.sock in self.clients:
+                            self.__flush(key.data)
+                    except Exception as e:
+                        self.__drop(key.data, e)
+
+            self.__fan_out()
+
+            if time.monotonic() >= next_heartbeat:
+                # Keeps idle connections open and detects clients which disconnected silently
+                for client in self.__subscribers(None):
+                    self.__send(client, b": heartbeat\n\n")
+                self.__close_incomplete_requests()
+                next_heartbeat = time.monotonic() + self.heartbeat_interval
+
+    def __drop(self, client, error):
+        logger.warning(f"Event stream client of {client.station} failed, disconnecting: {error}")
+        self.__close(client)
+
+    def __accept(self):
+        try:
+            sock, _ = self.server.accept()
+        except (BlockingIOError, OSError):
+            return
+
+        sock.setblocking(False)
+        client = _Client(sock)
+        with self.lock:
+            self.clients[sock] = client
+        self.selector.register(sock, selectors.EVENT_READ, client)
+
+    def __drain_wakeup(self):
+        try:
+            while self.wakeup[0].recv(4096):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+
+    def __read(self, client):
+        try:
+            data = client.sock.recv(4096)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+
+        if not data:
+            self.__close(client)
+            return
+
+        if client.station is not None:
+            # Subscribers do not send anything after the request
+            return
+
+        client.request += data
+        if b"\r\n\r\n" not in client.request:
+            if len(client.request) > 8192:
+                self.__respond(client, "431 Request Header Fields Too Large")
+            return
+
+        request_line = client.request.split(b"\r\n", 1)[0].decode("latin-1")
+        match = request_pattern.match(request_line)
+        if match is None or match.group(1) not in self.stations:
+            self.__respond(client, "404 Not Found")
+            return
+
+        client.station = match.group(1)
+        client.request = bytearray()
+        self.__send(client, (f"HTTP/1.1 200 OK\r\n"
+                             f"Content-Type: text/event-stream\r\n"
+                             f"Cache-Control: no-cache\r\n"
+                             f"Connection: keep-alive\r\n"
+                             f"Access-Control-Allow-Origin: {self.allowed_origin}\r\n"
+                             f"\r\n"
+                             f"retry: {self.retry}\n\n").encode())
+
+    def __close_incomplete_requests(self):
+        expired = time.monotonic() - self.heartbeat_interval
+        with self.lock:
+            clients = [client for client in self.clients.values()
+                       if client.station is None and client.connected_at < expired]
+        for client in clients:
+            self.__respond(client, "408 Request Timeout")
+
+    def __respond(self, client, status):
+        try:
+            client.sock.send(f"HTTP/1.1 {status}\r\nContent-Length: 0\r\nConnection: close\r\n"
+                             f"Access-Control-Allow-Origin: {self.allowed_origin}\r\n\r\n".encode())
+        except OSError:
+            pass
+        self.__close(client)
+
+    def __fan_out(self):
+        while True:
+            with self.lock:
+                if not self.pending:
+                    return
+                station, message, published = self.pending.popleft()
+
+            for client in self.__subscribers(station):
+                self.__send(client, message)
+
+            seconds = time.perf_counter() - published
+            with self.lock:
+                self.events += 1
+                self.fan_out_seconds += seconds
+                self.max_fan_out_seconds = max(self.max_fan_out_seconds, seconds)
+
+    def __subscribers(self, station):
+        with self.lock:
+            clients = list(self.clients.values())
+        return [client for client in clients
+                if client.station is not None and (station is None or client.station == station)]
+
+    def __send(self, client, message):
+        try:
+            client.output += message
+            if len(client.output) > self.max_buffer_size:
+                logger.warning(f"Event stream client of {client.station} is too slow, disconnecting.")
+                self.__close(client)
+                return
+            self.__flush(client)
+        except Exception as e:
+            self.__drop(client, e)
+
+    def __flush(self, client):
+        try:
+            sent = client.sock.send(client.output)
+            del client.output[:sent]
+        except BlockingIOError:
+            pass
+        except OSError:
+            self.__close(client)
+            return
+
+        # Wait for the socket to become writable only while output is pending
+        writing = len(client.output) > 0
+        if writing != client.writing:
+            client.writing = writing
+            self.selector.modify(client.sock, selectors.EVENT_READ | (selectors.EVENT_WRITE if writing else 0), client)
+
+    def __close(self, client):
+        with self.lock:
+            if self.clients.pop(client.sock, None) is None:
+                return
+        try:
+            self.selector.unregister(client.sock)
+        except (KeyError, ValueError):
+            pass
+        client.sock.close()
@@ -0,0 +1,76 @@
+import threading
+import time
+
+
+class FragmentCache:
+    """
+    Cache for rendered HTML fragments of the dashboard.
+
+    Holds one entry per station. An entry is only valid for the key it was rendered with (e.g. the last entry of the
+    station and the id of the prediction snapshot), a different key renders the fragments again and replaces the entry.
+    Incomplete renderings (e.g. after a failed lookup) are not cached and rendered again on the next request.
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.render_seconds = 0.0
+        self.last_render_seconds = {}
+        self.lock = threading.Lock()
+
+    def get(self, station, key, render):
+        """
+        Returns the fragments of the station, rendering them only if the key changed.
+        Args:
+            station: The station.
+            key: Hashable key of all inputs of the fragments.
+            render: Function without arguments returning the fragments and whether they are complete. Called on a
+                cache miss.
+
+        Returns: The fragments as returned by render.
+        """
+        with self.lock:
+            entry = self.entries.get(station, None)
+            if entry is not None and entry[0] == key:
+                self.hits += 1
+                return entry[1]
+
+        started = time.perf_counter()
+        fragments, complete = render()
+        seconds = time.perf_counter() - started
+
+        with self.lock:
+            self.misses += 1
+            self.render_seconds += seconds
+            self.last_render_seconds[station] = seconds
+            if complete:
+                self.entries[station] = (key, fragments)
+            else:
+                self.entries.pop(station, None)
+
+        return fragments
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+            self.render_seconds = 0.0
+            self.last_render_seconds.clear()
+
+    def get_stats(self):
+        """
+        Returns: A dictionary with the number of hits, misses and entries, the hit rate, the mean render time of a miss
+        and the last render time per station in seconds.
+        """
+        with self.lock:
+            requests = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self.entries),
+                "hit_rate": self.hits / requests if requests > 0 else 0.0,
+                "mean_render_seconds": self.render_seconds / self.misses if self.misses > 0 else 0.0,
+                "last_render_seconds": dict(self.last_render_seconds)
+            }
@@ -0,0 +1,68 @@
+import gzip
+import hashlib
+
+from flask import Response, request
+
+try:
+    import brotli
+except ImportError:
+    # Brotli is installed with requirements.txt, without it (e.g. a local setup) only gzip is offered
+    brotli = None
+
+# Content encodings in order of preference
+encodings = ["br", "gzip"]
+# File extension of the precompressed variants of a file
+file_extensions = {"br": ".br", "gzip": ".gz"}
+
+
+def compress(content):
+    """
+    Creates the encoded variants of the given content.
+    Args:
+        content: The content as bytes.
+
+    Returns: A dictionary with the content encoding (identity, gzip and br if brotli is installed) as key and the
+    encoded content as value.
+    """
+    variants = {"identity": content, "gzip": gzip.compress(content, mtime=0)}
+    if brotli is not None:
+        variants["br"] = brotli.compress(content)
+    return variants
+
+
+def create_etag(content):
+    """
+    Returns: A strong ETag derived from the hash of the given content.
+    """
+    return hashlib.sha256(content).hexdigest()[:32]
+
+
+def create_response(variants, mimetype, etag, max_age=0):
+    """
+    Creates a response for the best content encoding accepted by the client. The response carries a strong ETag per
+    encoding and is answered with 304 Not Modified if it matches the If-None-Match header of the request.
+    Args:
+        variants: A dictionary with the content encoding as key and the encoded content as value. Has to contain the
+            identity encoding.
+        mimetype: The mimetype of the content.
+        etag: The ETag of the identity encoding.
+        max_age: Seconds the client may use the response without revalidating it.
+
+    Returns: The response.
+    """
+    encoding = next((encoding for encoding in encodings
+                     if encoding in variants and request.accept_encodings[encoding]), "identity")
+
+    response = Response(variants[encoding], mimetype=mimetype)
+    response.vary.add("Accept-Encoding")
+    if encoding != "identity":
+        response.content_encoding = encoding
+        etag = f"{etag}-{encoding}"
+    response.set_etag(etag)
+
+    if max_age > 0:
+        response.cache_control.max_age = max_age
+    else:
+        response.cache_control.no_cache = True
+
+    return response.make_conditional(request)
@@ -0,0 +1,124 @@
+from collections import deque
+from datetime import timedelta
+
+import numpy as np
+
+
+class PublishCadence:
+    """
+    Learns the publish cadence of a station from the observed measurement timestamps.
+
+    The interval is the median distance between consecutive measurements. The publish delay is the shortest observed
+    time between a measurement and the moment it was first seen in the API.
+    """
+
+    def __init__(self, default_interval=timedelta(minutes=10), history=12):
+        self.default_interval = default_interval
+        self.timestamps = deque(maxlen=history)
+        self.delays = deque(maxlen=history)
+
+    def observe(self, measurement_time, seen_time=None):
+        """
+        Adds an observed measurement.
+        Args:
+            measurement_time: The time of the newest measurement.
+            seen_time: The time the measurement was first seen or None if it is unknown (e.g. on startup).
+        """
+        if self.timestamps and measurement_time <= self.timestamps[-1]:
+            return
+
+        self.timestamps.append(measurement_time)
+        if seen_time is not None:
+            self.delays.append(max(timedelta(0), seen_time - measurement_time))
+
+    @property
+    def last_measurement(self):
+        return self.timestamps[-1] if self.timestamps else None
+
+    @property
+    def interval(self):
+        if len(self.timestamps) < 2:
+            return self.default_interval
+
+        seconds = np.diff([timestamp.timestamp() for timestamp in self.timestamps])
+        return timedelta(seconds=float(np.median(seconds)))
+
+    @property
+    def delay(self):
+        return min(self.delays) if self.delays else timedelta(0)
+
+    def next_publish(self, after):
+        """
+        Returns the first expected publish time of a new measurement after the given time.
+        Args:
+            after: The time after which the publish time is searched.
+
+        Returns: The expected publish time.
+        """
+        expected = self.last_measurement + self.interval + self.delay
+        if expected <= after:
+            missed = (after - expected) // self.interval + 1
+            expected = expected + missed * self.interval
+
+        return expected
+
+
+class IngestionSchedule:
+    """
+    Schedules the polls of the stations just after the expected publish time of their next measurement.
+    If the new measurement is not available yet, the station is polled again every retry_interval up to max_retries
+    times before waiting for the next expected publish time.
+    """
+
+    def __init__(self, stations, margin=timedelta(seconds=15), retry_interval=timedelta(seconds=30), max_retries=6):
+        self.margin = margin
+        self.retry_interval = retry_interval
+        self.max_retries = max_retries
+        self.cadences = {station: PublishCadence() for station in stations}
+        self.next_polls = {}
+        self.retries = {station: 0 for station in stations}
+
+    def observe(self, station, measurement_time, now, seen=True):
+        """
+        Records the newest measurement of a station and schedules its next poll.
+        Args:
+            station: The station.
+            measurement_time: The time of the newest measurement.
+            now: The current time.
+            seen: Whether the measurement was just seen for the first time.
+        """
+        cadence = self.cadences[station]
+        cadence.observe(measurement_time, now if seen else None)
+        self.retries[station] = 0
+        self.next_polls[station] = max(now, cadence.next_publish(now - self.margin) + self.margin)
+
+    def miss(self, station, now):
+        """
+        Records a poll of a station which returned no new measurement and schedules its next poll.
+        Args:
+            station: The station.
+            now: The current time.
+        """
+        cadence = self.cadences[station]
+        if cadence.last_measurement is None:
+            self.next_polls[station] = now + cadence.interval
+            return
+
+        self.retries[station] += 1
+        if self.retries[station] <= self.max_retries:
+            self.next_polls[station] = now + self.retry_interval
+        else:
+            self.retries[station] = 0
+            self.next_polls[station] = cadence.next_publish(now) + self.margin
+
+    def next_poll(self):
+        """
+        Returns: The time of the next poll of any station.
+        """
+        return min(self.next_polls.values())
+
+    def due_stations(self, now):
+        """
+        Returns: The stations whose poll is due at the given time.
+        """
+        return [station for station, poll in self.next_polls.items() if poll <= now]
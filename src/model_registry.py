@@ -0,0 +1,89 @@
+import hashlib
+import logging
+import os
+import pickle
+import threading
+import time
+
+logger = logging.getLogger("app")
+
+
+class LoadedModel:
+    """
+    Immutable handle of a loaded model.
+    """
+
+    def __init__(self, model, version, mtime, load_time, loaded_at):
+        self.model = model
+        # First 12 hex digits of the SHA-256 hash of the model file
+        self.version = version
+        self.mtime = mtime
+        # Time in seconds it took to read and deserialize the model file
+        self.load_time = load_time
+        self.loaded_at = loaded_at
+
+
+class ModelRegistry:
+    """
+    Keeps a pickled model in memory.
+
+    The model is loaded lazily on first use. Afterwards, the modification time of the file is checked on every access
+    and the model is reloaded only if the file was modified and its hash changed. The loaded model is swapped
+    atomically, so predictions which are in progress keep using the model they started with.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.loaded = None
+        self.lock = threading.Lock()
+
+    def get(self):
+        """
+        Returns: The current model. Loads or reloads the model if required.
+        """
+        return self.get_loaded().model
+
+    def get_loaded(self):
+        """
+        Returns: The LoadedModel holding the current model and its version, load time and modification time.
+        """
+        loaded = self.loaded
+        mtime = os.stat(self.path).st_mtime_ns
+        if loaded is not None and loaded.mtime == mtime:
+            return loaded
+
+        with self.lock:
+            loaded = self.loaded
+            if loaded is not None and loaded.mtime == mtime:
+                return loaded
+
+            self.loaded = self.__load(loaded)
+            return self.loaded
+
+    def get_info(self):
+        """
+        Returns: A dictionary with the version, load time and load timestamp of the current model or None if the model
+        was not loaded yet.
+        """
+        loaded = self.loaded
+        if loaded is None:
+            return None
+
+        return {"version": loaded.version, "load_time": loaded.load_time, "loaded_at": loaded.loaded_at}
+
+    def __load(self, current):
+        started = time.perf_counter()
+        mtime = os.stat(self.path).st_mtime_ns
+        with open(self.path, 'rb') as f:
+            content = f.read()
+
+        version = hashlib.sha256(content).hexdigest()[:12]
+        if current is not None and current.version == version:
+            # The file was touched but not changed
+            return LoadedModel(current.model, current.version, mtime, current.load_time, current.loaded_at)
+
+        model = pickle.loads(content)
+        load_time = time.perf_counter() - started
+        logger.info(f"Loaded model {self.path} (version {version}) in {load_time:.2f}s")
+
+        return LoadedModel(model, version, mtime, load_time, time.time())
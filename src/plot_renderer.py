@@ -0,0 +1,200 @@
+import logging
+import multiprocessing
+import time
+from collections import deque
+from multiprocessing.connection import wait
+
+logger = logging.getLogger("app")
+
+
+def warm_up():
+    """
+    Initializer of the worker processes. Renders an empty figure so that the kaleido subprocess of the worker is
+    started once and reused for all plots rendered by the worker.
+    """
+    import plotly.graph_objects as go
+    import plotly.io as pio
+
+    try:
+        pio.to_image(go.Figure(), format="svg", width=10, height=10)
+    except Exception as e:
+        logger.error(f"Warming up kaleido failed: {e}")
+
+
+def render_figure(figure_json, image_format, width, height):
+    """
+    Renders a figure in a worker process.
+    Args:
+        figure_json: The figure serialized with Figure.to_json().
+        image_format: The image format (e.g. "svg").
+        width: The width of the image.
+        height: The height of the image.
+
+    Returns: The rendered image as bytes and the render time in seconds.
+    """
+    import plotly.io as pio
+
+    started = time.perf_counter()
+    content = pio.to_image(pio.from_json(figure_json), format=image_format, width=width, height=height)
+    return content, time.perf_counter() - started
+
+
+class RenderResult:
+    def __init__(self, content=None, seconds=None, error=None):
+        self.content = content
+        self.seconds = seconds
+        self.error = error
+
+
+def work(connection, render_function, initializer):
+    """
+    Main function of a worker process. Renders the figures received over the connection until it is closed or None
+    is received and sends back the result of the render function or the exception.
+    """
+    if initializer is not None:
+        initializer()
+
+    while True:
+        try:
+            task = connection.recv()
+        except EOFError:
+            return
+        if task is None:
+            return
+
+        try:
+            connection.send((render_function(*task), None))
+        except Exception as e:
+            try:
+                connection.send((None, e))
+            except Exception:
+                # The exception could not be pickled
+                connection.send((None, RuntimeError(repr(e))))
+
+
+class _Worker:
+    def __init__(self, context, render_function, initializer):
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(target=work, args=(child_connection, render_function, initializer),
+                                       daemon=True)
+        self.process.start()
+        child_connection.close()
+        # Key, figure JSON and start time of the plot in progress
+        self.task = None
+
+    def stop(self):
+        """
+        Stops the worker, an idle worker exits by itself, a busy or unresponsive worker is killed.
+        """
+        if self.task is None:
+            try:
+                self.connection.send(None)
+            except OSError:
+                pass
+            self.process.join(1)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.connection.close()
+
+
+class PlotRenderer:
+    """
+    Renders plotly figures on a pool of worker processes.
+
+    The workers are started on first use and kept alive, so every worker reuses its warm kaleido instance. Each plot
+    has to be rendered within timeout seconds. A worker which exceeds the timeout (or dies) is killed and replaced by a
+    new worker, the other workers are not affected.
+    """
+
+    def __init__(self, workers=2, timeout=60, image_format="svg", render_function=render_figure,
+                 initializer=warm_up):
+        self.workers = workers
+        self.timeout = timeout
+        self.image_format = image_format
+        self.render_function = render_function
+        self.initializer = initializer
+        self.pool = []
+        # Spawn the workers, forking the multithreaded app is not safe
+        self.context = multiprocessing.get_context("spawn")
+        # Render time in seconds of the last rendering of each plot
+        self.render_times = {}
+
+    def render(self, figures, width, height):
+        """
+        Renders the given figures in parallel.
+        Args:
+            figures: Dictionary with the plot key as key and the plotly figure as value.
+            width: The width of the images.
+            height: The height of the images.
+
+        Returns: Dictionary with the plot key as key and a RenderResult as value.
+        """
+        pending = deque((key, figure.to_json()) for key, figure in figures.items())
+        results = {}
+
+        while True:
+            self.__fill_pool()
+            for worker in self.pool:
+                if worker.task is None and pending:
+                    key, figure_json = pending.popleft()
+                    worker.task = (key, figure_json, time.monotonic())
+                    try:
+                        worker.connection.send((figure_json, self.image_format, width, height))
+                    except OSError:
+                        # The worker died while idle, its result is read as EOF below
+                        pass
+
+            busy = [worker for worker in self.pool if worker.task is not None]
+            if not busy:
+                return results
+
+            deadline = min(worker.task[2] for worker in busy) + self.timeout
+            ready = wait([worker.connection for worker in busy], timeout=max(0.0, deadline - time.monotonic()))
+
+            for worker in busy:
+                key, figure_json, started = worker.task
+                if worker.connection in ready:
+                    worker.task = None
+                    try:
+                        result, error = worker.connection.recv()
+                    except (EOFError, OSError):
+                        logger.error(f"Worker rendering plot {key} died.")
+                        results[key] = RenderResult(error=RuntimeError(f"Worker rendering {key} died"))
+                        self.__replace(worker)
+                        continue
+
+                    if error is not None:
+                        results[key] = RenderResult(error=error)
+                    else:
+                        content, seconds = result
+                        results[key] = RenderResult(content, seconds)
+                        self.render_times[key] = seconds
+                elif time.monotonic() - started >= self.timeout:
+                    logger.error(f"Rendering plot {key} timed out after {self.timeout}s.")
+                    results[key] = RenderResult(seconds=self.timeout, error=TimeoutError(f"Rendering {key} timed out"))
+                    self.render_times[key] = self.timeout
+                    self.__replace(worker)
+
+    def get_render_times(self):
+        """
+        Returns: Dictionary with the plot key as key and the last render time in seconds as value.
+        """
+        return dict(self.render_times)
+
+    def shutdown(self):
+        """
+        Stops the worker processes, plots in progress are killed.
+        """
+        pool = self.pool
+        self.pool = []
+        for worker in pool:
+            worker.stop()
+
+    def __replace(self, worker):
+        worker.stop()
+        self.pool.remove(worker)
+
+    def __fill_pool(self):
+        while len(self.pool) < self.workers:
+            self.pool.append(_Worker(self.context, self.render_function, self.initializer))
@@ -1,18 +1,51 @@
 import datetime
+import hashlib
 import logging
 import os
+import tempfile
 
+import pandas as pd
 import plotly.graph_objects as go
 import schedule
 
+import downsampling
+import http_cache
 import prediction as pr
 import weather_repository as wr
+from plot_renderer import PlotRenderer
 
 logger = logging.getLogger("app")
 
 plots_directory = "./static/plots/"
 plot_size = (1000, 650) # width, height
 
+# Number of processes rendering the plots and the maximum render time per plot in seconds
+plot_render_workers = int(os.environ.get("PLOT_RENDER_WORKERS", 2))
+plot_render_timeout = 60
+plot_renderer = None
+# If disabled, plots are only available as figure JSON and rendered by the browser
+server_side_rendering = os.environ.get("SERVER_SIDE_RENDERING", "true").lower() not in ("false", "0", "no")
+# Maximum number of points per line trace, longer series are downsampled with LTTB
+plot_point_budget = 500
+
+# Measurements of all plots, fetched once per station
+plot_measurements = [wr.Measurement.Wind_speed_avg_10min, wr.Measurement.Wind_gust_max_10min, wr.Measurement.Air_temp,
+                     wr.Measurement.Wind_direction]
+# Window in days of each plot and the plots which contain predictions
+plot_windows = {'wind_speed_1d': 1, 'wind_speed_7d': 7, 'air_temperature_1d': 1, 'air_temperature_7d': 7,
+                'wind_direction': 1}
+plots_with_predictions = {'wind_speed_1d', 'wind_direction'}
+
+# Fingerprint of the inputs of the last rendering and hash of the saved file of each plot key
+plot_fingerprints = {}
+plot_content_hashes = {}
+# Modification time and content of the rendered files of each plot key served by get_plot_file()
+plot_files = {}
+# Figure JSON of each plot key for client-side rendering, with its ETag and encoded variants
+plot_figures = {}
+# Functions called with the station, the plot name and the new version whenever the content of a plot changed
+plot_listeners = []
+
 
 def get_plots():
     """
@@ -36,97 +69,380 @@ def resample_and_interpolate_data(df, resample_rule="H", interpolation_method="l
     return df
 
 
-def add_mean_min_max_to_plot(plot, df, property_key, unit):
+def downsample_query(weather_query, resample_rule="1h", fill="linear"):
+    """
+    Lets InfluxDB resample and interpolate the data of the given query instead of resample_and_interpolate_data. Used
+    for windows longer than the window store, which are answered from the rollups.
+    Args:
+        weather_query: The query to downsample.
+        resample_rule: The interval to resample with.
+        fill: The InfluxDB fill option used for empty intervals.
+
+    Returns: The downsampled query.
+    """
+    weather_query.aggregation = wr.Aggregation.Mean
+    weather_query.group_by_interval = resample_rule
+    weather_query.fill = fill
+    return weather_query
+
+
+class PlotData:
+    """
+    Data of all plots of a station. Windows of a day are plotted in full resolution. Windows longer than a day are
+    resampled hourly (see resample_and_interpolate_data()).
+    """
+
+    def __init__(self, station, windows, statistics, predictions):
+        self.station = station
+        # Dictionaries with the number of days as key and the data or the statistics of the window as value
+        self.windows = windows
+        self.statistics = statistics
+        # Predictions with relative datetime labels or None if no predictions are available
+        self.predictions = predictions
+
+    def get_window(self, days_delta):
+        return self.windows[days_delta]
+
+    def get_statistics(self, days_delta):
+        return self.statistics[days_delta]
+
+
+def prepare_plot_data(station, days_deltas=(1, 7)):
+    """
+    Fetches the data of all plots of the given station. The raw data of the longest window held by the window store is
+    fetched once and the shorter windows are cut from it, the statistics are computed from the raw data. Longer windows
+    are resampled and aggregated by InfluxDB from the rollups.
+    Args:
+        station: The station to fetch the data for.
+        days_deltas: The windows of the plots in days.
+
+    Returns: The PlotData of the station.
+    """
+    stop_time = datetime.datetime.now()
+
+    held_days_deltas = [days_delta for days_delta in days_deltas if days_delta <= wr.window_store_days]
+    raw_data = None
+    if held_days_deltas:
+        start_time = stop_time - datetime.timedelta(days=max(held_days_deltas))
+        raw_data = wr.run_query(wr.WeatherQuery(station=station, measurements=plot_measurements,
+                                                start_time=start_time, stop_time=stop_time))
+
+    windows, statistics = {}, {}
+    for days_delta in days_deltas:
+        start_time = stop_time - datetime.timedelta(days=days_delta)
+        if days_delta in held_days_deltas:
+            weather_data = None
+            if raw_data is not None:
+                # Same start as a query of the window, which is snapped to the query time granularity
+                start = pd.Timestamp(start_time).ceil(wr.query_time_granularity).tz_localize("UTC")
+                weather_data = raw_data[raw_data.index >= start]
+        else:
+            weather_data = wr.run_query(downsample_query(wr.WeatherQuery(
+                station=station, measurements=plot_measurements, start_time=start_time, stop_time=stop_time)))
+
+        if weather_data is None or weather_data.empty:
+            raise ValueError(f"No data to plot for station {station}")
+
+        if days_delta not in held_days_deltas:
+            statistics[days_delta] = query_statistics(station, start_time, stop_time)
+        else:
+            statistics[days_delta] = {measurement.value: create_statistics(weather_data[measurement.value].mean(),
+                                                                           weather_data[measurement.value],
+                                                                           weather_data[measurement.value])
+                                      for measurement in plot_measurements}
+            if days_delta > 1:
+                weather_data = resample_and_interpolate_data(weather_data, resample_rule="1h")
+
+        windows[days_delta] = weather_data
+
+    predictions = None
+    try:
+        predictions = pr.get_predictions(station, relative_datetime_labels=True)
+    except Exception as e:
+        logger.error(f"Loading predictions for station {station} failed.")
+        logger.error(e)
+
+    return PlotData(station, windows, statistics, predictions)
+
+
+def query_statistics(station, start_time, stop_time):
+    """
+    Lets InfluxDB aggregate the mean, min and max of the plotted measurements of a station. The measurements are
+    aggregated hourly, so the query is answered from the hourly rollups if available.
+    Args:
+        station: The station.
+        start_time: The start of the window.
+        stop_time: The stop of the window.
+
+    Returns: Dictionary with the measurement as key and the statistics (see create_statistics()) as value.
+    """
+    aggregations = [wr.Aggregation.Mean, wr.Aggregation.Count, wr.Aggregation.Min, wr.Aggregation.Max]
+    weather_query = wr.WeatherQuery(station=station, measurements=plot_measurements, start_time=start_time,
+                                    stop_time=stop_time, aggregation=aggregations, group_by_interval="1h", fill="none")
+    data = wr.run_query(weather_query)
+    if data is None or data.empty:
+        raise ValueError(f"No statistics to plot for station {station}")
+
+    statistics = {}
+    for measurement in plot_measurements:
+        field = measurement.value
+        counts = data[f"{field}_count"].fillna(0)
+        # Mean of the hourly means weighted by the number of measurements per hour
+        mean = (data[f"{field}_mean"] * counts).sum() / counts.sum() if counts.sum() > 0 else None
+        statistics[field] = create_statistics(mean, data[f"{field}_min"], data[f"{field}_max"])
+
+    return statistics
+
+
+def create_statistics(mean, minima, maxima):
+    """
+    Creates the statistics of a measurement shown in a plot.
+    Args:
+        mean: The mean of the measurement.
+        minima: Series of the measurement (or of its minima per interval) to take the min and its time from.
+        maxima: Series of the measurement (or of its maxima per interval) to take the max and its time from.
+
+    Returns: Dictionary with the mean, min, max and the time of the min and the max. Values are None without data.
+    """
+    minima, maxima = minima.dropna(), maxima.dropna()
+    return {
+        "mean": None if mean is None or pd.isna(mean) else float(mean),
+        "min": float(minima.min()) if not minima.empty else None,
+        "min_time": minima.idxmin() if not minima.empty else None,
+        "max": float(maxima.max()) if not maxima.empty else None,
+        "max_time": maxima.idxmax() if not maxima.empty else None
+    }
+
+
+def create_line_trace(series, name):
+    """
+    Creates a line trace of the given series, downsampled to the point budget.
+    Args:
+        series: The series with a DatetimeIndex to plot.
+        name: The name of the trace.
+    Returns: The trace.
+    """
+    series = downsampling.downsample_series(series, plot_point_budget)
+    return go.Scatter(x=series.index, y=series, mode='lines', name=name)
+
+
+def add_mean_min_max_to_plot(plot, df, statistics, property_key, unit):
     """
     Adds a mean line and min/max points to the given plot.
     Args:
         plot: The plot to add the mean line and min/max points to.
-        df: The data frame containing the data.
+        df: The data frame containing the plotted data. The mean line spans its time range.
+        statistics: The statistics of the window, see create_statistics().
         property_key: The key of the property to add the mean line and min/max points for.
         unit: The unit of the property.
     """
-    plot.add_trace(go.Scatter(x=[df.index.min(), df.index.max()],
-                              y=[df[property_key].mean()] * 2, mode='lines',
-                              name=f"Mean: {df[property_key].mean():.2f}{unit}",
-                              line=dict(dash='dash')))
+    statistics = statistics[property_key]
+
+    if statistics["mean"] is not None:
+        plot.add_trace(go.Scatter(x=[df.index.min(), df.index.max()],
+                                  y=[statistics["mean"]] * 2, mode='lines',
+                                  name=f"Mean: {statistics['mean']:.2f}{unit}",
+                                  line=dict(dash='dash')))
+
+    if statistics["min"] is not None:
+        plot.add_trace(go.Scatter(x=[statistics["min_time"]],
+                                  y=[statistics["min"]],
+                                  mode='markers',
+                                  name=f"Min: {statistics['min']:.2f}{unit}",
+                                  marker=dict(size=10, color="red")))
 
-    plot.add_trace(go.Scatter(x=[df[property_key].idxmin()],
-                              y=[df[property_key].min()],
-                              mode='markers',
-                              name=f"Min: {df[property_key].min():.2f}{unit}",
-                              marker=dict(size=10, color="red")))
+    if statistics["max"] is not None:
+        plot.add_trace(go.Scatter(x=[statistics["max_time"]],
+                                  y=[statistics["max"]],
+                                  mode='markers',
+                                  name=f"Max: {statistics['max']:.2f}{unit}",
+                                  marker=dict(size=10, color="red")))
 
-    plot.add_trace(go.Scatter(x=[df[property_key].idxmax()],
-                              y=[df[property_key].max()],
-                              mode='markers',
-                              name=f"Max: {df[property_key].max():.2f}{unit}",
-                              marker=dict(size=10, color="red")))
 
+def get_plot_file_name(plot_key):
+    return os.path.join(os.path.dirname(__file__), plots_directory, plot_key + ".svg")
 
-def save_plot(plot, plot_name, station):
+
+def save_plot(content, plot_key):
     """
-    Saves the given plot to a file.
+    Saves a rendered plot to a file together with its precompressed variants (.gz and .br if brotli is installed).
+    The files are only replaced (atomically) if the content changed. Variants of other encodings (e.g. a .br file
+    left from an installation with brotli) are removed, so they are not served with outdated content.
     Args:
-        plot: The plot to save.
-        plot_name: The name of the plot.
-        station: The station the plot is for.
-    Returns: None
+        content: The rendered SVG as bytes.
+        plot_key: The key of the plot (<station>/<plot name>).
+    Returns: True if the file was written, False if it was unchanged.
     """
+    file_name = get_plot_file_name(plot_key)
+    content_hash = hashlib.sha256(content).hexdigest()
+    variants = http_cache.compress(content)
 
-    plot.update_layout(
-        autosize=False,
-        width=plot_size[0],
-        height=plot_size[1],
-    )
+    for encoding in http_cache.file_extensions:
+        if encoding not in variants:
+            try:
+                os.remove(get_variant_file_name(file_name, encoding))
+            except FileNotFoundError:
+                pass
 
-    if not os.path.exists(plots_directory + station):
-        os.makedirs(plots_directory + station)
+    if plot_key not in plot_content_hashes and os.path.isfile(file_name):
+        with open(file_name, "rb") as f:
+            plot_content_hashes[plot_key] = hashlib.sha256(f.read()).hexdigest()
+    if plot_content_hashes.get(plot_key) == content_hash and \
+            all(os.path.isfile(get_variant_file_name(file_name, encoding)) for encoding in variants):
+        return False
 
-    plot_file_name = f"{station}/{plot_name}"
+    os.makedirs(os.path.dirname(file_name), exist_ok=True)
+    # The uncompressed file is replaced last, its modification time marks a complete set of variants
+    for encoding in sorted(variants, key=lambda encoding: encoding == "identity"):
+        __write_file_atomically(get_variant_file_name(file_name, encoding), variants[encoding])
 
+    plot_content_hashes[plot_key] = content_hash
+    logger.debug(f"Saved plot {plot_key} as svg file.")
+    return True
+
+
+def get_variant_file_name(file_name, encoding):
+    return file_name + http_cache.file_extensions.get(encoding, "")
+
+
+def __write_file_atomically(file_name, content):
+    fd, temp_file = tempfile.mkstemp(dir=os.path.dirname(file_name), suffix=".tmp")
     try:
-        plot.write_image(os.path.join(os.path.dirname(__file__), plots_directory, plot_file_name + ".svg"))
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        os.replace(temp_file, file_name)
+    except BaseException:
+        os.remove(temp_file)
+        raise
 
-        logger.debug(f"Saved plot {plot_name} for station {station} as svg file.")
-    except Exception as e:
-        logger.error(f"Saving plot {plot_name} failed.")
-        logger.error(e)
+
+def get_plot_file(station, plot_name):
+    """
+    Returns the rendered SVG of a plot and its precompressed variants. The files are read again only if the SVG was
+    replaced.
+    Args:
+        station: The station of the plot.
+        plot_name: The name of the plot.
+    Returns: A dictionary with the ETag (content hash) and the variants of the SVG or None if the plot does not exist.
+    """
+    plot_key = f"{station}/{plot_name}"
+    if plot_name not in get_plots():
+        return None
+
+    file_name = get_plot_file_name(plot_key)
+    try:
+        modified = os.stat(file_name).st_mtime_ns
+    except OSError:
+        return None
+
+    cached = plot_files.get(plot_key, None)
+    if cached is not None and cached[0] == modified:
+        return cached[1]
+
+    with open(file_name, "rb") as f:
+        content = f.read()
+    variants = {"identity": content}
+    for encoding in http_cache.file_extensions:
+        try:
+            with open(get_variant_file_name(file_name, encoding), "rb") as f:
+                variants[encoding] = f.read()
+        except OSError:
+            pass
+
+    plot_file = {"etag": http_cache.create_etag(content), "variants": variants}
+    plot_files[plot_key] = (modified, plot_file)
+    return plot_file
+
+
+def save_plot_figure(figure, plot_key):
+    """
+    Keeps the figure JSON of a plot in memory for client-side rendering.
+    Args:
+        figure: The figure of the plot.
+        plot_key: The key of the plot (<station>/<plot name>).
+    Returns: True if the figure changed, False otherwise.
+    """
+    content = figure.to_json().encode()
+    etag = http_cache.create_etag(content)
+    previous = plot_figures.get(plot_key, None)
+    if previous is not None and previous["etag"] == etag:
+        return False
+
+    plot_figures[plot_key] = {"etag": etag, "variants": http_cache.compress(content)}
+    return True
+
+
+def get_plot_figure(station, plot_name):
+    """
+    Returns the figure JSON of a plot.
+    Args:
+        station: The station of the plot.
+        plot_name: The name of the plot.
+    Returns: A dictionary with the ETag and the encoded variants of the figure JSON or None if the plot is not
+    available.
+    """
+    return plot_figures.get(f"{station}/{plot_name}", None)
 
 
-def generate_wind_speed_plot(station: str, days_delta):
+def is_plot_available(plot_key):
+    """
+    Returns: True if the plot was generated and can be served in the configured rendering mode.
+    """
+    if plot_key not in plot_figures:
+        return False
+    return not server_side_rendering or os.path.isfile(get_plot_file_name(plot_key))
+
+
+def get_renderer_settings():
+    """
+    Returns: The settings which change the rendered output of all plots.
+    """
+    return {"size": plot_size, "format": "svg", "point_budget": plot_point_budget,
+            "server_side_rendering": server_side_rendering}
+
+
+def get_plot_fingerprint(station, plot_name, watermark, prediction_snapshot_id):
+    """
+    Returns the fingerprint of the inputs of a plot. The plot only has to be rendered again if it changed.
+    Args:
+        station: The station of the plot.
+        plot_name: The name of the plot.
+        watermark: The time of the last entry of the station.
+        prediction_snapshot_id: The id of the prediction snapshot of the station or None.
+    Returns: The fingerprint as hex string.
+    """
+    inputs = {
+        "station": station,
+        "plot": plot_name,
+        "window": plot_windows[plot_name],
+        "watermark": str(watermark),
+        "predictions": prediction_snapshot_id if plot_name in plots_with_predictions else None,
+        "settings": get_renderer_settings()
+    }
+    return hashlib.sha256(repr(sorted(inputs.items())).encode()).hexdigest()
+
+
+def generate_wind_speed_plot(plot_data, days_delta):
     """
     Generates a plot of the wind speed measurements for the given station. The plot also contains predictions for the next hour.
     Args:
-        station: The station to generate the plot for.
+        plot_data: The PlotData of the station to generate the plot for.
         days_delta: The number of days to go back in time.
 
-    Returns: None
+    Returns: The figure of the plot.
     """
 
-    start_time = datetime.datetime.now() - datetime.timedelta(days=days_delta)
-    stop_time = datetime.datetime.now()
-
-    weather_query = wr.WeatherQuery(station=station, measurements=[wr.Measurement.Wind_speed_avg_10min,
-                                                                   wr.Measurement.Wind_gust_max_10min],
-                                    start_time=start_time,
-                                    stop_time=stop_time)
-    weather_data = wr.run_query(weather_query)
+    weather_data = plot_data.get_window(days_delta)
 
     predictions = None
 
-    if days_delta > 1:
-        weather_data = resample_and_interpolate_data(weather_data)
-    else:
-        predictions = pr.get_predictions(station, relative_datetime_labels=True)
+    if days_delta <= 1:
+        predictions = plot_data.predictions
 
     plot = go.Figure()
 
-    plot.add_trace(
-        go.Scatter(x=weather_data.index, y=weather_data["wind_speed_avg_10min"], mode='lines',
-                   name='Wind speed (10min avg)'))
-    plot.add_trace(
-        go.Scatter(x=weather_data.index, y=weather_data["wind_gust_max_10min"], mode='lines',
-                   name='Wind gust (10min max)'))
+    plot.add_trace(create_line_trace(weather_data["wind_speed_avg_10min"], 'Wind speed (10min avg)'))
+    plot.add_trace(create_line_trace(weather_data["wind_gust_max_10min"], 'Wind gust (10min max)'))
 
     if predictions is not None:
         plot.add_trace(go.Scatter(x=list(predictions.keys()), y=list(x[0] for x in predictions.values()), mode='lines',
@@ -136,7 +452,7 @@ def generate_wind_speed_plot(station: str, days_delta):
     else:
         plot.update_xaxes(range=[weather_data.index.min(), weather_data.index.max()])
 
-    add_mean_min_max_to_plot(plot, weather_data, "wind_speed_avg_10min",
+    add_mean_min_max_to_plot(plot, weather_data, plot_data.get_statistics(days_delta), "wind_speed_avg_10min",
                              wr.unit_mapping[wr.Measurement.Wind_speed_avg_10min.value])
 
     plot.update_layout(
@@ -145,36 +461,27 @@ def generate_wind_speed_plot(station: str, days_delta):
         yaxis_title="Wind speed [m/s]",
     )
 
-    save_plot(plot, f"wind_speed_{days_delta}d", station)
+    return plot
 
 
-def generate_air_temperature_plot(station: str, days_delta):
+def generate_air_temperature_plot(plot_data, days_delta):
     """
     Generates a plot of the air temperature for the given station.
     Args:
-        station: The station to generate the plot for.
+        plot_data: The PlotData of the station to generate the plot for.
         days_delta: The number of days to go back in time.
 
-    Returns: None
+    Returns: The figure of the plot.
     """
 
-    start_time = datetime.datetime.now() - datetime.timedelta(days=days_delta)
-    stop_time = datetime.datetime.now()
-
-    weather_query = wr.WeatherQuery(station=station, measurements=[wr.Measurement.Air_temp],
-                                    start_time=start_time,
-                                    stop_time=stop_time)
-    weather_data = wr.run_query(weather_query)
-
-    if days_delta > 1:
-        weather_data = resample_and_interpolate_data(weather_data)
+    weather_data = plot_data.get_window(days_delta)
 
     plot = go.Figure()
 
-    plot.add_trace(
-        go.Scatter(x=weather_data.index, y=weather_data["air_temperature"], mode='lines', name='Air temperature'))
+    plot.add_trace(create_line_trace(weather_data["air_temperature"], 'Air temperature'))
 
-    add_mean_min_max_to_plot(plot, weather_data, "air_temperature", wr.unit_mapping[wr.Measurement.Air_temp.value])
+    add_mean_min_max_to_plot(plot, weather_data, plot_data.get_statistics(days_delta), "air_temperature",
+                             wr.unit_mapping[wr.Measurement.Air_temp.value])
 
     plot.update_xaxes(range=[weather_data.index.min(), weather_data.index.max()])
 
@@ -184,40 +491,35 @@ def generate_air_temperature_plot(station: str, days_delta):
         yaxis_title="Temperature [°C]"
     )
 
-    save_plot(plot, f"air_temperature_{days_delta}d", station)
+    return plot
 
 
-def generate_wind_direction_plot(station: str):
+def generate_wind_direction_plot(plot_data):
     """
     Generates a plot of the wind direction for the given station. The plot also contains predictions for the next hour.
     Args:
-        station: The station to generate the plot for.
+        plot_data: The PlotData of the station to generate the plot for.
 
-    Returns: None
+    Returns: The figure of the plot.
     """
 
-    start_time = datetime.datetime.now() - datetime.timedelta(days=1)
-    stop_time = datetime.datetime.now()
-
-    weather_query = wr.WeatherQuery(station=station, measurements=[wr.Measurement.Wind_direction],
-                                    start_time=start_time,
-                                    stop_time=stop_time)
-    weather_data = wr.run_query(weather_query)
-
-    predictions = pr.get_predictions(station, relative_datetime_labels=True)
+    weather_data = plot_data.get_window(1)
+    predictions = plot_data.predictions
 
     plot = go.Figure()
 
-    plot.add_trace(
-        go.Scatter(x=weather_data.index, y=weather_data["wind_direction"], mode='lines', name='Wind direction'))
+    plot.add_trace(create_line_trace(weather_data["wind_direction"], 'Wind direction'))
 
-    plot.add_trace(go.Scatter(x=list(predictions.keys()), y=list(x[1] for x in predictions.values()), mode='lines',
-                              name='Prediction'))
+    if predictions is not None:
+        plot.add_trace(go.Scatter(x=list(predictions.keys()), y=list(x[1] for x in predictions.values()),
+                                  mode='lines', name='Prediction'))
 
-    add_mean_min_max_to_plot(plot, weather_data, "wind_direction", wr.unit_mapping[wr.Measurement.Wind_direction.value])
+    add_mean_min_max_to_plot(plot, weather_data, plot_data.get_statistics(1), "wind_direction",
+                             wr.unit_mapping[wr.Measurement.Wind_direction.value])
 
     plot.update_yaxes(range=[0, 360])
-    plot.update_xaxes(range=[weather_data.index.min(), list(predictions.keys())[-1]])
+    plot.update_xaxes(range=[weather_data.index.min(),
+                             list(predictions.keys())[-1] if predictions is not None else weather_data.index.max()])
 
     plot.update_layout(
         title=f"Wind direction of the last 24 hours",
@@ -225,38 +527,150 @@ def generate_wind_direction_plot(station: str):
         yaxis_title="Wind direction [°]",
     )
 
-    save_plot(plot, "wind_direction", station)
+    return plot
+
+
+def generate_plot(plot_data, plot_name):
+    """
+    Generates the figure of the plot with the given name.
+    Args:
+        plot_data: The PlotData of the station to generate the plot for.
+        plot_name: The name of the plot, see get_plots().
+    Returns: The figure of the plot.
+    """
+    if plot_name == 'wind_direction':
+        return generate_wind_direction_plot(plot_data)
+    if plot_name.startswith('wind_speed_'):
+        return generate_wind_speed_plot(plot_data, plot_windows[plot_name])
+    return generate_air_temperature_plot(plot_data, plot_windows[plot_name])
 
 
 def generate_all_plots():
     """
-    Generates all plots for all stations.
+    Generates all plots for all stations. The figures are built first and then rendered in parallel by the
+    plot renderer. Plots whose fingerprint did not change since their last rendering are skipped.
     Returns: None
     """
-
-    days_deltas = [1, 7]
+    started = datetime.datetime.now()
+    days_deltas = sorted(set(plot_windows.values()))
+    figures = {}
+    fingerprints = {}
+    skipped = 0
 
     for station in wr.get_stations():
-        for days_delta in days_deltas:
+        watermark = wr.get_watermark(station)
+        prediction_snapshot_id = pr.get_prediction_snapshot_id(station)
+
+        outdated = []
+        for plot_name in get_plots():
+            plot_key = f"{station}/{plot_name}"
+            fingerprint = get_plot_fingerprint(station, plot_name, watermark, prediction_snapshot_id)
+            if plot_fingerprints.get(plot_key) == fingerprint and is_plot_available(plot_key):
+                skipped += 1
+                continue
+
+            fingerprints[plot_key] = fingerprint
+            outdated.append(plot_name)
+
+        if not outdated:
+            continue
+
+        try:
+            plot_data = prepare_plot_data(station, days_deltas)
+        except Exception as e:
+            logger.error(f"Loading plot data for station {station} failed.")
+            logger.error(e)
+            continue
+
+        for plot_name in outdated:
             try:
-                generate_wind_speed_plot(station, days_delta)
+                figures[f"{station}/{plot_name}"] = generate_plot(plot_data, plot_name)
             except Exception as e:
-                logger.error(f"Generating wind speed plot for station {station} with {days_delta} days delta failed.")
+                logger.error(f"Generating plot {plot_name} for station {station} failed.")
                 logger.error(e)
 
+    changed_figures = [plot_key for plot_key, figure in figures.items() if save_plot_figure(figure, plot_key)]
+
+    if not server_side_rendering:
+        for plot_key in figures:
+            plot_fingerprints[plot_key] = fingerprints[plot_key]
+        __notify_plot_listeners({plot_key: plot_figures[plot_key]["etag"] for plot_key in changed_figures})
+        logger.info(f"Updated {len(figures)} plot figures, skipped {skipped} unchanged plots in "
+                    f"{(datetime.datetime.now() - started).total_seconds():.2f}s.")
+        return
+
+    written = render_plots(figures)
+    for plot_key in written:
+        plot_fingerprints[plot_key] = fingerprints[plot_key]
+    # The version is the ETag of the file, i.e. the prefix of the content hash
+    __notify_plot_listeners({plot_key: plot_content_hashes[plot_key][:32]
+                             for plot_key, changed in written.items() if changed})
+
+    logger.info(f"Rendered {len(written)} of {len(figures)} outdated plots ({sum(written.values())} files changed), "
+                f"skipped {skipped} unchanged plots in {(datetime.datetime.now() - started).total_seconds():.2f}s.")
+
+
+def add_plot_listener(listener):
+    """
+    Registers a listener which is called with the station, the plot name and the new version (ETag) of a plot whenever
+    the content of the plot changed.
+    Args:
+        listener: Function taking the station, the plot name and the version.
+    Returns: None
+    """
+    plot_listeners.append(listener)
+
+
+def __notify_plot_listeners(versions):
+    for plot_key, version in versions.items():
+        station, plot_name = plot_key.split("/", 1)
+        for listener in list(plot_listeners):
             try:
-                generate_air_temperature_plot(station, days_delta)
+                listener(station, plot_name, version)
             except Exception as e:
-                logger.error(
-                    f"Generating air temperature plot for station {station} with {days_delta} days delta failed.")
-                logger.error(e)
+                logger.error(f"Plot listener failed for {plot_key}: {e}")
+
+
+def render_plots(figures):
+    """
+    Renders the given figures on the plot renderer and saves them.
+    Args:
+        figures: Dictionary with the plot key (<station>/<plot name>) as key and the figure as value.
+    Returns: A dictionary with the key of each successfully saved plot as key and whether its file changed as value.
+    """
+    global plot_renderer
+    if plot_renderer is None:
+        plot_renderer = PlotRenderer(workers=plot_render_workers, timeout=plot_render_timeout)
+
+    for figure in figures.values():
+        figure.update_layout(autosize=False, width=plot_size[0], height=plot_size[1])
+
+    saved = {}
+    if not figures:
+        return saved
+
+    for plot_key, result in plot_renderer.render(figures, width=plot_size[0], height=plot_size[1]).items():
+        if result.error is not None:
+            logger.error(f"Saving plot {plot_key} failed.")
+            logger.error(result.error)
+            continue
 
         try:
-            generate_wind_direction_plot(station)
+            saved[plot_key] = save_plot(result.content, plot_key)
         except Exception as e:
-            logger.error(f"Generating wind direction plot for station {station} failed.")
+            logger.error(f"Saving plot {plot_key} failed.")
             logger.error(e)
 
+    return saved
+
+
+def get_render_times():
+    """
+    Returns the render time of the last rendering of each plot.
+    Returns: A dictionary with the plot key (<station>/<plot name>) as key and the render time in seconds as value.
+    """
+    return plot_renderer.get_render_times() if plot_renderer is not None else {}
+
 
 def init():
     """
@@ -1,6 +1,7 @@
+import dataclasses
 import datetime
 import logging
-import pickle
+import types
 
 import numpy as np
 import pandas as pd
@@ -8,37 +9,70 @@ import schedule
 
 logger = logging.getLogger("app")
 
+import weather_data as wd
 import weather_repository as wr
+from model_registry import ModelRegistry
+from single_flight import SingleFlight
 
 predicted_measurements = [wr.Measurement.Wind_speed_avg_10min, wr.Measurement.Wind_direction, wr.Measurement.Air_temp]
-prediction_cache = {}
+# Latest PredictionSnapshot per station, replaced whenever the ingestion advances the data of the station
+prediction_snapshots = {}
+# Snapshots whose data is older than this are checked against the database before they are returned
+prediction_snapshot_max_age = datetime.timedelta(minutes=30)
+# Concurrent updates of the snapshot of the same station share one update
+prediction_flights = SingleFlight()
+# The model is loaded once and reloaded when the file changes
+model_registry = ModelRegistry('./weather_model.pkl')
+# Number of 10 minute steps which are predicted recursively
+prediction_horizon_steps = 6
+# Columns of the feature matrix in the order the model was trained with
+feature_columns = ['station', 'air_temperature_10min_before', 'wind_speed_avg_10min_before',
+                   'wind_direction_10min_before', 'day', 'month', 'year']
+
+
+@dataclasses.dataclass(frozen=True)
+class PredictionSnapshot:
+    """
+    Immutable predictions of a station for the data at data_datetime made by the model with model_version.
+    The labelled predictions are read-only mappings of the label to the wind speed and wind direction.
+    """
+    data_datetime: pd.Timestamp
+    labelled_predictions: tuple
+    model_version: str
+    created_at: datetime.datetime = dataclasses.field(
+        init=False, default_factory=lambda: datetime.datetime.now(datetime.timezone.utc))
+
+    def __post_init__(self):
+        object.__setattr__(self, 'labelled_predictions', tuple(
+            types.MappingProxyType({label: tuple(values) for label, values in prediction.items()})
+            for prediction in self.labelled_predictions))
+
+    def get_labelled_predictions(self):
+        """
+        Returns: A copy of the labelled predictions which can be modified by the caller.
+        """
+        return [{label: list(values) for label, values in prediction.items()}
+                for prediction in self.labelled_predictions]
+
 
 def get_predictions(station, relative_datetime_labels=False):
     """
-    Returns a dictionary of predictions for the given station. Cache is used if data has not changed since and cache is allowed.
+    Returns a dictionary of predictions for the given station. The predictions are precomputed whenever new data of the
+    station is ingested and returned from memory. Only if the snapshot is missing or older than
+    prediction_snapshot_max_age, the latest data is queried and the predictions are recomputed if it changed.
     Args:
         station: The station to get predictions for
         relative_datetime_labels: If true, the keys of the dictionary will be absolute datetimes, otherwise they will be strings relative to NOW
     Returns: A list of dictionaries, each dictionary containing a key-value pair of the relative time and the prediction
     """
-    query = wr.WeatherQuery(station, predicted_measurements)
-    pred_data = wr.run_query(query)
-    latest_data_datetime = pred_data.index[-1]
-
-    cached_predictions = __get_cached_predictions(station, latest_data_datetime)
-    if cached_predictions is not None:
-        if relative_datetime_labels:
-            return convert_labelled_predictions_to_relative_datetime(cached_predictions)
-        else:
-            return cached_predictions
+    snapshot = prediction_snapshots.get(station, None)
+    if snapshot is None or __is_stale(snapshot):
+        # Concurrent requests of the station share one update
+        snapshot = prediction_flights.do(station, lambda: __update_snapshots([station]).get(station, None))
+        if snapshot is None:
+            raise LookupError(f"No predictions available for station {station}")
 
-    labelled_predictions = __predict(station, wind_speed_avg_10min_before=pred_data['wind_speed_avg_10min'],
-                                     wind_direction_10min_before=pred_data['wind_direction'],
-                                     air_temperature_10min_before=pred_data['air_temperature'],
-                                     day=datetime.datetime.now().day, month=datetime.datetime.now().month,
-                                     year=datetime.datetime.now().year, data_datetime=latest_data_datetime)
-
-    prediction_cache[station] = labelled_predictions
+    labelled_predictions = snapshot.get_labelled_predictions()
 
     if relative_datetime_labels:
         return convert_labelled_predictions_to_relative_datetime(labelled_predictions)
@@ -46,64 +80,70 @@ def get_predictions(station, relative_datetime_labels=False):
         return labelled_predictions
 
 
-def __get_cached_predictions(station, latest_data_datetime):
+def get_prediction_snapshot_id(station):
     """
-    Returns the cached predictions for the given station if they are available and the data has not changed since.
+    Returns the id of the current prediction snapshot of the station, which changes whenever the predictions change.
     Args:
-        station: The station to get predictions for
-        latest_data_datetime: The latest datetime of the data
-    Returns: The cached predictions if available, otherwise None
+        station: The station
+    Returns: The id as string or None if there is no snapshot
     """
-    if station in prediction_cache:
-        if list(prediction_cache[station][0].keys())[0] == latest_data_datetime:
-            # Return copy of cached predictions
-            return [prediction.copy() for prediction in prediction_cache[station]]
+    snapshot = prediction_snapshots.get(station, None)
+    if snapshot is None:
+        return None
+
+    return f"{snapshot.data_datetime.isoformat()}/{snapshot.model_version}"
 
-    return None
 
+def __is_stale(snapshot):
+    return pd.Timestamp.now(tz='UTC') - snapshot.data_datetime > prediction_snapshot_max_age
 
-def __predict(station, air_temperature_10min_before, wind_speed_avg_10min_before,
-              wind_direction_10min_before, day, month, year, data_datetime):
+
+def predict_batch(features, horizon_steps=None):
     """
-    Predicts the wind speed, wind direction and air temperature for the next 60 minutes. The predictions are based on the given data.
+    Predicts the wind speed and wind direction recursively for multiple rows at once. The model is called once per
+    horizon step with the feature matrix of all rows, the predictions of a step are the wind features of the next step.
     Args:
-        station: The station to predict for
-        air_temperature_10min_before:
-        wind_speed_avg_10min_before:
-        wind_direction_10min_before:
-        day: The day of the prediction
-        month: The month of the prediction
-        year: The year of the prediction
-        data_datetime: The datetime of the data provided
+        features: NumPy array of shape (rows, len(feature_columns)), e.g. one row per station or start time
+        horizon_steps: The number of 10 minute steps to predict, defaults to prediction_horizon_steps
+
+    Returns: NumPy array of shape (rows, horizon_steps, 2) with the predicted wind speed and wind direction
+    """
+    if horizon_steps is None:
+        horizon_steps = prediction_horizon_steps
+
+    model = model_registry.get()
+    features = pd.DataFrame(np.array(features, dtype=np.float64), columns=feature_columns)
+    wind_columns = ['wind_speed_avg_10min_before', 'wind_direction_10min_before']
+
+    predictions = np.empty((len(features), horizon_steps, 2))
+    for step in range(horizon_steps):
+        predictions[:, step] = model.predict(features)
+        features[wind_columns] = predictions[:, step]
+
+    return predictions
 
-    Returns: A list of dictionaries, each dictionary containing a key-value pair of the relative time and the prediction
 
+def __create_features(station, pred_data, now):
     """
-    with open('./weather_model.pkl', 'rb') as f:
-        model = pickle.load(f)
+    Creates the feature row of a station from the latest measurements.
+    """
+    return [__convert_station_to_int(station), pred_data['air_temperature'].iloc[0],
+            pred_data['wind_speed_avg_10min'].iloc[0], pred_data['wind_direction'].iloc[0],
+            now.day, now.month, now.year]
 
-        pred_df = pd.DataFrame({
-            'station': [__convert_station_to_int(station)],
-            'air_temperature_10min_before': [air_temperature_10min_before[0]],
-            'wind_speed_avg_10min_before': [wind_speed_avg_10min_before[0]],
-            'wind_direction_10min_before': [wind_direction_10min_before[0]],
-            'day': [day],
-            'month': [month],
-            'year': [year]
-        })
 
-        predictions = [[wind_speed_avg_10min_before[0], wind_direction_10min_before[0]]]
-        labelled_predictions = [{data_datetime: [wind_speed_avg_10min_before[0], wind_direction_10min_before[0]]}]
+def __label_predictions(data_datetime, features, predictions):
+    """
+    Labels the predictions of one row of predict_batch with the relative time of each horizon step. The first entry
+    holds the measured wind speed and wind direction at data_datetime.
+    """
+    wind_speed, wind_direction = features[2], features[3]
+    labelled_predictions = [{data_datetime: [wind_speed, wind_direction]}]
 
-        for i in range(0, 6):
-            offset_time = (i + 1) * 10
-            pred_df['wind_speed_avg_10min_before'] = predictions[i][0]
-            pred_df['wind_direction_10min_before'] = predictions[i][1]
-            prediction = model.predict(pred_df)[0].tolist()
-            predictions.append(prediction)
-            labelled_predictions.append({f"+{offset_time}'": np.round(prediction, 2)})
+    for i, prediction in enumerate(predictions):
+        labelled_predictions.append({f"+{(i + 1) * 10}'": np.round(prediction, 2)})
 
-        return labelled_predictions
+    return labelled_predictions
 
 
 def __convert_station_to_int(station):
@@ -118,22 +158,76 @@ def convert_labelled_predictions_to_relative_datetime(labelled_predictions):
     Returns: A dictionary with relative datetime as keys and the predictions as values
     """
     first_prediction_datetime = list(labelled_predictions[0].keys())[0]
-    return {first_prediction_datetime + datetime.timedelta(minutes=int(key[1:3])): value
+    return {first_prediction_datetime + datetime.timedelta(minutes=int(key[1:-1])): value
             for prediction in labelled_predictions
             for key, value in prediction.items() if not isinstance(key, datetime.datetime) and key.startswith("+")}
 
-def __predict_all_stations():
-    logger.debug('Predicting all stations')
-    for station in wr.get_stations():
+def __update_snapshots(stations):
+    """
+    Recomputes the predictions of all given stations whose snapshot is missing, outdated or made by another model
+    version with a single model call per horizon step and publishes the new snapshots.
+    Args:
+        stations: The stations to update
+    Returns: A dictionary with the current snapshot of each station which could be predicted
+    """
+    now = datetime.datetime.now()
+    model_version = model_registry.get_loaded().version
+    snapshots, pending, rows = {}, [], []
+    for station in stations:
         try:
-            get_predictions(station)
-            logger.debug(f'Predicted {station}')
+            pred_data = wr.run_query(wr.WeatherQuery(station, predicted_measurements))
+            latest_data_datetime = pred_data.index[-1]
+
+            snapshot = prediction_snapshots.get(station, None)
+            if snapshot is not None and snapshot.data_datetime == latest_data_datetime \
+                    and snapshot.model_version == model_version:
+                snapshots[station] = snapshot
+                continue
+
+            rows.append(__create_features(station, pred_data, now))
+            pending.append((station, latest_data_datetime))
         except Exception as e:
             logger.error(f'Error predicting station {station}: {e}')
 
+    if rows:
+        try:
+            features = np.array(rows, dtype=np.float64)
+            predictions = predict_batch(features)
+            for i, (station, latest_data_datetime) in enumerate(pending):
+                snapshots[station] = PredictionSnapshot(
+                    latest_data_datetime, __label_predictions(latest_data_datetime, features[i], predictions[i]),
+                    model_version)
+                prediction_snapshots[station] = snapshots[station]
+                logger.debug(f'Predicted {station}')
+        except Exception as e:
+            logger.error(f'Error predicting stations {[station for station, _ in pending]}: {e}')
+
+    return snapshots
+
+
+def __on_data_written(station, data):
+    """
+    Data listener for weather_data.py which precomputes the predictions of a station after new data was ingested.
+    """
+    __update_snapshots([station])
+
+
+def __predict_all_stations():
+    logger.debug('Predicting all stations')
+    __update_snapshots(wr.get_stations())
     logger.debug('Done predicting all stations')
 
 
+def get_model_info():
+    """
+    Returns: A dictionary with the version, load time and load timestamp of the prediction model or None if the model
+    was not loaded yet.
+    """
+    return model_registry.get_info()
+
+
 def init():
     __predict_all_stations()
+    wd.add_data_listener(wr.config, __on_data_written)
+    # Picks up model changes and stations whose listener update failed
     schedule.every(10).minutes.do(__predict_all_stations)
@@ -0,0 +1,92 @@
+import threading
+from collections import OrderedDict
+
+
+class QueryCache:
+    """
+    Bounded LRU cache for query results.
+
+    Entries are grouped by station and invalidated per station whenever the last entry (watermark) of the station
+    advances. Cached DataFrames are never handed out directly, callers always receive a copy.
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.generations = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Returns a copy of the cached result for the given key.
+        Args:
+            key: The normalized query key. The first element has to be the station.
+
+        Returns: The cached DataFrame or None on a cache miss.
+        """
+        with self.lock:
+            df = self.entries.get(key, None)
+            if df is None:
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+
+        return df.copy()
+
+    def generation(self, station):
+        """
+        Returns the current generation of the given station. Pass it to put() to detect invalidations which happened
+        while the query was executed.
+        """
+        with self.lock:
+            return self.generations.get(station, 0)
+
+    def put(self, key, df, generation):
+        """
+        Stores a copy of the given result unless the station was invalidated since the given generation.
+        Args:
+            key: The normalized query key. The first element has to be the station.
+            df: The DataFrame to cache.
+            generation: The generation of the station before the query was executed.
+        """
+        df = df.copy()
+        with self.lock:
+            if self.generations.get(key[0], 0) != generation:
+                return
+
+            self.entries[key] = df
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, station):
+        """
+        Removes all entries of the given station.
+        """
+        with self.lock:
+            self.generations[station] = self.generations.get(station, 0) + 1
+            for key in [key for key in self.entries if key[0] == station]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def get_stats(self):
+        """
+        Returns: A dictionary with the number of hits, misses and entries and the hit rate.
+        """
+        with self.lock:
+            requests = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self.entries),
+                "hit_rate": self.hits / requests if requests > 0 else 0.0
+            }
@@ -0,0 +1,165 @@
+import logging
+import random
+import threading
+import time
+
+from service_status import ServiceStatus
+
+logger = logging.getLogger("app")
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised if a call is rejected because the circuit breaker of its endpoint is open.
+    """
+    pass
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker for a single upstream endpoint.
+
+    The breaker opens after failure_threshold consecutive failures and rejects all calls for reset_timeout seconds.
+    After that a single probe call is let through (half open). The breaker closes if the probe succeeds and opens
+    again if it fails. State changes are reported to the ServiceStatus.
+    """
+    closed = "closed"
+    open = "open"
+    half_open = "half_open"
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=60, clock=time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self.probe_in_flight = False
+        self.lock = threading.Lock()
+        self._set_state(CircuitBreaker.closed)
+
+    def _set_state(self, state):
+        self.state = state
+        ServiceStatus.update_breaker_state(self.name, state)
+
+    def allow_request(self):
+        """
+        Checks if a call may be made. Switches an open breaker to half open once the reset timeout has passed.
+        Returns: True if the call may be made.
+        """
+        with self.lock:
+            if self.state == CircuitBreaker.open and self.clock() - self.opened_at >= self.reset_timeout:
+                logger.info(f"Circuit breaker '{self.name}' half open, sending probe.")
+                self._set_state(CircuitBreaker.half_open)
+
+            if self.state == CircuitBreaker.half_open:
+                if self.probe_in_flight:
+                    return False
+                self.probe_in_flight = True
+                return True
+
+            return self.state == CircuitBreaker.closed
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.probe_in_flight = False
+            if self.state != CircuitBreaker.closed:
+                logger.info(f"Circuit breaker '{self.name}' closed.")
+                self._set_state(CircuitBreaker.closed)
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.probe_in_flight = False
+            if self.state == CircuitBreaker.half_open or self.failures >= self.failure_threshold:
+                if self.state != CircuitBreaker.open:
+                    logger.warning(f"Circuit breaker '{self.name}' opened after {self.failures} failures.")
+                self.opened_at = self.clock()
+                self._set_state(CircuitBreaker.open)
+
+    def call(self, function, *args, **kwargs):
+        """
+        Calls the given function if the breaker allows it and records the outcome.
+        Args:
+            function: The function to call.
+            *args: Positional arguments of the function.
+            **kwargs: Keyword arguments of the function.
+
+        Returns: The return value of the function.
+        Raises: CircuitOpenError if the breaker rejects the call.
+        """
+        if not self.allow_request():
+            raise CircuitOpenError(f"Circuit breaker '{self.name}' is open.")
+
+        try:
+            result = function(*args, **kwargs)
+        except Exception:
+            self.record_failure()
+            raise
+
+        self.record_success()
+        return result
+
+
+breakers = {}
+breakers_lock = threading.Lock()
+
+
+def get_breaker(name, failure_threshold=5, reset_timeout=60):
+    """
+    Returns the circuit breaker of the given endpoint. The breaker is created on first use.
+    Args:
+        name: The name of the endpoint.
+        failure_threshold: The number of consecutive failures after which a new breaker opens.
+        reset_timeout: The number of seconds a new breaker stays open before sending a probe.
+
+    Returns: The circuit breaker.
+    """
+    with breakers_lock:
+        if name not in breakers:
+            breakers[name] = CircuitBreaker(name, failure_threshold, reset_timeout)
+        return breakers[name]
+
+
+def backoff_delay(attempt, base_delay=1, max_delay=30):
+    """
+    Returns the delay before the given retry attempt using exponential backoff with full jitter.
+    Args:
+        attempt: The number of the retry attempt, starting at 1.
+        base_delay: The delay of the first attempt in seconds.
+        max_delay: The upper bound of the delay in seconds.
+
+    Returns: The delay in seconds.
+    """
+    return random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))
+
+
+def retry(function, retries=3, base_delay=1, max_delay=30, should_retry=lambda e: True, sleep=time.sleep):
+    """
+    Calls the given function and retries it with exponential backoff and jitter if it raises an exception.
+    Calls rejected by an open circuit breaker are not retried.
+    Args:
+        function: The function to call without arguments.
+        retries: The maximum number of retries.
+        base_delay: The delay before the first retry in seconds.
+        max_delay: The upper bound of the delay in seconds.
+        should_retry: Predicate deciding if an exception is worth a retry.
+        sleep: The function used to wait between attempts.
+
+    Returns: The return value of the function.
+    """
+    attempt = 0
+    while True:
+        try:
+            return function()
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            attempt += 1
+            if attempt > retries or not should_retry(e):
+                raise
+
+            delay = backoff_delay(attempt, base_delay, max_delay)
+            logger.warning(f"Attempt {attempt} failed ({e}). Trying again in {delay:.1f} seconds...")
+            sleep(delay)
@@ -0,0 +1,165 @@
+"""Rollups of the weather measurements
+
+Maintains hourly and daily rollup measurements (e.g. mythenquai_1h) holding
+the mean, sum, min, max and count of every field of a station. The rollups are
+computed inside InfluxDB with SELECT ... INTO queries for the time buckets
+touched by newly written data.
+
+The history can be rolled up with:
+
+    python rollups.py --backfill [--station mythenquai]
+"""
+
+import argparse
+import logging
+
+import pandas as pd
+
+import weather_data as wd
+
+logger = logging.getLogger("app")
+
+# Rollup resolutions ordered from fine to coarse
+resolutions = {
+    "1h": pd.Timedelta(hours=1),
+    "1d": pd.Timedelta(days=1)
+}
+# The sum is stored to aggregate the means of multiple buckets weighted by their count
+functions = ["mean", "sum", "min", "max", "count"]
+# All fields of the stations, the water level is only contained in the CSV files
+fields = sorted((set(wd.Config.keys_mapping.values()) - {'timestamp'}) | {'water_level'})
+backfill_window = pd.Timedelta(days=31)
+
+
+def get_rollup_measurement(station, resolution):
+    """
+    Returns the name of the rollup measurement of a station.
+    Args:
+        station: The station.
+        resolution: The resolution of the rollup (e.g. "1h").
+
+    Returns: The name of the rollup measurement.
+    """
+    return f"{station}_{resolution}"
+
+
+def create_rollup_query_string(station, resolution, start, stop):
+    """
+    Creates the SELECT ... INTO query string which rolls up the data of the station between start (inclusive) and
+    stop (exclusive).
+    Args:
+        station: The station.
+        resolution: The resolution of the rollup (e.g. "1h").
+        start: The start of the time range (UTC), aligned to the resolution.
+        stop: The stop of the time range (UTC), aligned to the resolution.
+
+    Returns: The query string.
+    """
+    select = ','.join(f'{function}({field}) AS {field}_{function}' for field in fields for function in functions)
+    return f"SELECT {select} INTO {get_rollup_measurement(station, resolution)} FROM {station} " \
+           f"WHERE time >= '{start:%Y-%m-%dT%H:%M:%SZ}' AND time < '{stop:%Y-%m-%dT%H:%M:%SZ}' " \
+           f"GROUP BY time({resolution})"
+
+
+def update_rollups(config, station, first_time, last_time):
+    """
+    Recomputes all rollup buckets of the station which contain data between first_time and last_time.
+    Args:
+        config: The Config containing the DB connection info.
+        station: The station.
+        first_time: The time of the first new measurement.
+        last_time: The time of the last new measurement.
+
+    Returns: None
+    """
+    first_time = pd.Timestamp(first_time).tz_convert('UTC')
+    last_time = pd.Timestamp(last_time).tz_convert('UTC')
+
+    for resolution, delta in resolutions.items():
+        start = first_time.floor(delta)
+        stop = last_time.floor(delta) + delta
+        with config.db_query_slots:
+            config.client.query(create_rollup_query_string(station, resolution, start, stop), database=config.db_name,
+                                method="POST")
+
+
+def on_data_written(config, station, data):
+    """
+    Data listener for weather_data.py which updates the rollups of newly written data.
+    """
+    if data is not None and not data.empty:
+        update_rollups(config, station, data.index.min(), data.index.max())
+
+
+def backfill(config, station):
+    """
+    Rolls up the whole history of a station in windows of backfill_window.
+    Args:
+        config: The Config containing the DB connection info.
+        station: The station.
+
+    Returns: None
+    """
+    with config.db_query_slots:
+        first = config.client.query(f"SELECT * FROM {station} ORDER BY time ASC LIMIT 1", database=config.db_name)
+        last = config.client.query(f"SELECT * FROM {station} ORDER BY time DESC LIMIT 1", database=config.db_name)
+    if station not in first or station not in last:
+        logger.info(f"No data to roll up for {station}.")
+        return
+
+    start = first[station].index[0].tz_convert('UTC')
+    stop = last[station].index[0].tz_convert('UTC')
+    logger.info(f"Rolling up {station} from {start} to {stop}..")
+
+    while start <= stop:
+        window_stop = min(start + backfill_window, stop)
+        update_rollups(config, station, start, window_stop)
+        start = window_stop.floor(resolutions["1d"]) + resolutions["1d"]
+
+    logger.info(f"Rolled up {station}.")
+
+
+def has_rollups(config, station):
+    """
+    Checks if rollups exist for the station.
+    Returns: True if the coarsest rollup measurement of the station contains data.
+    """
+    measurement = get_rollup_measurement(station, list(resolutions)[-1])
+    with config.db_query_slots:
+        result = config.client.query(f"SELECT * FROM {measurement} LIMIT 1", database=config.db_name)
+    return measurement in result
+
+
+def ensure_backfilled(config):
+    """
+    Backfills the rollups of all stations which do not have any rollups yet.
+    Args:
+        config: The Config containing the DB connection info.
+
+    Returns: None
+    """
+    for station in config.stations:
+        if not has_rollups(config, station):
+            backfill(config, station)
+
+
+if __name__ == '__main__':
+    import os
+
+    logging.basicConfig(level=logging.INFO, format="[%(asctime)s] - [%(levelname)s] : %(message)s")
+
+    parser = argparse.ArgumentParser(description="Maintain the rollup measurements of the weather stations.")
+    parser.add_argument("--backfill", action="store_true", help="Roll up the whole history of the stations.")
+    parser.add_argument("--station", help="Only roll up the given station.")
+    args = parser.parse_args()
+
+    config = wd.Config()
+    config.db_host = os.environ.get("INFLUXDB_HOST", config.db_host)
+    config.db_port = int(os.environ.get("INFLUXDB_PORT", config.db_port))
+    wd.connect_db(config)
+
+    if args.backfill:
+        for station in ([args.station] if args.station else config.stations):
+            backfill(config, station)
+    else:
+        parser.print_help()
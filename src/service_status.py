@@ -2,6 +2,8 @@ class ServiceStatus:
     is_live = False
     last_fetch = None
     last_update = None
+    breaker_states = {}
+    ingest_lag = {}
 
     @staticmethod
     def get_status():
@@ -11,4 +13,20 @@ class ServiceStatus:
     def update_last_fetch(time):
         # Convert time to current timezone
         if time is not None:
-            ServiceStatus.last_fetch = time.tz_localize('UTC').tz_convert('Europe/Berlin')
\ No newline at end of file
+            ServiceStatus.last_fetch = time.tz_localize('UTC').tz_convert('Europe/Berlin')
+
+    @staticmethod
+    def update_breaker_state(name, state):
+        ServiceStatus.breaker_states[name] = state
+
+    @staticmethod
+    def get_breaker_states():
+        return dict(ServiceStatus.breaker_states)
+
+    @staticmethod
+    def update_ingest_lag(station, seconds):
+        ServiceStatus.ingest_lag[station] = seconds
+
+    @staticmethod
+    def get_ingest_lag():
+        return dict(ServiceStatus.ingest_lag)
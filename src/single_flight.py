@@ -0,0 +1,67 @@
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical calls.
+
+    The first caller of a key executes the function, callers with the same key arriving while it is in flight wait for
+    it and receive the same result (or exception). Results are not cached, a call after the flight finished executes
+    the function again.
+    """
+
+    def __init__(self):
+        self.calls = {}
+        self.executions = 0
+        self.shared = 0
+        self.lock = threading.Lock()
+
+    def do(self, key, function):
+        """
+        Executes the function unless a call with the same key is already in flight.
+        Args:
+            key: Hashable key identifying identical calls.
+            function: Function without arguments.
+
+        Returns: The result of the function, shared by all callers of the flight.
+        """
+        with self.lock:
+            call = self.calls.get(key, None)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self.calls[key] = call
+                self.executions += 1
+            else:
+                self.shared += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+
+    def get_stats(self):
+        """
+        Returns: A dictionary with the number of executed and shared calls and the calls in flight.
+        """
+        with self.lock:
+            return {"executions": self.executions, "shared": self.shared, "in_flight": len(self.calls)}
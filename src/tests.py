@@ -1,8 +1,39 @@
 import datetime
+import gzip
+import http.server
+import json
+import multiprocessing
+import os
+import pickle
+import shutil
+import socket
+import tempfile
+import threading
+import time
 import unittest
+import unittest.mock
+
+import numpy as np
+import pandas as pd
 
 import app
+import backtest
+import csv_import
+import downsampling
+import event_stream
+import fragment_cache
+import http_cache
+import ingestion_schedule
+import model_registry
+import plot_renderer
+import plotting
+import prediction
+import resilience
+import rollups
+import single_flight
+import weather_data as wd
 import weather_repository as wr
+import window_store
 
 
 class WeatherQueryTestCase(unittest.TestCase):
@@ -23,7 +54,284 @@ class WeatherQueryTestCase(unittest.TestCase):
         self.assertEqual("SELECT water_temperature,air_temperature FROM test WHERE time >= '2021-01-01T00:00:00Z' AND time <= '2021-01-01T00:00:00Z'", query.create_query_string())
 
 
+    def test_query_with_aggregation(self):
+        """
+        Test that the weather_query string contains the aggregate function, the GROUP BY interval and the fill option.
+        """
+        measurements = [wr.Measurement.Wind_speed_avg_10min, wr.Measurement.Air_temp]
+        query = wr.WeatherQuery(station="test", measurements=measurements, start_time=datetime.datetime(2021, 1, 1, 0, 0, 0),
+                                stop_time=datetime.datetime(2021, 1, 8, 0, 0, 0), aggregation=wr.Aggregation.Mean,
+                                group_by_interval=datetime.timedelta(hours=1), fill="linear")
+        self.assertEqual("SELECT mean(wind_speed_avg_10min) AS wind_speed_avg_10min,mean(air_temperature) AS air_temperature "
+                         "FROM test WHERE time >= '2021-01-01T00:00:00Z' AND time <= '2021-01-08T00:00:00Z' "
+                         "GROUP BY time(1h) fill(linear)", query.create_query_string())
+
+        query = wr.WeatherQuery(station="test", measurements=[wr.Measurement.Air_temp], aggregation=wr.Aggregation.Max)
+        self.assertEqual("SELECT max(air_temperature) AS air_temperature FROM test", query.create_query_string())
+
+        query.aggregation = [wr.Aggregation.Min, wr.Aggregation.Count]
+        self.assertEqual("SELECT min(air_temperature) AS air_temperature_min,count(air_temperature) AS air_temperature_count "
+                         "FROM test", query.create_query_string())
+
+    def test_route_to_rollup(self):
+        """
+        Test that long-range aggregated queries are routed to the coarsest rollup dividing the GROUP BY interval.
+        """
+        start = datetime.datetime(2021, 1, 1, 0, 10, 0)
+        query = wr.WeatherQuery(station="test", measurements=[wr.Measurement.Air_temp], start_time=start,
+                                stop_time=datetime.datetime(2021, 3, 1, 0, 0, 0), aggregation=wr.Aggregation.Max,
+                                group_by_interval=datetime.timedelta(days=7))
+        routed = query.route_to_rollup(rollups.resolutions, datetime.timedelta(days=2))
+        self.assertEqual("test_1d", routed.get_series_name())
+        self.assertEqual("SELECT max(air_temperature_max) AS air_temperature FROM test_1d WHERE "
+                         "time >= '2021-01-01T00:00:00Z' AND time <= '2021-03-01T00:00:00Z' GROUP BY time(7d)",
+                         routed.create_query_string())
+
+        query.aggregation = wr.Aggregation.Mean
+        self.assertEqual("SELECT sum(air_temperature_sum) / sum(air_temperature_count) AS air_temperature FROM test_1d "
+                         "WHERE time >= '2021-01-01T00:00:00Z' AND time <= '2021-03-01T00:00:00Z' GROUP BY time(7d)",
+                         query.route_to_rollup(rollups.resolutions, datetime.timedelta(days=2)).create_query_string())
+
+        query.aggregation = [wr.Aggregation.Mean, wr.Aggregation.Count]
+        self.assertEqual("SELECT sum(air_temperature_sum) / sum(air_temperature_count) AS air_temperature_mean,"
+                         "sum(air_temperature_count) AS air_temperature_count FROM test_1d "
+                         "WHERE time >= '2021-01-01T00:00:00Z' AND time <= '2021-03-01T00:00:00Z' GROUP BY time(7d)",
+                         query.route_to_rollup(rollups.resolutions, datetime.timedelta(days=2)).create_query_string())
+
+        query.group_by_interval = "3h"
+        self.assertEqual("1h", query.route_to_rollup(rollups.resolutions, datetime.timedelta(days=2)).rollup)
+
+        query.group_by_interval = datetime.timedelta(minutes=30)
+        self.assertIs(query, query.route_to_rollup(rollups.resolutions, datetime.timedelta(days=2)))
+        query.group_by_interval = "1h"
+        query.stop_time = datetime.datetime(2021, 1, 2, 0, 0, 0)
+        self.assertIs(query, query.route_to_rollup(rollups.resolutions, datetime.timedelta(days=2)))
+
+
+class WindowStoreTestCase(unittest.TestCase):
+    def create_data(self, start, periods):
+        index = pd.date_range(start, periods=periods, freq="10min", tz="UTC")
+        return pd.DataFrame({"air_temperature": np.arange(periods, dtype=float)}, index=index)
+
+    def test_ring_buffer(self):
+        """
+        Test that the ring buffer keeps the latest rows, ignores old rows and only answers covered time ranges.
+        """
+        window = window_store.StationWindow(["air_temperature", "wind_direction"], capacity=10)
+        window.append(self.create_data("2023-01-01T00:00:00", 8))
+        window.append(self.create_data("2023-01-01T01:00:00", 6))
+        window.append(self.create_data("2023-01-01T00:00:00", 3))
+
+        latest = window.query(["air_temperature"])
+        self.assertEqual(pd.Timestamp("2023-01-01T01:50:00", tz="UTC"), latest.index[0])
+        self.assertEqual(5.0, latest["air_temperature"].iloc[0])
+
+        data = window.query(["air_temperature", "wind_direction"], pd.Timestamp("2023-01-01T00:20:00"),
+                            pd.Timestamp("2023-01-01T01:00:00"))
+        self.assertEqual([2.0, 3.0, 4.0, 5.0, 6.0], data["air_temperature"].tolist())
+        self.assertTrue(data["wind_direction"].isna().all())
+
+        # The first rows were overwritten
+        self.assertIsNone(window.query(["air_temperature"], pd.Timestamp("2023-01-01T00:10:00"),
+                                       pd.Timestamp("2023-01-01T01:00:00")))
+        self.assertIsNone(window.query(["humidity"]))
+
+    def test_query_fields(self):
+        """
+        Test that like InfluxDB only the requested fields, only fields with values and no rows without values are
+        returned.
+        """
+        window = window_store.StationWindow(["air_temperature", "humidity", "water_level"], capacity=10)
+        data = self.create_data("2023-01-01T00:00:00", 4)
+        data["humidity"] = [50.0, 51.0, 52.0, np.nan]
+        data.loc[data.index[1], "air_temperature"] = np.nan
+        window.append(data)
+
+        self.assertEqual(["air_temperature", "humidity"], list(window.query(None).columns))
+        self.assertEqual(pd.Timestamp("2023-01-01T00:20:00", tz="UTC"), window.query(["humidity"]).index[0])
+
+        data = window.query(["air_temperature"], pd.Timestamp("2023-01-01T00:00:00"),
+                            pd.Timestamp("2023-01-01T00:30:00"))
+        self.assertEqual(["air_temperature"], list(data.columns))
+        self.assertEqual([0.0, 2.0, 3.0], data["air_temperature"].tolist())
+        self.assertIsNone(window.query(["water_level"], pd.Timestamp("2023-01-01T00:00:00"),
+                                       pd.Timestamp("2023-01-01T00:30:00")))
+
+    def test_warm(self):
+        """
+        Test that a warmed window covers the loaded time range even if it holds no data at its start.
+        """
+        window = window_store.StationWindow(["air_temperature"], capacity=100)
+        window.warm(self.create_data("2023-01-01T06:00:00", 6), pd.Timestamp("2023-01-01T00:00:00", tz="UTC"))
+
+        self.assertEqual(6, len(window.query(["air_temperature"], pd.Timestamp("2023-01-01T00:00:00"),
+                                             pd.Timestamp("2023-01-02T00:00:00"))))
+        self.assertIsNone(window.query(["air_temperature"], pd.Timestamp("2022-12-31T23:50:00"),
+                                       pd.Timestamp("2023-01-02T00:00:00")))
+
+
+class SingleFlightTestCase(unittest.TestCase):
+    def test_shared_error(self):
+        """
+        Test that callers waiting for a flight receive its exception and that finished flights are executed again.
+        """
+        flights = single_flight.SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        errors = []
+
+        def fail():
+            started.set()
+            release.wait(5)
+            raise ValueError("failed")
+
+        def call():
+            try:
+                flights.do("key", fail)
+            except ValueError as e:
+                errors.append(e)
+
+        leader = threading.Thread(target=call)
+        leader.start()
+        started.wait(5)
+        follower = threading.Thread(target=call)
+        follower.start()
+        while flights.get_stats()["shared"] < 1:
+            time.sleep(0.01)
+        release.set()
+        leader.join(5)
+        follower.join(5)
+
+        self.assertEqual(2, len(errors))
+        self.assertEqual(1, flights.get_stats()["executions"])
+        self.assertEqual(1, flights.do("key", lambda: 1))
+        self.assertEqual({"executions": 2, "shared": 1, "in_flight": 0}, flights.get_stats())
+
+
 class WeatherRepositoryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.client = FakeDbClient({"mythenquai": pd.Timestamp("2023-01-01T12:00:00", tz="UTC")})
+        self.client.queries = []
+        query = self.client.query
+        self.client.query = lambda query_string, **kwargs: self.client.queries.append(query_string) or query(query_string)
+        self.addCleanup(setattr, wr.config, "client", wr.config.client)
+        self.addCleanup(setattr, wr.config, "db_query_slots", wr.config.db_query_slots)
+        wr.config.client = self.client
+        wd.connect_db(wr.config)
+        wr.query_cache.clear()
+        self.addCleanup(wr.query_cache.clear)
+        self.addCleanup(setattr, wr, "window_store", wr.window_store)
+        wr.window_store = wr.WindowStore(fields=["air_temperature", "wind_direction"], days=1)
+
+    def test_query_cache(self):
+        """
+        Test that identical queries within the same interval are answered from the cache until the station is
+        invalidated and that callers receive independent copies.
+        """
+        start = datetime.datetime(2023, 1, 1, 0, 1, 0)
+        first = wr.run_query(wr.WeatherQuery("mythenquai", [wr.Measurement.Air_temp], start,
+                                             datetime.datetime(2023, 1, 1, 12, 3, 0)))
+        first["air_temperature"] = 99.0
+        second = wr.run_query(wr.WeatherQuery("mythenquai", [wr.Measurement.Air_temp], start,
+                                              datetime.datetime(2023, 1, 1, 12, 8, 0)))
+
+        self.assertEqual(1, len(self.client.queries))
+        self.assertEqual("SELECT air_temperature FROM mythenquai WHERE time >= '2023-01-01T00:10:00Z' AND "
+                         "time <= '2023-01-01T12:00:00Z'", self.client.queries[0])
+        self.assertEqual(1.0, second["air_temperature"].iloc[0])
+        self.assertEqual(1, wr.get_query_cache_stats()["hits"])
+
+        wr.query_cache.invalidate("mythenquai")
+        wr.run_query(wr.WeatherQuery("mythenquai", [wr.Measurement.Air_temp], start,
+                                     datetime.datetime(2023, 1, 1, 12, 3, 0)))
+        self.assertEqual(2, len(self.client.queries))
+
+    def test_concurrent_queries(self):
+        """
+        Test that concurrent identical queries share one database query and that the number of concurrent database
+        queries is limited.
+        """
+        release = threading.Event()
+        running = []
+        max_running = []
+        query = self.client.query
+
+        def blocking_query(query_string, **kwargs):
+            running.append(query_string)
+            max_running.append(len(running))
+            release.wait(5)
+            running.remove(query_string)
+            return query(query_string, **kwargs)
+
+        self.client.query = blocking_query
+        self.addCleanup(setattr, wr.config, "db_max_concurrent_queries", wr.config.db_max_concurrent_queries)
+        wr.config.db_max_concurrent_queries = 1
+        wd.connect_db(wr.config)
+        shared = wr.query_flights.get_stats()["shared"]
+
+        start = datetime.datetime(2023, 1, 1, 0, 0, 0)
+        stops = [datetime.datetime(2023, 1, 1, 12, 0, 0)] * 3 + [datetime.datetime(2023, 1, 1, 11, 0, 0)]
+        results = [None] * len(stops)
+
+        def run(i):
+            results[i] = wr.run_query(wr.WeatherQuery("mythenquai", [wr.Measurement.Air_temp], start, stops[i]))
+
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(len(stops))]
+        for thread in threads:
+            thread.start()
+        while wr.query_flights.get_stats()["shared"] < shared + 2:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(2, len(self.client.queries))
+        self.assertEqual([1], list(set(max_running)))
+        results[0]["air_temperature"] = 99.0
+        self.assertEqual(1.0, results[1]["air_temperature"].iloc[0])
+
+    def test_health_check(self):
+        """
+        Test that the health check queries the database even if the latest measurement is cached.
+        """
+        for attribute in ["is_live", "last_fetch", "last_update"]:
+            self.addCleanup(setattr, wr.ServiceStatus, attribute, getattr(wr.ServiceStatus, attribute))
+        self.addCleanup(setattr, wr.config, "stations", wr.config.stations)
+        wr.config.stations = ["mythenquai"]
+        wr.run_query(wr.WeatherQuery("mythenquai", [wr.Measurement.Air_temp]))
+
+        self.assertTrue(wr.health_check())
+        self.assertEqual(2, len(self.client.queries))
+
+        def unavailable(query_string, **kwargs):
+            raise ConnectionError("Database down")
+
+        self.client.query = unavailable
+        with self.assertLogs("app", level="ERROR"):
+            self.assertFalse(wr.health_check())
+        self.assertFalse(wr.ServiceStatus.is_live)
+
+    def test_query_window_store(self):
+        """
+        Test that queries covered by the window store are answered without querying the database.
+        """
+        index = pd.date_range("2023-01-01T00:00:00", periods=6, freq="10min", tz="UTC")
+        wr.window_store.warm("mythenquai", pd.DataFrame({"air_temperature": np.arange(6.0)}, index=index),
+                             pd.Timestamp("2023-01-01T00:00:00", tz="UTC"))
+
+        data = wr.run_query(wr.WeatherQuery("mythenquai", [wr.Measurement.Air_temp],
+                                            datetime.datetime(2023, 1, 1, 0, 5), datetime.datetime(2023, 1, 1, 1, 0)))
+        self.assertEqual([1.0, 2.0, 3.0, 4.0, 5.0], data["air_temperature"].tolist())
+        self.assertEqual("Europe/Zurich", str(data.index.tz))
+
+        latest = wr.run_query(wr.WeatherQuery("mythenquai", [wr.Measurement.Air_temp]))
+        self.assertEqual([5.0], latest["air_temperature"].tolist())
+        self.assertEqual([], self.client.queries)
+
+        wr.run_query(wr.WeatherQuery("mythenquai", [wr.Measurement.Air_temp], datetime.datetime(2022, 12, 31),
+                                     datetime.datetime(2023, 1, 1, 1, 0)))
+        self.assertEqual(1, len(self.client.queries))
+
     def test_get_units(self):
         """
         Test that the right units are returned for the different measurements using the unit_mapping dictionary.
@@ -36,6 +344,799 @@ class WeatherRepositoryTestCase(unittest.TestCase):
         self.assertEqual("hPa", wr.get_unit(wr.Measurement.Pressure.value))
         self.assertEqual("mm", wr.get_unit(wr.Measurement.Precipitation.value))
 
+class RollupsTestCase(unittest.TestCase):
+    def test_update_rollups(self):
+        """
+        Test that all hourly and daily buckets touched by new data are recomputed.
+        """
+        config = wd.Config()
+        config.client = FakeDbClient({})
+        config.client.query = lambda query, **kwargs: queries.append(query)
+        wd.connect_db(config)
+        queries = []
+
+        index = pd.to_datetime(["2023-01-01T22:50:00Z", "2023-01-02T00:10:00Z"])
+        rollups.on_data_written(config, "test", pd.DataFrame({"air_temperature": [1.0, 2.0]}, index=index))
+
+        self.assertEqual(2, len(queries))
+        self.assertIn("mean(air_temperature) AS air_temperature_mean,sum(air_temperature) AS air_temperature_sum,"
+                      "min(air_temperature) AS air_temperature_min,"
+                      "max(air_temperature) AS air_temperature_max,count(air_temperature) AS air_temperature_count",
+                      queries[0])
+        self.assertTrue(queries[0].endswith("INTO test_1h FROM test WHERE time >= '2023-01-01T22:00:00Z' AND "
+                                            "time < '2023-01-02T01:00:00Z' GROUP BY time(1h)"))
+        self.assertTrue(queries[1].endswith("INTO test_1d FROM test WHERE time >= '2023-01-01T00:00:00Z' AND "
+                                            "time < '2023-01-03T00:00:00Z' GROUP BY time(1d)"))
+
+
+class CsvImportTestCase(unittest.TestCase):
+    def test_to_line_protocol(self):
+        """
+        Test that rows are converted to line protocol with missing values omitted and empty rows dropped.
+        """
+        data = pd.DataFrame({"air_temperature": [8.9, np.nan, np.nan], "wind_direction": [149.0, 155.0, np.nan]},
+                            index=pd.to_datetime(["2022-12-31T23:00:00+00:00", "2022-12-31T23:10:00+00:00",
+                                                  "2022-12-31T23:20:00+00:00"], utc=True))
+        lines = csv_import.to_line_protocol(data, "test").tolist()
+        self.assertEqual(["test air_temperature=8.9,wind_direction=149.0 1672527600",
+                          "test wind_direction=155.0 1672528200"], lines)
+
+    def test_read_chunks(self):
+        """
+        Test that the CSV file is parsed with a UTC index, float columns and '.' as missing value.
+        """
+        data = next(csv_import.read_chunks("./csv/messwerte_mythenquai.csv", 10))
+        self.assertEqual(10, len(data))
+        self.assertEqual(pd.Timestamp("2022-12-31T23:00:00", tz="UTC"), data.index[0])
+        self.assertNotIn("timestamp_cet", data.columns)
+        self.assertTrue(all(dtype == np.float64 for dtype in data.dtypes))
+
+    def test_resume_from_checkpoint(self):
+        """
+        Test that a second import only writes the rows appended to the CSV file since the first import.
+        """
+        class Client:
+            def __init__(self):
+                self.lines = []
+
+            def write(self, lines, params=None, protocol=None):
+                self.lines.extend(lines)
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        file_name = os.path.join(directory, "messwerte_test.csv")
+        with open("./csv/messwerte_mythenquai.csv", "r") as f:
+            content = f.readlines()
+        with open(file_name, "w") as f:
+            f.writelines(content[:101])
+
+        config = wr.wd.Config()
+        config.client = Client()
+        config.historic_data_checkpoint_file = os.path.join(directory, "checkpoints.json")
+
+        rows, last_entry = csv_import.import_csv_file(config, "test", file_name)
+        self.assertEqual(100, rows)
+
+        with open(file_name, "a") as f:
+            f.writelines(content[101:111])
+
+        config.client = Client()
+        last_db_time = last_entry.index[-1].tz_convert(None)
+        rows, last_entry = csv_import.import_csv_file(config, "test", file_name, last_db_time)
+        self.assertEqual(10, rows)
+        self.assertEqual(10, len(config.client.lines))
+        self.assertEqual(pd.Timestamp(content[110].split(",")[0]), last_entry.index[-1])
+
+        # Without data in the database the whole file is imported again
+        config.client = Client()
+        rows, _ = csv_import.import_csv_file(config, "test", file_name, None)
+        self.assertEqual(110, rows)
+
+
+class CsvDownloadTestCase(unittest.TestCase):
+    def setUp(self):
+        content = b"timestamp_utc,timestamp_cet,air_temperature\n2023-01-01T00:00:00+00:00,2023-01-01T01:00:00+01:00,1.0\n"
+        requests_received = self.requests_received = []
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                requests_received.append(self.path)
+                if self.headers.get("If-None-Match") == '"v1"':
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "text/csv")
+                self.send_header("ETag", '"v1"')
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        for name, value in [("csv_directory", directory),
+                            ("csv_download_state_file", os.path.join(directory, "download_state.json")),
+                            ("csv_download_url", f"http://127.0.0.1:{self.server.server_port}/{{station}}_{{year}}.csv")]:
+            self.addCleanup(setattr, wr, name, getattr(wr, name))
+            setattr(wr, name, value)
+        self.content = content
+
+    def test_conditional_download(self):
+        """
+        Test that the CSV file is downloaded once and that a second download is skipped using the stored ETag.
+        """
+        self.assertTrue(wr.download_latest_csv_files("test"))
+        with open(wr.get_csv_file_name("test"), "rb") as f:
+            self.assertEqual(self.content, f.read())
+
+        self.assertFalse(wr.download_latest_csv_files("test"))
+        self.assertEqual(2, len(self.requests_received))
+        self.assertEqual(["download_state.json", "messwerte_test.csv"], sorted(os.listdir(wr.csv_directory)))
+
+
+class FakeResponse:
+    def __init__(self, payload):
+        self.ok = True
+        self.status_code = 200
+        self.content = json.dumps(payload).encode()
+
+    def raise_for_status(self):
+        pass
+
+
+class FakeApiSession:
+    """
+    Stand-in for the requests session used to query the measurements API. Returns one measurement per day at noon.
+    """
+    def __init__(self, max_rows=None):
+        self.requests = []
+        self.max_rows = max_rows
+        self.lock = threading.Lock()
+
+    def get(self, url, params=None, **kwargs):
+        with self.lock:
+            self.requests.append((url, params))
+        start = datetime.datetime.strptime(params["startDate"], "%Y-%m-%d")
+        stop = datetime.datetime.strptime(params["endDate"], "%Y-%m-%d")
+        result = [{"timestamp": f"{day:%Y-%m-%d}T12:00:00.000Z", "values": {"air_temperature": {"value": 1.5}}}
+                  for day in pd.date_range(start, stop, freq="D", inclusive="left")]
+        total_count = len(result)
+        if self.max_rows is not None:
+            result = result[:self.max_rows]
+        return FakeResponse({"ok": True, "total_count": total_count, "result": result})
+
+
+class FakeDbClient:
+    """
+    Stand-in for the InfluxDB DataFrameClient which records all written DataFrames.
+    """
+    def __init__(self, last_entries):
+        self.last_entries = last_entries
+        self.written = []
+
+    def query(self, query, **kwargs):
+        station = query.split(" FROM ")[1].split(" ")[0]
+        return {station: pd.DataFrame({"air_temperature": [1.0]}, index=[self.last_entries[station]])}
+
+    def write_points(self, data, station, **kwargs):
+        self.written.append((station, data))
+
+
+class ImportLatestDataTestCase(unittest.TestCase):
+    def test_backfill(self):
+        """
+        Test that all missing days of all stations are fetched and committed with one write per station in order.
+        """
+        now = pd.Timestamp.now("UTC").floor("D")
+        config = wd.Config()
+        config.stations = ["first", "second"]
+        config.stations_last_entries = {}
+        config.client = FakeDbClient({"first": now - pd.Timedelta(days=3), "second": now - pd.Timedelta(days=1)})
+        wd.connect_db(config)
+        config.session = FakeApiSession()
+
+        wd.import_latest_data(config, periodic_read=False)
+
+        self.assertEqual(["first", "second"], [station for station, _ in config.client.written])
+        first = config.client.written[0][1]
+        self.assertTrue(first.index.is_monotonic_increasing)
+        self.assertGreaterEqual(len(first), 3)
+        self.assertTrue((first.index > now - pd.Timedelta(days=3)).all())
+
+    def test_adaptive_window(self):
+        """
+        Test that the catch-up starts at the largest window, grows after small responses and that truncated
+        responses are split until complete.
+        """
+        now = pd.Timestamp.now("UTC").floor("D")
+        config = wd.Config()
+        config.stations = ["first"]
+        config.stations_last_entries = {}
+        config.api_window_days = {"first": 8}
+        config.client = FakeDbClient({"first": now - pd.Timedelta(days=20)})
+        wd.connect_db(config)
+        config.session = FakeApiSession(max_rows=3)
+
+        wd.import_latest_data(config, periodic_read=False)
+
+        written = config.client.written[0][1]
+        expected_days = pd.date_range(now - pd.Timedelta(days=20), now, freq="D").tz_localize(None)
+        self.assertEqual(list(expected_days), list(written.index.tz_localize(None).floor("D")))
+        # The windows of 8 days were split
+        self.assertGreater(len(config.session.requests), 3)
+
+        # Without a window size, the catch-up starts at the largest window within api_window_max_rows
+        config.session = FakeApiSession()
+        config.api_window_days = {}
+        config.stations_last_entries = {}
+        config.client = FakeDbClient({"first": now - pd.Timedelta(days=20)})
+        wd.connect_db(config)
+        wd.import_latest_data(config, periodic_read=False)
+        windows = [(pd.Timestamp(params["endDate"]) - pd.Timestamp(params["startDate"])).days
+                   for _, params in config.session.requests]
+        self.assertEqual([2000 // 144, 21 - 2000 // 144], windows)
+
+        # A small window grows with the first small response, during the catch-up
+        config.session = FakeApiSession()
+        config.api_window_days = {"first": 1}
+        config.stations_last_entries = {}
+        config.client = FakeDbClient({"first": now - pd.Timedelta(days=20)})
+        wd.connect_db(config)
+        wd.import_latest_data(config, periodic_read=False)
+        self.assertEqual(config.api_window_max_days, config.api_window_days["first"])
+        self.assertEqual(2, len(config.session.requests))
+        written = config.client.written[0][1]
+        self.assertEqual(list(expected_days), list(written.index.tz_localize(None).floor("D")))
+
+
+class ResilienceTestCase(unittest.TestCase):
+    def test_circuit_breaker(self):
+        """
+        Test that the breaker opens after the failure threshold, lets a single probe through after the reset timeout
+        and closes again once the probe succeeds.
+        """
+        now = [0]
+        breaker = resilience.CircuitBreaker("test_endpoint", failure_threshold=2, reset_timeout=60,
+                                            clock=lambda: now[0])
+
+        def fail():
+            raise ConnectionError("unavailable")
+
+        for _ in range(2):
+            self.assertRaises(ConnectionError, breaker.call, fail)
+        self.assertEqual(resilience.CircuitBreaker.open, breaker.state)
+        self.assertEqual("open", wr.ServiceStatus.get_breaker_states()["test_endpoint"])
+        self.assertRaises(resilience.CircuitOpenError, breaker.call, lambda: True)
+
+        now[0] = 61
+        self.assertTrue(breaker.allow_request())
+        self.assertEqual(resilience.CircuitBreaker.half_open, breaker.state)
+        self.assertFalse(breaker.allow_request())
+        breaker.record_success()
+        self.assertEqual(resilience.CircuitBreaker.closed, breaker.state)
+        self.assertTrue(breaker.call(lambda: True))
+
+    def test_retry(self):
+        """
+        Test that failing calls are retried with bounded, growing delays and give up after the maximum of retries.
+        """
+        calls = []
+        delays = []
+
+        def fail():
+            calls.append(1)
+            raise ConnectionError("unavailable")
+
+        self.assertRaises(ConnectionError, resilience.retry, fail, retries=3, base_delay=1, max_delay=2,
+                          sleep=delays.append)
+        self.assertEqual(4, len(calls))
+        self.assertEqual(3, len(delays))
+        self.assertTrue(all(0 <= delay <= 2 for delay in delays))
+
+
+class IngestionScheduleTestCase(unittest.TestCase):
+    def test_publish_aligned_polling(self):
+        """
+        Test that polls are scheduled just after the learned publish time and retried briefly when data is missing.
+        """
+        start = datetime.datetime(2023, 1, 1, 12, 0, 0)
+        schedule = ingestion_schedule.IngestionSchedule(["test"], margin=datetime.timedelta(seconds=15),
+                                                        retry_interval=datetime.timedelta(seconds=30),
+                                                        max_retries=2)
+
+        # Measurements every 10 minutes which are published 2 minutes later
+        for i in range(3):
+            measurement = start + datetime.timedelta(minutes=10 * i)
+            schedule.observe("test", measurement, measurement + datetime.timedelta(minutes=2))
+
+        self.assertEqual(datetime.timedelta(minutes=10), schedule.cadences["test"].interval)
+        self.assertEqual(datetime.timedelta(minutes=2), schedule.cadences["test"].delay)
+        expected = start + datetime.timedelta(minutes=32, seconds=15)
+        self.assertEqual(expected, schedule.next_poll())
+
+        schedule.miss("test", expected)
+        self.assertEqual(expected + datetime.timedelta(seconds=30), schedule.next_poll())
+        schedule.miss("test", expected + datetime.timedelta(seconds=30))
+        schedule.miss("test", expected + datetime.timedelta(seconds=60))
+        self.assertEqual(expected + datetime.timedelta(minutes=10), schedule.next_poll())
+        self.assertEqual([], schedule.due_stations(expected + datetime.timedelta(minutes=5)))
+        self.assertEqual(["test"], schedule.due_stations(expected + datetime.timedelta(minutes=10)))
+
+
+class ModelRegistryTestCase(unittest.TestCase):
+    def test_reload_on_change(self):
+        """
+        Test that the model is loaded once and reloaded only if the content of the file changed.
+        """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "model.pkl")
+        with open(path, "wb") as f:
+            pickle.dump({"weights": [1]}, f)
+
+        registry = model_registry.ModelRegistry(path)
+        self.assertIsNone(registry.get_info())
+        model = registry.get()
+        version = registry.get_info()["version"]
+        self.assertIs(model, registry.get())
+
+        # Touching the file does not reload the model
+        os.utime(path, ns=(0, 1))
+        self.assertIs(model, registry.get())
+
+        with open(path, "wb") as f:
+            pickle.dump({"weights": [2]}, f)
+        os.utime(path, ns=(0, 2))
+        self.assertEqual({"weights": [2]}, registry.get())
+        self.assertNotEqual(version, registry.get_info()["version"])
+
+
+class FakeModel:
+    """
+    Stand-in for the prediction model which derives the next wind speed and wind direction from all features.
+    """
+    def __init__(self):
+        self.calls = 0
+
+    def predict(self, features):
+        self.calls += 1
+        values = np.asarray(features, dtype=np.float64)
+        return np.column_stack([values[:, 2] * 0.9 + values[:, 0] + values[:, 1] * 0.01,
+                                (values[:, 3] + 7 * values[:, 4] / values[:, 5]) % 360])
+
+
+class PredictionTestCase(unittest.TestCase):
+    def setUp(self):
+        self.model = FakeModel()
+        self.addCleanup(setattr, prediction, "model_registry", prediction.model_registry)
+        prediction.model_registry = unittest.mock.Mock(get=lambda: self.model)
+
+    def test_predict_batch(self):
+        """
+        Test that the batched prediction calls the model once per horizon step and matches the row by row prediction.
+        """
+        features = np.array([[0, 5.2, 3.1, 270.0, 1, 2, 2023], [1, -1.5, 0.4, 12.0, 28, 12, 2022]])
+        predictions = prediction.predict_batch(features)
+        self.assertEqual((2, 6, 2), predictions.shape)
+        self.assertEqual(6, self.model.calls)
+
+        for row, expected in zip(features, predictions):
+            pred_df = pd.DataFrame([row], columns=prediction.feature_columns)
+            for step in range(6):
+                result = self.model.predict(pred_df)[0]
+                np.testing.assert_array_equal(result, expected[step])
+                pred_df['wind_speed_avg_10min_before'] = result[0]
+                pred_df['wind_direction_10min_before'] = result[1]
+
+        self.assertEqual((1, 12, 2), prediction.predict_batch(features[:1], horizon_steps=12).shape)
+
+    def test_prediction_snapshots(self):
+        """
+        Test that predictions are served from the snapshot without querying until the snapshot gets stale and that
+        new data replaces the snapshot.
+        """
+        self.addCleanup(setattr, prediction, "prediction_snapshots", prediction.prediction_snapshots)
+        prediction.prediction_snapshots = {}
+        prediction.model_registry.get_loaded = lambda: unittest.mock.Mock(version="v1")
+
+        latest = pd.Timestamp.now("UTC").floor("10min")
+        queries = []
+
+        def run_query(weather_query):
+            queries.append(weather_query)
+            return pd.DataFrame({"wind_speed_avg_10min": [3.0], "wind_direction": [90.0], "air_temperature": [5.0]},
+                                index=[latest])
+
+        with unittest.mock.patch.object(wr, "run_query", run_query):
+            getattr(prediction, "__on_data_written")("mythenquai", None)
+            first = prediction.get_predictions("mythenquai")
+            self.assertEqual(1, len(queries))
+            self.assertEqual({latest: [3.0, 90.0]}, first[0])
+            self.assertEqual(7, len(first))
+
+            first[1]["+10'"] = None
+            self.assertIsNotNone(prediction.get_predictions("mythenquai")[1]["+10'"])
+            with self.assertRaises(AttributeError):
+                prediction.prediction_snapshots["mythenquai"].data_datetime = latest
+            with self.assertRaises(TypeError):
+                prediction.prediction_snapshots["mythenquai"].labelled_predictions[1]["+10'"] = None
+
+            latest = latest + pd.Timedelta(minutes=10)
+            getattr(prediction, "__on_data_written")("mythenquai", None)
+            self.assertEqual(latest, list(prediction.get_predictions("mythenquai")[0].keys())[0])
+            self.assertEqual(2, len(queries))
+            self.assertEqual(12, self.model.calls)
+
+            # A stale snapshot is checked against the database but not recomputed if the data did not change
+            latest = latest - pd.Timedelta(hours=1)
+            prediction.prediction_snapshots["mythenquai"] = prediction.PredictionSnapshot(
+                latest, prediction.get_predictions("mythenquai"), "v1")
+            prediction.get_predictions("mythenquai")
+            self.assertEqual(3, len(queries))
+            self.assertEqual(12, self.model.calls)
+
+    def test_relative_labels(self):
+        """
+        Test that labels of horizons beyond 90 minutes are converted to the correct datetimes.
+        """
+        start = datetime.datetime(2023, 1, 1, 12, 0)
+        labelled = [{start: [1.0, 2.0]}, {"+10'": [1.0, 2.0]}, {"+120'": [3.0, 4.0]}]
+        self.assertEqual([start + datetime.timedelta(minutes=10), start + datetime.timedelta(minutes=120)],
+                         list(prediction.convert_labelled_predictions_to_relative_datetime(labelled).keys()))
+
+
+class PersistenceModel:
+    """
+    Stand-in for the prediction model which predicts the wind speed and wind direction of 10 minutes before.
+    """
+    def predict(self, features):
+        return np.asarray(features, dtype=np.float64)[:, 2:4]
+
+
+class BacktestTestCase(unittest.TestCase):
+    def test_run_backtest(self):
+        """
+        Test that the MAE grows with the horizon for a persistence model on a linear trend and that wind direction
+        errors wrap around at 360 degrees.
+        """
+        self.addCleanup(setattr, prediction, "model_registry", prediction.model_registry)
+        prediction.model_registry = unittest.mock.Mock(get=PersistenceModel)
+
+        index = pd.date_range("2023-01-01", periods=20, freq="10min", tz="UTC")
+        data = pd.DataFrame({"air_temperature": 5.0, "wind_speed_avg_10min": np.arange(20) * 0.5,
+                             "wind_direction": (355 + np.arange(20) * 2) % 360}, index=index)
+        data.iloc[3, 1] = np.nan
+
+        results, stats = backtest.run_backtest({"mythenquai": data}, horizon_steps=3, batch_size=4)
+
+        speed = results[results["variable"] == "wind_speed_avg_10min"]
+        self.assertEqual([10, 20, 30], speed["horizon"].tolist())
+        np.testing.assert_allclose([0.5, 1.0, 1.5], speed["mae"])
+        np.testing.assert_allclose([2.0, 4.0, 6.0], results[results["variable"] == "wind_direction"]["mae"])
+        # 17 start times, one without features
+        self.assertEqual(16 * 3, stats["predictions"])
+
+        # A single measurement (e.g. prediction/input/input.csv) has no targets
+        self.assertRaises(ValueError, backtest.run_backtest, {"mythenquai": data.iloc[:1]}, horizon_steps=3)
+        self.assertEqual(3, backtest.run_backtest({"mythenquai": data.iloc[4:8]}, horizon_steps=3)[1]["predictions"])
+
+    def test_load_csv(self):
+        """
+        Test that the station is taken from the file name of the CSV file.
+        """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        file_name = os.path.join(directory, "messwerte_tiefenbrunnen_2023.csv")
+        with open(file_name, "w", encoding="utf-8-sig") as f:
+            f.write("timestamp_utc,air_temperature,wind_speed_avg_10min,wind_direction\n"
+                    "2023-01-01T00:00:00+00:00,1.0,2.0,.\n")
+
+        datasets = backtest.load_csv(file_name)
+        self.assertEqual(["tiefenbrunnen"], list(datasets))
+        self.assertTrue(np.isnan(datasets["tiefenbrunnen"]["wind_direction"].iloc[0]))
+
+
+def render_stub(figure_json, image_format, width, height):
+    """
+    Stand-in for plot_renderer.render_figure which renders the title of the figure and hangs for the title "slow".
+    """
+    title = json.loads(figure_json)["layout"]["title"]["text"]
+    if title == "slow":
+        time.sleep(60)
+    return f"<svg>{title} {width}x{height}</svg>".encode(), 0.1
+
+
+class PlotRendererTestCase(unittest.TestCase):
+    def test_render(self):
+        """
+        Test that figures are rendered in parallel and that a hanging worker is killed without losing the other plots.
+        """
+        import plotly.graph_objects as go
+
+        renderer = plot_renderer.PlotRenderer(timeout=5, render_function=render_stub, initializer=None)
+        self.addCleanup(renderer.shutdown)
+
+        figures = {key: go.Figure(layout=dict(title=key)) for key in ["a", "slow", "b", "c"]}
+        started = time.monotonic()
+        results = renderer.render(figures, width=100, height=50)
+        self.assertLess(time.monotonic() - started, 30)
+
+        self.assertEqual(b"<svg>a 100x50</svg>", results["a"].content)
+        self.assertEqual(b"<svg>c 100x50</svg>", results["c"].content)
+        self.assertIsInstance(results["slow"].error, TimeoutError)
+        self.assertEqual({"a": 0.1, "b": 0.1, "c": 0.1, "slow": 5}, renderer.get_render_times())
+
+        # The hanging worker was killed and replaced
+        processes = [worker.process for worker in renderer.pool]
+        self.assertEqual(2, len(processes))
+        self.assertTrue(all(process.is_alive() for process in processes))
+        renderer.shutdown()
+        self.assertFalse(any(process.is_alive() for process in processes))
+        self.assertEqual([], multiprocessing.active_children())
+
+
+class DownsamplingTestCase(unittest.TestCase):
+    def test_lttb(self):
+        """
+        Test that LTTB keeps the first and last point and peaks and returns the point budget.
+        """
+        y = np.sin(np.linspace(0, 20, 1000))
+        y[423] = 50.0
+        indices = downsampling.lttb_indices(np.arange(1000), y, 100)
+
+        self.assertEqual(100, len(indices))
+        self.assertEqual([0, 999], [indices[0], indices[-1]])
+        self.assertTrue(np.all(np.diff(indices) > 0))
+        self.assertIn(423, indices)
+        np.testing.assert_array_equal(np.arange(10), downsampling.lttb_indices(np.arange(10), np.zeros(10), 10))
+
+    def test_downsample_series(self):
+        """
+        Test that series within the budget are unchanged and missing values are dropped otherwise.
+        """
+        index = pd.date_range("2023-01-01", periods=300, freq="10min", tz="UTC")
+        series = pd.Series(np.arange(300, dtype=float), index=index)
+        series.iloc[5] = np.nan
+
+        self.assertIs(series, downsampling.downsample_series(series, 300))
+        downsampled = downsampling.downsample_series(series, 30)
+        self.assertEqual(30, len(downsampled))
+        self.assertFalse(downsampled.isna().any())
+        self.assertEqual(index[-1], downsampled.index[-1])
+
+
+class PlottingTestCase(unittest.TestCase):
+    def setUp(self):
+        now = pd.Timestamp.now("UTC").floor("10min")
+        index = pd.date_range(now - pd.Timedelta(days=7), now, freq="10min")
+        self.data = pd.DataFrame({measurement.value: np.linspace(0, 10, len(index))
+                                  for measurement in plotting.plot_measurements}, index=index)
+        self.run_query = unittest.mock.Mock(side_effect=self.fake_run_query)
+        self.get_predictions = unittest.mock.Mock(return_value={now + pd.Timedelta(minutes=10): [1.0, 2.0]})
+        self.watermarks = {station: now for station in wr.get_stations()}
+
+        for target, attribute, value in [(wr, "run_query", self.run_query),
+                                         (wr, "get_watermark", self.watermarks.get),
+                                         (prediction, "get_predictions", self.get_predictions),
+                                         (plotting, "plot_fingerprints", {}),
+                                         (plotting, "plot_content_hashes", {}),
+                                         (plotting, "plot_figures", {})]:
+            patcher = unittest.mock.patch.object(target, attribute, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def fake_run_query(self, weather_query):
+        """
+        Answers the queries of the plots like InfluxDB from the test data.
+        """
+        data = self.data[self.data.index >= pd.Timestamp(weather_query.start_time).tz_localize("UTC")]
+        if weather_query.aggregation is None:
+            return data
+
+        hourly = data.resample("1h")
+        if weather_query.aggregation == wr.Aggregation.Mean:
+            return hourly.mean().interpolate()
+
+        return pd.concat([getattr(hourly, aggregation.value)().add_suffix(f"_{aggregation.value}")
+                          for aggregation in weather_query.aggregation], axis=1)
+
+    def test_queries_per_station(self):
+        """
+        Test that the raw week is fetched once per station, the day is cut from it in full resolution and the week is
+        resampled hourly, and that the predictions are looked up once per station. Windows beyond the window store
+        are resampled and aggregated by the database from the rollups.
+        """
+        render_plots = unittest.mock.Mock(return_value={})
+        with unittest.mock.patch.object(plotting, "render_plots", render_plots):
+            plotting.generate_all_plots()
+
+        run_query = self.run_query
+        get_predictions = self.get_predictions
+
+        stations = wr.get_stations()
+        self.assertEqual(len(stations), run_query.call_count)
+        self.assertEqual(len(stations), get_predictions.call_count)
+        week_query = run_query.call_args.args[0]
+        self.assertIsNone(week_query.aggregation)
+        self.assertEqual(datetime.timedelta(days=7), week_query.stop_time - week_query.start_time)
+
+        figures = render_plots.call_args[0][0]
+        self.assertEqual(sorted(f"{station}/{plot}" for station in stations for plot in plotting.get_plots()),
+                         sorted(figures))
+
+        day = figures[f"{stations[0]}/air_temperature_1d"].data[0]
+        week = figures[f"{stations[0]}/air_temperature_7d"].data[0]
+        self.assertLessEqual(len(day.x), 24 * 6 + 1)
+        self.assertEqual(len(self.data.resample("1h").mean()), len(week.x))
+        self.assertEqual(f"Mean: {self.data['air_temperature'].iloc[-len(day.x):].mean():.2f}°C",
+                         figures[f"{stations[0]}/air_temperature_1d"].data[1].name)
+        self.assertEqual(f"Mean: {self.data['air_temperature'].mean():.2f}°C",
+                         figures[f"{stations[0]}/air_temperature_7d"].data[1].name)
+
+        run_query.reset_mock()
+        plot_data = plotting.prepare_plot_data(stations[0], days_deltas=(1, 30))
+        self.assertEqual(3, run_query.call_count)
+        queries = [call.args[0] for call in run_query.call_args_list]
+        self.assertEqual([None, wr.Aggregation.Mean], [query.aggregation for query in queries[:2]])
+        self.assertEqual("1h", queries[2].route_to_rollup(rollups.resolutions, datetime.timedelta(days=2)).rollup)
+        self.assertEqual(len(self.fake_run_query(queries[1])), len(plot_data.get_window(30)))
+
+    def test_point_budget(self):
+        """
+        Test that line traces are downsampled to the point budget while min and max are aggregated separately.
+        """
+        self.data.iloc[77, self.data.columns.get_loc("air_temperature")] = -30.0
+        with unittest.mock.patch.object(plotting, "plot_point_budget", 50):
+            plot_data = plotting.prepare_plot_data(wr.get_stations()[0])
+            figure = plotting.generate_air_temperature_plot(plot_data, 7)
+
+        self.assertEqual(50, len(figure.data[0].x))
+        self.assertEqual("Min: -30.00°C", figure.data[2].name)
+
+    def test_dirty_tracking(self):
+        """
+        Test that only plots whose inputs changed are rendered again and that unchanged output is not rewritten.
+        """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        renderer = unittest.mock.Mock(render=lambda figures, width, height: {
+            key: plot_renderer.RenderResult(f"<svg>{key}</svg>".encode(), 0.1) for key in figures})
+
+        listener = unittest.mock.Mock()
+
+        with unittest.mock.patch.object(plotting, "plots_directory", directory), \
+                unittest.mock.patch.object(plotting, "plot_renderer", renderer), \
+                unittest.mock.patch.object(plotting, "plot_listeners", [listener]):
+            plotting.generate_all_plots()
+            stations = wr.get_stations()
+            self.assertEqual(len(stations) * len(plotting.get_plots()), listener.call_count)
+            self.assertEqual(len(stations), self.run_query.call_count)
+            file_name = os.path.join(directory, stations[0], "wind_direction.svg")
+            with open(file_name, "rb") as f:
+                self.assertEqual(f"<svg>{stations[0]}/wind_direction</svg>".encode(), f.read())
+            modified = os.stat(file_name).st_mtime_ns
+
+            plotting.generate_all_plots()
+            self.assertEqual(len(stations), self.run_query.call_count)
+
+            self.watermarks[stations[0]] += pd.Timedelta(minutes=10)
+            with self.assertLogs("app", level="INFO") as logs:
+                plotting.generate_all_plots()
+            self.assertEqual(len(stations) + 1, self.run_query.call_count)
+            self.assertIn("Rendered 5 of 5 outdated plots (0 files changed), skipped 5 unchanged plots", logs.output[-1])
+            self.assertEqual(modified, os.stat(file_name).st_mtime_ns)
+            self.assertEqual(len(stations) * len(plotting.get_plots()), listener.call_count)
+
+
+class EventStreamTestCase(unittest.TestCase):
+    def setUp(self):
+        self.stream = event_stream.EventStream(stations=["mythenquai", "tiefenbrunnen"], host="127.0.0.1", port=0)
+        self.stream.start()
+        self.addCleanup(self.stream.stop)
+
+    def subscribe(self, path):
+        sock = socket.create_connection(("127.0.0.1", self.stream.port), timeout=5)
+        self.addCleanup(sock.close)
+        sock.sendall(f"GET {path} HTTP/1.1\r\nHost: localhost\r\nAccept: text/event-stream\r\n\r\n".encode())
+        return sock
+
+    def receive(self, sock, until):
+        data = b""
+        while until not in data:
+            chunk = sock.recv(4096)
+            if not chunk:
+                break
+            data += chunk
+        return data
+
+    def test_fan_out(self):
+        """
+        Test that published events are pushed to all subscribers of the station only, with CORS headers.
+        """
+        first = self.subscribe("/stations/mythenquai/events")
+        second = self.subscribe("/stations/mythenquai/events")
+        other = self.subscribe("/stations/tiefenbrunnen/events")
+        for sock in [first, second, other]:
+            headers = self.receive(sock, b"retry: 5000\n\n")
+            self.assertIn(b"Content-Type: text/event-stream", headers)
+            self.assertIn(b"Access-Control-Allow-Origin: *", headers)
+        self.assertEqual(3, self.stream.get_stats()["connections"])
+
+        self.stream.publish("mythenquai", "measurement", {"values": {"air_temperature": 10.5}})
+        self.stream.publish("tiefenbrunnen", "plot", {"plot_type": "wind_direction", "version": "abc"})
+
+        for sock in [first, second]:
+            self.assertEqual(b'event: measurement\ndata: {"values":{"air_temperature":10.5}}\n\n',
+                             self.receive(sock, b"\n\n"))
+        self.assertEqual(b'event: plot\ndata: {"plot_type":"wind_direction","version":"abc"}\n\n',
+                         self.receive(other, b"\n\n"))
+
+        # The fan-out latency is recorded after the events were handed to the sockets
+        while self.stream.get_stats()["events"] < 2:
+            time.sleep(0.01)
+        self.assertGreater(self.stream.get_stats()["max_fan_out_seconds"], 0.0)
+
+        first.close()
+        self.stream.publish("mythenquai", "measurement", {"values": {}})
+        self.receive(second, b"\n\n")
+        while self.stream.get_stats()["connections"] > 2:
+            time.sleep(0.01)
+
+    def test_failures(self):
+        """
+        Test that a failing client is disconnected and that the server loop is restarted after an unexpected error,
+        keeping the other connections open.
+        """
+        self.stream.restart_delay = 0.01
+        healthy = self.subscribe("/stations/mythenquai/events")
+        failing = self.subscribe("/stations/mythenquai/events")
+        for sock in [healthy, failing]:
+            self.receive(sock, b"retry: 5000\n\n")
+
+        # A broken buffer makes every write to the client fail
+        failing_client = next(client for client in self.stream.clients.values() if client.sock.getpeername() ==
+                              failing.getsockname())
+        failing_client.output = None
+        self.stream.publish("mythenquai", "measurement", {"values": {}})
+        self.assertEqual(b'event: measurement\ndata: {"values":{}}\n\n', self.receive(healthy, b"\n\n"))
+        self.assertEqual(b"", failing.recv(4096))
+        self.assertEqual(1, self.stream.get_stats()["connections"])
+
+        select = self.stream.selector.select
+        failures = [RuntimeError("failed")]
+
+        def failing_select(timeout=None):
+            if failures:
+                raise failures.pop()
+            return select(timeout)
+
+        self.stream.selector.select = failing_select
+        self.stream.publish("mythenquai", "measurement", {"values": {}})
+        self.receive(healthy, b"\n\n")
+        while self.stream.get_stats()["restarts"] < 1:
+            time.sleep(0.01)
+        self.stream.publish("mythenquai", "plot", {"version": "abc"})
+        self.assertEqual(b'event: plot\ndata: {"version":"abc"}\n\n', self.receive(healthy, b"\n\n"))
+        self.assertEqual(1, self.stream.get_stats()["connections"])
+
+    def test_unknown_station(self):
+        """
+        Test that requests for unknown stations or paths are answered with 404 and closed.
+        """
+        for path in ["/stations/unknown/events", "/events"]:
+            sock = self.subscribe(path)
+            self.assertTrue(self.receive(sock, b"\r\n\r\n").startswith(b"HTTP/1.1 404 Not Found"))
+            self.assertEqual(b"", sock.recv(4096))
+
+
 class UserInterfaceTestCase(unittest.TestCase):
     def test_convert_to_datetime_string(self):
         """
@@ -48,5 +1149,229 @@ class UserInterfaceTestCase(unittest.TestCase):
         self.assertEqual("12:14", app.convert_to_datetime_string(today))
 
 
+class ApiTestCase(unittest.TestCase):
+    def setUp(self):
+        self.addCleanup(setattr, app, "service_ready", app.service_ready)
+        app.service_ready = True
+        self.client = app.app.test_client()
+
+    def test_status(self):
+        """
+        Test that the status, including the breaker states and the statistics, is served also while the service is
+        starting.
+        """
+        self.addCleanup(setattr, wr.ServiceStatus, "breaker_states", dict(wr.ServiceStatus.breaker_states))
+        self.addCleanup(setattr, wr.ServiceStatus, "ingest_lag", dict(wr.ServiceStatus.ingest_lag))
+        wr.ServiceStatus.update_breaker_state("test_endpoint", resilience.CircuitBreaker.open)
+        wr.ServiceStatus.update_ingest_lag("mythenquai", 42.0)
+        app.service_ready = False
+
+        response = self.client.get("/api/status")
+        self.assertEqual(200, response.status_code)
+        self.assertFalse(response.get_json()["ready"])
+        self.assertEqual("open", response.get_json()["breakers"]["test_endpoint"])
+        self.assertEqual(42.0, response.get_json()["ingest_lag"]["mythenquai"])
+        self.assertEqual(wr.get_query_cache_stats(), response.get_json()["query_cache"])
+        self.assertEqual(app.get_fragment_cache_stats(), response.get_json()["fragment_cache"])
+        self.assertEqual(app.get_event_stream_stats(), response.get_json()["event_stream"])
+        self.assertEqual(plotting.get_render_times(), response.get_json()["render_times"])
+        self.assertEqual(prediction.get_model_info(), response.get_json()["model"])
+        self.assertEqual(503, self.client.get("/api/stations/mythenquai/latest").status_code)
+
+    def test_plot_figure(self):
+        """
+        Test that the figure JSON of a plot is served gzip compressed with an ETag and answered with 304 if unchanged.
+        """
+        import plotly.graph_objects as go
+
+        with unittest.mock.patch.object(plotting, "plot_figures", {}):
+            plotting.save_plot_figure(go.Figure(layout=dict(title="test")), "mythenquai/wind_direction")
+
+            response = self.client.get("/api/stations/mythenquai/plots/wind_direction")
+            self.assertEqual(200, response.status_code)
+            self.assertEqual("test", response.get_json()["layout"]["title"]["text"])
+
+            response = self.client.get("/api/stations/mythenquai/plots/wind_direction",
+                                       headers={"Accept-Encoding": "gzip"})
+            self.assertEqual("gzip", response.headers["Content-Encoding"])
+            self.assertEqual("test", json.loads(gzip.decompress(response.data))["layout"]["title"]["text"])
+
+            response = self.client.get("/api/stations/mythenquai/plots/wind_direction",
+                                       headers={"Accept-Encoding": "gzip", "If-None-Match": response.headers["ETag"]})
+            self.assertEqual(304, response.status_code)
+
+            self.assertEqual(404, self.client.get("/api/stations/mythenquai/plots/unknown").status_code)
+
+    def test_plot_file(self):
+        """
+        Test that rendered plots are saved with a gzip variant which is served with a strong ETag.
+        """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with unittest.mock.patch.object(plotting, "plots_directory", directory), \
+                unittest.mock.patch.object(plotting, "plot_content_hashes", {}), \
+                unittest.mock.patch.object(plotting, "plot_files", {}):
+            self.assertTrue(plotting.save_plot(b"<svg>first</svg>", "mythenquai/wind_direction"))
+            self.assertTrue(os.path.isfile(os.path.join(directory, "mythenquai", "wind_direction.svg.gz")))
+
+            response = self.client.get("/plots/mythenquai/wind_direction.svg", headers={"Accept-Encoding": "gzip"})
+            self.assertEqual("gzip", response.headers["Content-Encoding"])
+            self.assertEqual("image/svg+xml", response.mimetype)
+            self.assertEqual(b"<svg>first</svg>", gzip.decompress(response.data))
+            etag = response.headers["ETag"]
+
+            self.assertEqual(304, self.client.get("/plots/mythenquai/wind_direction.svg",
+                                                  headers={"Accept-Encoding": "gzip",
+                                                           "If-None-Match": etag}).status_code)
+
+            self.assertFalse(plotting.save_plot(b"<svg>first</svg>", "mythenquai/wind_direction"))
+            plotting.save_plot(b"<svg>second</svg>", "mythenquai/wind_direction")
+            response = self.client.get("/plots/mythenquai/wind_direction.svg", headers={"If-None-Match": etag})
+            self.assertEqual(200, response.status_code)
+            self.assertEqual(b"<svg>second</svg>", response.data)
+            self.assertEqual(404, self.client.get("/plots/mythenquai/unknown.svg").status_code)
+
+    def test_stale_plot_variant(self):
+        """
+        Test that variants of encodings which are no longer produced (e.g. brotli was uninstalled) are removed.
+        """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with unittest.mock.patch.object(plotting, "plots_directory", directory), \
+                unittest.mock.patch.object(plotting, "plot_content_hashes", {}), \
+                unittest.mock.patch.object(plotting, "plot_files", {}), \
+                unittest.mock.patch.object(http_cache, "brotli", None):
+            file_name = os.path.join(directory, "mythenquai", "wind_direction.svg")
+            os.makedirs(os.path.dirname(file_name))
+            for content in [b"<svg>first</svg>", b"<svg>first</svg>", b"<svg>second</svg>"]:
+                with open(file_name + ".br", "wb") as f:
+                    f.write(b"outdated")
+                plotting.save_plot(content, "mythenquai/wind_direction")
+                self.assertFalse(os.path.exists(file_name + ".br"))
+
+            response = self.client.get("/plots/mythenquai/wind_direction.svg", headers={"Accept-Encoding": "br"})
+            self.assertNotIn("Content-Encoding", response.headers)
+            self.assertEqual(b"<svg>second</svg>", response.data)
+
+    def test_latest(self):
+        """
+        Test that the latest measurement is served from the snapshot and answered with 304 until new data arrives.
+        """
+        first = pd.DataFrame({"air_temperature": [10.0, 11.5], "wind_speed_avg_10min": [2.0, np.nan]},
+                             index=pd.to_datetime(["2022-01-01 00:00", "2022-01-01 00:10"]))
+        second = pd.DataFrame({"air_temperature": [12.0], "wind_speed_avg_10min": [3.0]},
+                              index=pd.to_datetime(["2022-01-01 00:20"]))
+
+        with unittest.mock.patch.object(wr, "latest_snapshots", {}), \
+                unittest.mock.patch.object(wr, "run_query", return_value=first) as run_query:
+            response = self.client.get("/api/stations/mythenquai/latest")
+            self.assertEqual(200, response.status_code)
+            self.assertEqual({"air_temperature": 11.5, "wind_speed_avg_10min": None}, response.get_json()["values"])
+            etag = response.headers["ETag"]
+
+            response = self.client.get("/api/stations/mythenquai/latest", headers={"If-None-Match": etag})
+            self.assertEqual(304, response.status_code)
+            self.assertEqual(1, run_query.call_count)
+
+            snapshot = wr.get_latest_snapshot("mythenquai")
+            with self.assertRaises(AttributeError):
+                snapshot.values = {}
+            with self.assertRaises(TypeError):
+                snapshot.values["air_temperature"] = 0.0
+
+            run_query.return_value = second
+            wr.update_latest_snapshot("mythenquai")
+            response = self.client.get("/api/stations/mythenquai/latest", headers={"If-None-Match": etag})
+            self.assertEqual(200, response.status_code)
+            self.assertEqual(12.0, response.get_json()["values"]["air_temperature"])
+
+            self.assertEqual(404, self.client.get("/api/stations/unknown/latest").status_code)
+
+    def test_latest_multiple_stations(self):
+        """
+        Test that the latest measurements of multiple stations are served in the requested order with a combined ETag.
+        """
+        data = pd.DataFrame({"air_temperature": [10.0]}, index=pd.to_datetime(["2022-01-01 00:00"]))
+
+        with unittest.mock.patch.object(wr, "latest_snapshots", {}), \
+                unittest.mock.patch.object(wr, "run_query", return_value=data):
+            response = self.client.get("/api/stations/latest?stations=tiefenbrunnen,mythenquai")
+            self.assertEqual(200, response.status_code)
+            self.assertEqual(["tiefenbrunnen", "mythenquai"], [entry["station"] for entry in response.get_json()])
+
+            response = self.client.get("/api/stations/latest?stations=tiefenbrunnen,mythenquai",
+                                       headers={"If-None-Match": response.headers["ETag"]})
+            self.assertEqual(304, response.status_code)
+            self.assertEqual(404, self.client.get("/api/stations/latest?stations=unknown").status_code)
+
+
+class DashboardTestCase(unittest.TestCase):
+    def setUp(self):
+        self.addCleanup(setattr, app, "service_ready", app.service_ready)
+        self.addCleanup(setattr, app, "fragment_cache", app.fragment_cache)
+        app.service_ready = True
+        app.fragment_cache = fragment_cache.FragmentCache()
+        self.client = app.app.test_client()
+
+        self.snapshot = wr.LatestSnapshot("mythenquai", pd.Timestamp("2022-01-01 00:00", tz="UTC"),
+                                          {"air_temperature": 10.123, "humidity": None})
+        self.snapshot_id = "first"
+        predictions = [{datetime.datetime(2022, 1, 1, 0, 10): [3.5, 180.0]}]
+
+        patches = [
+            unittest.mock.patch.object(wr, "get_latest_snapshot", side_effect=lambda station: self.snapshot),
+            unittest.mock.patch.object(prediction, "get_prediction_snapshot_id",
+                                       side_effect=lambda station: self.snapshot_id),
+            unittest.mock.patch.object(prediction, "get_predictions", side_effect=lambda station: list(predictions))
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_fragments_cached(self):
+        """
+        Test that the current weather and the predictions are rendered once per data version and reused otherwise.
+        """
+        response = self.client.get("/weatherstation/mythenquai")
+        self.assertEqual(200, response.status_code)
+        self.assertIn(b"10.12", response.data)
+        self.assertIn(b"180.0", response.data)
+        self.assertIn(b"<span", response.data)
+
+        self.client.get("/weatherstation/mythenquai")
+        self.assertEqual(1, prediction.get_predictions.call_count)
+        stats = app.get_fragment_cache_stats()
+        self.assertEqual(1, stats["hits"])
+        self.assertEqual(1, stats["misses"])
+        self.assertEqual(0.5, stats["hit_rate"])
+        self.assertIn("mythenquai", stats["last_render_seconds"])
+
+        self.snapshot_id = "second"
+        self.client.get("/weatherstation/mythenquai")
+        self.assertEqual(2, prediction.get_predictions.call_count)
+
+        self.snapshot = wr.LatestSnapshot("mythenquai", pd.Timestamp("2022-01-01 00:10", tz="UTC"),
+                                          {"air_temperature": 11.0})
+        response = self.client.get("/weatherstation/mythenquai")
+        self.assertEqual(3, prediction.get_predictions.call_count)
+        self.assertIn(b"11.0", response.data)
+
+    def test_failed_lookup_not_cached(self):
+        """
+        Test that fragments rendered after a failed lookup are rendered again and that unknown stations are not cached.
+        """
+        prediction.get_predictions.side_effect = LookupError("No predictions")
+        with self.assertLogs("app", level="ERROR"):
+            self.assertEqual(200, self.client.get("/weatherstation/mythenquai").status_code)
+        self.assertEqual(0, app.get_fragment_cache_stats()["entries"])
+
+        prediction.get_predictions.side_effect = lambda station: [{datetime.datetime(2022, 1, 1): [3.5, 180.0]}]
+        self.assertIn(b"180.0", self.client.get("/weatherstation/mythenquai").data)
+        self.assertEqual(2, app.get_fragment_cache_stats()["misses"])
+
+        self.assertEqual(404, self.client.get("/weatherstation/unknown").status_code)
+        self.assertEqual(1, app.get_fragment_cache_stats()["entries"])
+
+
 if __name__ == '__main__':
     unittest.main()
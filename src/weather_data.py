@@ -21,15 +21,23 @@ import os
 import signal
 import sys
 import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from time import sleep
+from time import perf_counter, sleep
 
 import numpy as np
 import pandas as pd
 import requests
 from influxdb import DataFrameClient
 from pandas import json_normalize
-from requests.exceptions import ConnectionError
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError, HTTPError, Timeout
+
+import csv_import
+import ingestion_schedule
+import resilience
+from service_status import ServiceStatus
 
 logger = logging.getLogger("app")
 
@@ -57,15 +65,45 @@ class Config:
         'values.windchill.value': 'windchill'
     }
     historic_data_chunksize = 10000
+    historic_data_batchsize = 50000
+    historic_data_bulk_import = True
+    historic_data_checkpoint_file = './csv/import_checkpoints.json'
+    backfill_workers = 8
+    data_listeners = []
+    # Adaptive size (in days) of the windows requested from the API. Without
+    # a size per station, the largest window within api_window_max_rows at
+    # api_rows_per_day (one measurement every 10 minutes) is requested.
+    api_window_days = {}
+    api_rows_per_day = 144
+    api_window_min_days = 1
+    api_window_max_days = 32
+    api_window_max_rows = 2000
+    api_window_max_seconds = 10
+    # Resilience of the API requests, see resilience.py
+    api_timeout = (5, 30)
+    api_retries = 4
+    api_retry_base_delay = 1
+    api_retry_max_delay = 30
+    api_breaker_failure_threshold = 5
+    api_breaker_reset_timeout = 60
+    # Polling of the periodic read relative to the expected publish time
+    ingest_poll_margin = 15
+    ingest_retry_interval = 30
+    ingest_max_retries = 6
+    # Maximum number of concurrent database queries, further queries wait for a free slot of db_query_slots
+    db_max_concurrent_queries = 4
+    db_query_slots = None
     client = None
+    session = None
 
 def connect_db(config):
-    """Connects to the database and initializes the client
+    """Connects to the database and initializes the client and the query slots
 
     Parameters:
     config (Config): The Config containing the DB connection info
 
    """
+    config.db_query_slots = threading.BoundedSemaphore(config.db_max_concurrent_queries)
     if config.client is None:
         # https://www.influxdata.com/blog/getting-started-python-influxdb/
         config.client = DataFrameClient(host=config.db_host,
@@ -74,13 +112,14 @@ def connect_db(config):
         config.client.switch_database(config.db_name)
 
 
-def execute_query(config, station, query_string):
+def execute_query(config, station, query_string, series=None):
     """
     Executes a given weather_query related to a specific weather station that is within the config
     Args:
         config: DB config
         station: Station from the weather config
         query_string: Influx weather_query string
+        series: Name of the queried measurement if it differs from the station (e.g. a rollup)
 
     Returns: None in case of error or empty set or pandas DataFrame with data
     """
@@ -91,8 +130,9 @@ def execute_query(config, station, query_string):
 
     try:
         logger.debug(f"Query: {query_string}")
-        result = config.client.query(query_string, database=config.db_name)
-        df = result.get(station, None)
+        with config.db_query_slots:
+            result = config.client.query(query_string, database=config.db_name)
+        df = result.get(series if series is not None else station, None)
         return df
 
     except Exception as e:
@@ -116,6 +156,12 @@ def clean_db(config):
 def import_csv_file(config, station, file_name):
     """Imports data from a .csv file
 
+    Uses the bulk import of csv_import.py unless
+    config.historic_data_bulk_import is disabled. The bulk import resumes
+    after the rows which were imported on a previous start, given that the
+    database still holds them. The throughput of the import is logged in
+    rows/s.
+
     Parameters:
     config (Config): The Config containing the DB connection info
     station (String): Either 'Mythenquai' or 'Tiefenbrunnen'
@@ -124,99 +170,353 @@ def import_csv_file(config, station, file_name):
    """
     if os.path.isfile(file_name):
         logger.debug('\tLoad ' + file_name)
-        for chunk in pd.read_csv(file_name, delimiter=',',
-                                 chunksize=config.historic_data_chunksize):
-            chunk = __define_types(chunk, '%Y-%m-%dT%H:%M:%S')
-            logger.debug('Add ' + station + ' from ' + str(
-                chunk.index[0]) + ' to ' + str(chunk.index[-1]))
-            __add_data_to_db(config, chunk, station)
+        start = perf_counter()
+        if config.historic_data_bulk_import:
+            last_db_time = __extract_last_db_day(
+                __get_last_db_entry(config, station), station, None)
+            rows, _ = csv_import.import_csv_file(
+                config, station, file_name, last_db_time,
+                on_write=lambda data: __data_written(config, station, data))
+        else:
+            rows = 0
+            for chunk in pd.read_csv(file_name, delimiter=',',
+                                     chunksize=config.historic_data_chunksize):
+                chunk = __define_types(chunk, '%Y-%m-%dT%H:%M:%S')
+                logger.debug('Add ' + station + ' from ' + str(
+                    chunk.index[0]) + ' to ' + str(chunk.index[-1]))
+                __add_data_to_db(config, chunk, station)
+                rows += len(chunk)
+        elapsed = perf_counter() - start
+        logger.info(f'Imported {rows} rows of {station} in {elapsed:.2f}s '
+                    f'({rows / max(elapsed, 1e-9):.0f} rows/s)')
     else:
         logger.info(file_name + ' does not seem to exist.')
 
 
+def add_data_listener(config, listener):
+    """Registers a listener for new data
+
+    The listener is called with the station and the written DataFrame
+    whenever new data was written to the database which advances the last
+    entry of the station.
+
+    Parameters:
+    config (Config): The Config containing the DB connection info
+    listener (function): Function taking the station and the DataFrame
+
+   """
+    config.data_listeners.append(listener)
+
+
+def get_last_entry_time(config, station):
+    """Returns the time of the last entry of a station
+
+    Parameters:
+    config (Config): The Config containing the DB connection info
+    station (String): Either 'Mythenquai' or 'Tiefenbrunnen'
+
+    Returns:
+    datetime: The time of the last entry (naive UTC) or None
+
+   """
+    return __extract_last_db_day(__get_last_db_entry(config, station),
+                                 station, None)
+
+
+def is_csv_file_imported(config, station, file_name):
+    """Checks if a .csv file was already completely imported
+
+    Parameters:
+    config (Config): The Config containing the DB connection info
+    station (String): Either 'Mythenquai' or 'Tiefenbrunnen'
+    file_name (String): Path to the file which shall be checked
+
+    Returns:
+    bool: True if the import checkpoint covers the whole file and the
+    database still holds the imported data
+
+   """
+    if not config.historic_data_bulk_import or not os.path.isfile(file_name):
+        return False
+
+    last_db_time = __extract_last_db_day(__get_last_db_entry(config, station),
+                                         station, None)
+    return csv_import.is_imported(config, station, file_name, last_db_time)
+
+
 def import_latest_data(config, periodic_read=False):
     """Reads the latest data from the Wasserschutzpolizei Zurich weather API
 
+    Missing days of all stations are fetched concurrently, see __backfill.
+    Afterwards, the periodic read polls each station just after the expected
+    publish time of its next measurement, see ingestion_schedule.py.
+
     Parameters:
     config (Config): The Config containing the DB connection info
     periodic_read (bool): Defines if the function should keep reading after it
     imported the latest data (blocking through a sleep)
 
    """
-    # access API for current data
-    current_time = datetime.utcnow() + timedelta(hours=1)
-    current_day = current_time.replace(hour=0, minute=0, second=0,
-                                       microsecond=0)
-    last_db_days = [current_day] * len(config.stations)
-
-    for idx, station in enumerate(config.stations):
-        last_db_entry = __get_last_db_entry(config, station)
-        last_db_days[idx] = __extract_last_db_day(last_db_entry, station,
-                                                  last_db_days[
-                                                      idx]) + timedelta(hours=1)
-
     if periodic_read and threading.current_thread() is threading.main_thread():
         signal.signal(signal.SIGINT, __signal_handler)
         logger.debug('\nPress Ctrl+C to stop!\n')
-    check_db_day = min(last_db_days)
-    check_db_day = check_db_day.replace(hour=0, minute=0, second=0,
-                                        microsecond=0)
 
-    first_cycle = True
-    last_cycle = False
+    __backfill(config, __get_first_days(config, config.stations),
+               __get_current_day())
+
+    if not periodic_read:
+        return
+
+    schedule = ingestion_schedule.IngestionSchedule(
+        config.stations,
+        margin=timedelta(seconds=config.ingest_poll_margin),
+        retry_interval=timedelta(seconds=config.ingest_retry_interval),
+        max_retries=config.ingest_max_retries)
+    now = datetime.utcnow()
+    for station in config.stations:
+        last_time = __extract_last_db_day(__get_last_db_entry(config, station),
+                                          station, None)
+        if last_time is None:
+            schedule.miss(station, now)
+        else:
+            schedule.observe(station, last_time, now, seen=False)
 
     while True:
-        # check if all historic data (retrieved from API) has been processed
-        if (not first_cycle and periodic_read and check_db_day >= current_day
-                and not first_cycle):
-            # once every 10 Min
-            current_time = datetime.utcnow() + timedelta(hours=1)
-            sleep_until = current_time + timedelta(minutes=10)
-            # once per day
-            # sleep_until = current_time + timedelta(days = 1)
-            # sleep_until = sleep_until.replace(hour=6, minute=0, second=0,
-            #                                  microsecond=0)
-            sleep_sec = (sleep_until - current_time).total_seconds()
-
-            logger.debug('Sleep for ' + str(sleep_sec) + 's (from ' + str(
-                current_time) + ' until ' + str(
-                sleep_until) + ') when next data will be queried.')
-            sleep(sleep_sec)
-            current_day = current_time.replace(hour=0, minute=0, second=0,
-                                               microsecond=0)
-
-        if not periodic_read and check_db_day >= current_day:
-            if last_cycle:
-                return
-            last_cycle = True
-
-        for idx, station in enumerate(config.stations):
-            if last_db_days[idx].replace(hour=0, minute=0, second=0,
-                                         microsecond=0) > check_db_day:
-                continue
-            last_db_entry = __get_last_db_entry(config, station)
-            last_db_days[idx] = __extract_last_db_day(last_db_entry, station,
-                                                      last_db_days[idx])
-            data_of_last_db_day = __get_data_of_day(check_db_day, station)
+        sleep_until = schedule.next_poll()
+        current_time = datetime.utcnow()
+        sleep_sec = max(0.0, (sleep_until - current_time).total_seconds())
+
+        logger.debug('Sleep for ' + str(sleep_sec) + 's (from ' + str(
+            current_time) + ' until ' + str(
+            sleep_until) + ') when next data will be queried.')
+        sleep(sleep_sec)
+
+        now = datetime.utcnow()
+        stations = schedule.due_stations(now)
+        last_times = {station: __extract_last_db_day(
+            __get_last_db_entry(config, station), station, None)
+            for station in stations}
+
+        __backfill(config, __get_first_days(config, stations),
+                   __get_current_day(), stations)
+
+        now = datetime.utcnow()
+        for station in stations:
+            last_time = __extract_last_db_day(
+                __get_last_db_entry(config, station), station, None)
+            if last_time is not None and (last_times[station] is None or
+                                          last_time > last_times[station]):
+                schedule.observe(station, last_time, now)
+            else:
+                schedule.miss(station, now)
+
+
+def __get_current_day():
+    current_time = datetime.utcnow() + timedelta(hours=1)
+    return current_time.replace(hour=0, minute=0, second=0, microsecond=0)
+
 
-            normalized_data = __clean_data(config, data_of_last_db_day,
-                                           last_db_entry, station)
+def __get_first_days(config, stations):
+    current_day = __get_current_day()
+    first_days = {}
+    for station in stations:
+        last_db_entry = __get_last_db_entry(config, station)
+        first_days[station] = __extract_last_db_day(
+            last_db_entry, station, current_day) + timedelta(hours=1)
+
+    return first_days
+
+
+def __backfill(config, first_days, last_day, stations=None):
+    """Fetches and stores all days from the first day of each station up to
+    the last day
+
+    The days are requested in multi-day windows of an adaptive size, see
+    __adapt_window_days. Each window is sized when it is submitted, so the
+    size adapted to the previous responses applies to the rest of the
+    catch-up. After the first window of a station, the (station, window)
+    fetches are fanned out over a pool of config.backfill_workers threads
+    sharing one pooled session. A window whose response turns out to be too
+    large or too slow is split in halves which are fetched again. The
+    results are committed to the database per station in timestamp order.
+    If a fetch fails, the windows before it are committed and the remaining
+    ones are left for the next cycle.
 
-            if normalized_data.size > 0:
+    Parameters:
+    config (Config): The Config containing the DB connection info
+    first_days (dict): The first day to fetch per station
+    last_day (datetime): The last day to fetch for all stations
+    stations (list): The stations to fetch, defaults to all stations
+
+   """
+    if stations is None:
+        stations = config.stations
+    __get_session(config)
+    stop_day = last_day + timedelta(days=1)
+
+    # Windows of a station in flight, once the first one sized the window
+    in_flight = max(1, config.backfill_workers // len(stations))
+
+    with ThreadPoolExecutor(max_workers=config.backfill_workers) as executor:
+        fetches = {}
+        next_days = {}
+        for station in stations:
+            next_days[station] = first_days[station].replace(
+                hour=0, minute=0, second=0, microsecond=0)
+            fetches[station] = deque()
+            __submit_windows(config, executor, station, fetches[station],
+                             next_days, stop_day, 1)
+
+        for station in stations:
+            last_db_entry = __get_last_db_entry(config, station)
+            frames = []
+            while fetches[station]:
+                day, days, fetch = fetches[station].popleft()
+                try:
+                    data_of_window, elapsed = fetch.result()
+                except Exception as e:
+                    logger.error(f'Fetching {station} at {day:%Y-%m-%d} '
+                                 f'failed: {e}')
+                    for _, _, pending in fetches[station]:
+                        pending.cancel()
+                    break
+
+                split = __adapt_window_days(config, station, days,
+                                            data_of_window, elapsed)
+                if split:
+                    half = days // 2
+                    for start, length in [(day + timedelta(days=half),
+                                           days - half), (day, half)]:
+                        fetches[station].appendleft(
+                            (start, length,
+                             executor.submit(__get_data_of_window, config,
+                                             start, length, station)))
+                    continue
+
+                normalized_data = __clean_data(config, data_of_window,
+                                               last_db_entry, station)
+                if normalized_data.size > 0:
+                    frames.append(normalized_data)
+                __submit_windows(config, executor, station, fetches[station],
+                                 next_days, stop_day, in_flight)
+
+            if frames:
+                normalized_data = pd.concat(frames).sort_index()
+                normalized_data = normalized_data[
+                    ~normalized_data.index.duplicated(keep='last')]
                 __add_data_to_db(config, normalized_data, station)
                 logger.debug('Handle ' + station + ' from ' + str(
                     normalized_data.index[0]) + ' to ' + str(
                     normalized_data.index[-1]))
+
+                # Ingest lag: measurement time of the newest row to DB write
+                ingest_lag = (pd.Timestamp.now(tz='UTC') -
+                              normalized_data.index[-1]).total_seconds()
+                ServiceStatus.update_ingest_lag(station, ingest_lag)
+                logger.info(f'Ingest lag of {station}: {ingest_lag:.0f}s')
             else:
                 logger.debug('No new data received for ' + station)
 
-        if check_db_day < current_day:
-            check_db_day = check_db_day + pd.DateOffset(1)
-        elif periodic_read and check_db_day >= current_day:
-            check_db_day = datetime.utcnow() + timedelta(hours=1)
 
-        if first_cycle:
-            first_cycle = False
+def __submit_windows(config, executor, station, fetches, next_days,
+                     stop_day, limit):
+    """Submits the next windows of a station until limit windows are queued
+
+    Parameters:
+    config (Config): The Config containing the window settings
+    executor (ThreadPoolExecutor): The pool fetching the windows
+    station (String): The station to fetch
+    fetches (deque): The queued (day, days, future) windows of the station
+    next_days (dict): The first day not submitted yet per station
+    stop_day (datetime): The day after the last day to fetch
+    limit (int): The number of windows to queue
+
+   """
+    window_days = __get_window_days(config, station)
+    while len(fetches) < limit and next_days[station] < stop_day:
+        day = next_days[station]
+        days = min(window_days, (stop_day - day).days)
+        fetches.append((day, days, executor.submit(
+            __get_data_of_window, config, day, days, station)))
+        next_days[station] = day + timedelta(days=days)
+
+
+def __get_window_days(config, station):
+    """Returns the window size of a station, by default the largest window
+    within config.api_window_max_rows
+
+    Parameters:
+    config (Config): The Config containing the window settings
+    station (String): The station to fetch
+
+    Returns:
+    int: The number of days per window
+
+   """
+    if station in config.api_window_days:
+        return config.api_window_days[station]
+    return max(config.api_window_min_days,
+               min(config.api_window_max_days,
+                   config.api_window_max_rows // config.api_rows_per_day))
+
+
+def __adapt_window_days(config, station, days, data_of_window, elapsed):
+    """Adapts the window size of a station to the last response
+
+    The window size is halved if the response was truncated, exceeded
+    config.api_window_max_rows or took longer than
+    config.api_window_max_seconds. After a full window it grows to the size
+    for which the rows and time at the rate of the response would be half
+    of these limits. Otherwise it is kept.
+
+    Parameters:
+    config (Config): The Config containing the window settings
+    station (String): The station the response belongs to
+    days (int): The number of days of the requested window
+    data_of_window (dict): The parsed response
+    elapsed (float): The duration of the request in seconds
+
+    Returns:
+    bool: True if the window has to be split and fetched again
+
+   """
+    rows = len(data_of_window.get('result', []))
+    total_rows = data_of_window.get('total_count', rows)
+    too_large = (total_rows > rows or rows >= config.api_window_max_rows)
+    too_slow = elapsed > config.api_window_max_seconds
+
+    window_days = __get_window_days(config, station)
+    if too_large or too_slow:
+        window_days = max(config.api_window_min_days, min(window_days,
+                                                          days) // 2)
+    elif days >= window_days:
+        days_by_rows = days * config.api_window_max_rows // (2 * max(rows, 1))
+        days_by_time = int(days * config.api_window_max_seconds /
+                           (2 * max(elapsed, 0.001)))
+        window_days = max(window_days, min(config.api_window_max_days,
+                                           days_by_rows, days_by_time))
+    config.api_window_days[station] = window_days
+
+    if too_large and days > 1:
+        logger.debug(f'Response of {station} with {total_rows} rows for '
+                     f'{days} days too large, splitting window.')
+        return True
+    if total_rows > rows:
+        logger.warning(f'Response of {station} for a single day truncated '
+                       f'to {rows} of {total_rows} rows.')
+
+    return False
+
+
+def __get_session(config):
+    if config.session is None:
+        adapter = HTTPAdapter(pool_connections=len(config.stations),
+                              pool_maxsize=config.backfill_workers)
+        config.session = requests.Session()
+        config.session.mount('https://', adapter)
+        config.session.mount('http://', adapter)
+
+    return config.session
 
 
 def __set_last_db_entry(config, station, entry):
@@ -226,9 +526,13 @@ def __set_last_db_entry(config, station, entry):
 
     if current_last_time is None and entry_time is not None:
         config.stations_last_entries[station] = entry
+        return True
     elif (current_last_time is not None and entry_time is not None and
           current_last_time < entry_time):
         config.stations_last_entries[station] = entry
+        return True
+
+    return False
 
 
 def __get_last_db_entry(config, station):
@@ -243,14 +547,16 @@ def __get_last_db_entry(config, station):
             # to make weather_query work
             query = (f'SELECT air_temperature FROM {station} ORDER BY time '
                      f'DESC LIMIT 1')
-            last_entry = config.client.query(query)
+            with config.db_query_slots:
+                last_entry = config.client.query(query)
         except:
             # There are influxDB versions which have an issue with above weather_query
             logger.error(
                 'An exception occurred while querying last entry from DB for ',
                 station, '. Try alternative approach.')
             query = f'SELECT * FROM {station} ORDER BY time DESC LIMIT 1'
-            last_entry = config.client.query(query)
+            with config.db_query_slots:
+                last_entry = config.client.query(query)
 
     __set_last_db_entry(config, station, last_entry)
     return last_entry
@@ -271,31 +577,42 @@ def __extract_last_db_day(last_entry, station, default_last_db_day):
     return default_last_db_day
 
 
-def __get_data_of_day(day, station):
+def __get_data_of_window(config, day, days, station):
     # convert to local time of station
     base_url = 'https://tecdottir.herokuapp.com/measurements/{}'
     day_str = day.strftime('%Y-%m-%d')
-    end_date = day + timedelta(days=1)
+    end_date = day + timedelta(days=days)
     end_day_str = end_date.strftime('%Y-%m-%d')
-    logger.debug('Query ' + station + ' at ' + day_str)
+    logger.debug('Query ' + station + ' from ' + day_str + ' to ' +
+                 end_day_str)
     payload = {
         'startDate': day_str,
-        'endDate': end_day_str
+        'endDate': end_day_str,
+        'limit': config.api_window_max_rows
     }
     url = base_url.format(station)
-    while True:
-        try:
-            response = requests.get(url, params=payload)
-            if response.ok:
-                j_data = json.loads(response.content)
-                return j_data
-            else:
-                response.raise_for_status()
-                break
-        except ConnectionError as e:
-            logger.error(f"Request for '{e.request.url}' failed."
-                         f"({e.args[0].args[0]})\nTrying again in 10 seconds...")
-            sleep(10)
+    breaker = resilience.get_breaker(url, config.api_breaker_failure_threshold,
+                                     config.api_breaker_reset_timeout)
+
+    def fetch():
+        start = perf_counter()
+        response = __get_session(config).get(url, params=payload,
+                                             timeout=config.api_timeout)
+        response.raise_for_status()
+        return json.loads(response.content), perf_counter() - start
+
+    return resilience.retry(lambda: breaker.call(fetch),
+                            retries=config.api_retries,
+                            base_delay=config.api_retry_base_delay,
+                            max_delay=config.api_retry_max_delay,
+                            should_retry=__is_transient_error)
+
+
+def __is_transient_error(e):
+    if isinstance(e, (ConnectionError, Timeout)):
+        return True
+    return (isinstance(e, HTTPError) and e.response is not None
+            and e.response.status_code >= 500)
 
 
 def __define_types(data, date_format):
@@ -344,9 +661,11 @@ def __clean_data(config, data_of_last_day, last_db_entry, station):
         last_db_entry_time = last_db_entry
     elif isinstance(last_db_entry, dict):
         last_db_entry_time = last_db_entry.get(station, None)
-    last_db_entry_time = last_db_entry_time.index[0]
-    normalized.drop(normalized[normalized.index <= last_db_entry_time].index,
-                    inplace=True)
+    if last_db_entry_time is not None and not last_db_entry_time.index.empty:
+        last_db_entry_time = last_db_entry_time.index[0]
+        normalized.drop(
+            normalized[normalized.index <= last_db_entry_time].index,
+            inplace=True)
 
     return normalized
 
@@ -354,7 +673,17 @@ def __clean_data(config, data_of_last_day, last_db_entry, station):
 def __add_data_to_db(config, data, station):
     config.client.write_points(data, station, time_precision='s',
                                database=config.db_name)
-    __set_last_db_entry(config, station, data.tail(1))
+    __data_written(config, station, data)
+
+
+def __data_written(config, station, data):
+    # advance the last entry of the station and notify the listeners
+    if __set_last_db_entry(config, station, data.tail(1)):
+        for listener in list(config.data_listeners):
+            try:
+                listener(station, data)
+            except Exception as e:
+                logger.error(f'Data listener failed for {station}: {e}')
 
 
 def __signal_handler(sig, frame):
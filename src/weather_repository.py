@@ -1,12 +1,24 @@
+import copy
+import dataclasses
 import datetime
 import enum
+import json
 import logging
 import os
+import tempfile
 import time
+import types
+from concurrent.futures import ThreadPoolExecutor
 
+import pandas as pd
 import requests
 
+import resilience
+import rollups
 import weather_data as wd
+from query_cache import QueryCache
+from single_flight import SingleFlight
+from window_store import WindowStore
 from service_status import ServiceStatus
 
 logger = logging.getLogger("app")
@@ -14,6 +26,37 @@ logger = logging.getLogger("app")
 # Default config for the weather_data.py script
 config = wd.Config()
 
+# Location and source of the yearly CSV files
+csv_directory = "./csv"
+csv_download_url = "https://data.stadt-zuerich.ch/dataset/sid_wapo_wetterstationen/download/messwerte_{station}_{year}.csv"
+# ETag and Last-Modified of the last download per station, kept next to the downloaded files. Both have to be on
+# persistent storage (the weather-monitor-csv volume) for conditional downloads to survive a deploy.
+csv_download_state_file = os.path.join(csv_directory, "download_state.json")
+csv_download_chunk_size = 64 * 1024
+csv_download_timeout = 30
+
+# Results of run_query, invalidated per station whenever new data of the station is written
+query_cache = QueryCache(max_entries=256)
+# Interval of the measurements. Query time ranges are snapped to it to share cache entries.
+query_time_granularity = datetime.timedelta(minutes=10)
+# Concurrent cache misses of the same query share one database query
+query_flights = SingleFlight()
+
+# Latest days of measurements of all stations held in memory, fed by the ingestion
+window_store_days = 8
+window_store = WindowStore(fields=rollups.fields, days=window_store_days)
+
+# Latest measurement of each station as LatestSnapshot, replaced whenever new data of the station is written
+latest_snapshots = {}
+
+# Aggregated queries spanning at least this time range are answered from the rollups once they are backfilled
+rollups_enabled = False
+rollup_min_time_range = datetime.timedelta(days=2)
+
+# Delay in seconds before the periodic read is restarted after a failure
+periodic_read_restart_base_delay = 3
+periodic_read_restart_max_delay = 300
+
 class Measurement(enum.Enum):
     """
     Enum for the different measurements that can be queried from the database.
@@ -62,12 +105,30 @@ def get_unit(variable_name):
     return unit_mapping[variable_name]
 
 
+class Aggregation(enum.Enum):
+    """
+    Enum for the aggregate functions that can be applied to the measurements of a weather_query.
+    The enum values are the names of the InfluxQL functions.
+    """
+    Mean = "mean"
+    Min = "min"
+    Max = "max"
+    Last = "last"
+    Count = "count"
+
+
 class WeatherQuery:
-    def __init__(self, station, measurements = None, start_time = None, stop_time = None):
+    def __init__(self, station, measurements = None, start_time = None, stop_time = None, aggregation = None,
+                 group_by_interval = None, fill = None):
         self.station = station
+        # Resolution of the rollup measurement the weather_query is answered from (e.g. "1h") or None for raw data
+        self.rollup = None
         self.measurements = measurements
         self.start_time = start_time
         self.stop_time = stop_time
+        self.aggregation = aggregation
+        self.group_by_interval = group_by_interval
+        self.fill = fill
 
     def create_query_string(self):
         """
@@ -78,11 +139,22 @@ class WeatherQuery:
         Per default the weather_query will return the latest measurement for each measurement type if no start and stop time is given.
         Otherwise, the weather_query will return all measurements between the start and stop time.
 
+        If an aggregation is given, the aggregate function is applied to each measurement. The result columns keep the
+        names of the measurements. With a list of aggregations, all functions are applied to each measurement and the
+        result columns are named <measurement>_<function>. With a group_by_interval the measurements are aggregated per time interval and
+        empty intervals are filled according to fill (e.g. "linear", "previous", "null", "none" or a number).
+
         Returns: The weather_query string for the weather_query.
         """
         time_string = WeatherQuery.create_time_where_string(start_datetime=self.start_time, stop_datetime=self.stop_time)
         has_time = time_string is not None
 
+        if self.rollup is not None:
+            return self.create_rollup_query_string(time_string)
+
+        if self.aggregation is not None:
+            return self.create_aggregation_query_string(time_string)
+
         query = f'SELECT {WeatherQuery.create_measurements_string(self.measurements) if self.measurements is not None else "*"} ' \
                 f'FROM {self.station} ' \
                 f'{("WHERE " + time_string) if has_time else "ORDER BY time DESC"}' \
@@ -90,6 +162,129 @@ class WeatherQuery:
 
         return query
 
+    def create_aggregation_query_string(self, time_string):
+        """
+        Creates the weather_query string for a weather_query with aggregation.
+        Args:
+            time_string: The time 'where' string of the weather_query or None.
+        Returns: The weather_query string for the weather_query.
+        """
+        if self.measurements is not None:
+            select = ','.join(f'{aggregation.value}({measurement.value}) AS {self.get_column_name(measurement, aggregation)}'
+                              for measurement in self.measurements for aggregation in self.get_aggregations())
+        else:
+            select = ','.join(f'{aggregation.value}(*)' for aggregation in self.get_aggregations())
+
+        query = f'SELECT {select} FROM {self.station}'
+        if time_string is not None:
+            query += f' WHERE {time_string}'
+        if self.group_by_interval is not None:
+            query += f' GROUP BY time({WeatherQuery.create_interval_string(self.group_by_interval)})'
+            if self.fill is not None:
+                query += f' fill({self.fill})'
+
+        return query
+
+    def create_rollup_query_string(self, time_string):
+        """
+        Creates the weather_query string for a weather_query which is answered from a rollup measurement.
+        Min and max are aggregated from the min and max of the rollup buckets. The mean is the sum of the bucket sums
+        divided by the sum of the bucket counts, i.e. the mean of the bucket means weighted by their count.
+        Args:
+            time_string: The time 'where' string of the weather_query.
+        Returns: The weather_query string for the weather_query.
+        """
+        select = ','.join(f'{WeatherQuery.create_rollup_select(aggregation, measurement.value)} '
+                          f'AS {self.get_column_name(measurement, aggregation)}'
+                          for measurement in self.measurements for aggregation in self.get_aggregations())
+
+        query = f'SELECT {select} FROM {self.get_series_name()} WHERE {time_string}' \
+                f' GROUP BY time({WeatherQuery.create_interval_string(self.group_by_interval)})'
+        if self.fill is not None:
+            query += f' fill({self.fill})'
+
+        return query
+
+    @staticmethod
+    def create_rollup_select(aggregation, field):
+        """
+        Creates the expression aggregating a field of the rollup buckets.
+        Args:
+            aggregation: The Aggregation (mean, min, max or count).
+            field: The name of the field.
+        Returns: The expression for the weather_query.
+        """
+        if aggregation == Aggregation.Mean:
+            return f'sum({field}_sum) / sum({field}_count)'
+        if aggregation == Aggregation.Count:
+            return f'sum({field}_count)'
+        return f'{aggregation.value}({field}_{aggregation.value})'
+
+    def get_aggregations(self):
+        """
+        Returns: The list of aggregations of the weather_query.
+        """
+        return list(self.aggregation) if isinstance(self.aggregation, (list, tuple)) else [self.aggregation]
+
+    def get_column_name(self, measurement, aggregation):
+        """
+        Returns: The name of the result column of the measurement aggregated with the aggregation.
+        """
+        if isinstance(self.aggregation, (list, tuple)):
+            return f'{measurement.value}_{aggregation.value}'
+        return measurement.value
+
+    def get_series_name(self):
+        """
+        Returns: The name of the measurement in the database the weather_query is answered from.
+        """
+        return self.station if self.rollup is None else rollups.get_rollup_measurement(self.station, self.rollup)
+
+    def route_to_rollup(self, resolutions, min_time_range):
+        """
+        Creates a copy of the weather_query which is answered from the coarsest rollup whose resolution divides the
+        group_by_interval. Only mean, min, max and count aggregations of given measurements over a time range of at least
+        min_time_range are routed. The start time is rounded down to the resolution of the rollup.
+        Args:
+            resolutions: Dictionary of the rollup resolutions (e.g. "1h") and their timedelta, ordered from fine to
+                coarse.
+            min_time_range: The minimum time range of a routed weather_query as timedelta.
+        Returns: The routed weather_query or the weather_query itself if no rollup matches.
+        """
+        if self.aggregation is None \
+                or any(aggregation not in (Aggregation.Mean, Aggregation.Min, Aggregation.Max, Aggregation.Count)
+                       for aggregation in self.get_aggregations()) \
+                or self.measurements is None or self.group_by_interval is None \
+                or self.start_time is None or self.stop_time is None \
+                or self.stop_time - self.start_time < min_time_range:
+            return self
+
+        interval = pd.Timedelta(self.group_by_interval)
+        matching = [name for name, resolution in resolutions.items() if interval % resolution == pd.Timedelta(0)]
+        if not matching:
+            return self
+
+        routed = copy.copy(self)
+        routed.rollup = matching[-1]
+        routed.start_time = pd.Timestamp(self.start_time).floor(resolutions[routed.rollup]).to_pydatetime()
+        return routed
+
+    def snap_to_granularity(self, granularity):
+        """
+        Creates a copy of the weather_query with the start time rounded up and the stop time rounded down to the given
+        granularity. For measurements aligned to the granularity, the result of the weather_query stays the same.
+        Args:
+            granularity: The granularity as timedelta.
+        Returns: The snapped weather_query.
+        """
+        if self.start_time is None or self.stop_time is None:
+            return self
+
+        snapped = copy.copy(self)
+        snapped.start_time = pd.Timestamp(self.start_time).ceil(granularity).to_pydatetime()
+        snapped.stop_time = pd.Timestamp(self.stop_time).floor(granularity).to_pydatetime()
+        return snapped
+
     @staticmethod
     def create_date_string(date):
         """
@@ -119,6 +314,23 @@ class WeatherQuery:
 
         return f'time >= \'{WeatherQuery.create_date_string(start_datetime)}\' AND time <= \'{WeatherQuery.create_date_string(stop_datetime)}\''
 
+    @staticmethod
+    def create_interval_string(interval):
+        """
+        Creates the duration string of an interval for the weather_query.
+        Args:
+            interval: The interval as timedelta or as duration string (e.g. "1h").
+        Returns: The duration string for the weather_query.
+        """
+        if not isinstance(interval, datetime.timedelta):
+            return str(interval)
+
+        seconds = int(interval.total_seconds())
+        for unit, unit_seconds in [("d", 86400), ("h", 3600), ("m", 60)]:
+            if seconds % unit_seconds == 0:
+                return f"{seconds // unit_seconds}{unit}"
+        return f"{seconds}s"
+
     @staticmethod
     def create_measurements_string(measurements):
         """
@@ -129,53 +341,140 @@ class WeatherQuery:
         """
         return ','.join(str(x.value) for x in measurements)
 
+def get_csv_file_name(station):
+    """
+    Returns the path of the CSV file for the given station.
+    Args:
+        station: The station to get the CSV file path for.
+
+    Returns: The path of the CSV file.
+    """
+    return os.path.join(csv_directory, f"messwerte_{station}.csv")
+
+
+def load_download_state():
+    """
+    Loads the ETag and Last-Modified headers of the last downloads.
+    Returns: A dictionary with the station as key and the download state as value.
+    """
+    try:
+        with open(csv_download_state_file, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_download_state(station, state):
+    """
+    Saves the download state of a station. The file is replaced atomically.
+    Args:
+        station: The station the download state belongs to.
+        state: The download state containing the url, ETag and Last-Modified header.
+
+    Returns: None
+    """
+    download_state = load_download_state()
+    download_state[station] = state
+
+    os.makedirs(os.path.dirname(csv_download_state_file) or ".", exist_ok=True)
+    temp_file = csv_download_state_file + ".tmp"
+    with open(temp_file, "w") as f:
+        json.dump(download_state, f, indent=2)
+    os.replace(temp_file, csv_download_state_file)
+
+
 def download_latest_csv_files(station):
     """
     Downloads the latest CSV files from the weather station. If the download files, a fallback CSV file is used.
+    The download is conditional on the ETag and Last-Modified header of the previous download and is streamed to a
+    temporary file which replaces the CSV file atomically once complete.
     Args:
         station: The station to download the CSV files for.
 
-    Returns: None
+    Returns: True if the CSV file was replaced, False if it was not modified or the download failed.
     """
-    # Template for the CSV file paths
-    file_name = f"./csv/messwerte_{station}.csv"
+    file_name = get_csv_file_name(station)
 
     logger.info(f"Downloading latest CSV file for station {station}..")
     os.makedirs(os.path.dirname(file_name), exist_ok=True)
 
-    url = f"https://data.stadt-zuerich.ch/dataset/sid_wapo_wetterstationen/download/messwerte_{station}_{datetime.datetime.now().year}.csv"
-    r = requests.get(url, allow_redirects=True)
+    url = csv_download_url.format(station=station, year=datetime.datetime.now().year)
+
+    headers = {}
+    state = load_download_state().get(station, {})
+    if state.get("url") == url and os.path.isfile(file_name):
+        if state.get("etag"):
+            headers["If-None-Match"] = state["etag"]
+        if state.get("last_modified"):
+            headers["If-Modified-Since"] = state["last_modified"]
+
+    breaker = resilience.get_breaker(f"csv_download_{station}")
+    with breaker.call(requests.get, url, headers=headers, allow_redirects=True, stream=True,
+                      timeout=csv_download_timeout) as r:
+        if r.status_code == 304:
+            logger.info(f"CSV file for station {station} not modified since last download.")
+            return False
+
+        if r.status_code == 200 and r.headers.get('Content-Type', '').startswith('text/csv'):
+            fd, temp_file = tempfile.mkstemp(dir=os.path.dirname(file_name), suffix=".tmp")
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    for chunk in r.iter_content(chunk_size=csv_download_chunk_size):
+                        f.write(chunk)
+                os.replace(temp_file, file_name)
+            except BaseException:
+                os.remove(temp_file)
+                raise
+
+            save_download_state(station, {
+                "url": url,
+                "etag": r.headers.get("ETag"),
+                "last_modified": r.headers.get("Last-Modified")
+            })
+            logger.info(f"Downloaded latest CSV file for station {station} to {file_name}")
+            return True
 
-    if r.status_code == 200 and r.headers['Content-Type'] == 'text/csv':
-        open(file_name, 'wb').write(r.content)
-        logger.info(f"Downloaded latest CSV file for station {station} to {file_name}")
-    else:
         logger.warning(f"Could not download latest CSV file for station {station}.")
         logger.warning(f"Status code: {r.status_code}")
         logger.warning(f"Using fallback CSV file for station {station}..")
+        return False
+
 
 def init():
     """
     Initializes the database connection and creates the database if it does not exist.
-    Imports the CSV files into the database.
+    Downloads the latest CSV files of all stations concurrently and imports them into the database. The import is
+    skipped for CSV files which were not modified since their last complete import.
     Checks if additional data can be fetched from the API.
 
     Returns: None
     """
     config.db_host = os.environ.get("INFLUXDB_HOST") if os.environ.get("INFLUXDB_HOST") else "localhost"
     config.debug = int(os.environ.get("INFLUXDB_PORT")) if os.environ.get("INFLUXDB_PORT") else 8086
+    config.db_max_concurrent_queries = int(os.environ.get("DB_MAX_CONCURRENT_QUERIES", config.db_max_concurrent_queries))
     logger.debug(f"DB config: host {config.db_host}, port {config.db_port}")
 
     wd.connect_db(config)
     logger.debug("DB connected")
 
+    # Roll up the history which was written before the rollups existed. The rollups of new data are updated before
+    # the cached query results are invalidated.
+    rollups.ensure_backfilled(config)
+    wd.add_data_listener(config, lambda station, data: rollups.on_data_written(config, station, data))
+    wd.add_data_listener(config, lambda station, data: query_cache.invalidate(station))
+
     logger.debug("Starting CSV import..")
 
+    # Download the CSV files of all stations concurrently
+    logger.info("Checking for latest CSV files started")
+    with ThreadPoolExecutor(max_workers=len(config.stations)) as executor:
+        downloads = {station: executor.submit(download_latest_csv_files, station) for station in config.stations}
+
     # Import CSV files for each station
     for station in config.stations:
-        logger.info("Checking for latest CSV files started for " + station)
+        modified = True
         try:
-            download_latest_csv_files(station)
+            modified = downloads[station].result()
         except Exception as e:
             logger.error("Download latest CSV files failed for " + station)
             logger.error(e)
@@ -183,8 +482,12 @@ def init():
             # Use fallback data
             logger.info("Using fallback data..")
 
-        wd.import_csv_file(config=config, file_name=f"./csv/messwerte_{station}.csv",
-                           station=station)
+        file_name = get_csv_file_name(station)
+        if not modified and wd.is_csv_file_imported(config, station, file_name):
+            logger.debug(f"CSV '{station}' already imported.")
+            continue
+
+        wd.import_csv_file(config=config, file_name=file_name, station=station)
         logger.debug(f"CSV '{station}' imported.")
 
     logger.debug("CSV import finished.")
@@ -194,36 +497,130 @@ def init():
     wd.import_latest_data(config=config, periodic_read=False)
     logger.debug("Periodic read finished.")
 
+    warm_window_store()
+    wd.add_data_listener(config, window_store.append)
+    logger.debug("Window store warmed.")
+
+    for station in config.stations:
+        update_latest_snapshot(station)
+    wd.add_data_listener(config, lambda station, data: update_latest_snapshot(station))
+
+    global rollups_enabled
+    rollups_enabled = True
+
+
+@dataclasses.dataclass(frozen=True)
+class LatestSnapshot:
+    """
+    Immutable latest measurement of a station together with its compact JSON representation.
+    The ETag is derived from the time of the measurement (watermark) and changes whenever new data arrives.
+    """
+    station: str
+    watermark: pd.Timestamp
+    values: types.MappingProxyType
+    etag: str = dataclasses.field(init=False)
+    content: bytes = dataclasses.field(init=False, repr=False)
+
+    def __post_init__(self):
+        object.__setattr__(self, 'values', types.MappingProxyType(dict(self.values)))
+        object.__setattr__(self, 'etag', f"{self.station}-{int(self.watermark.timestamp())}")
+        object.__setattr__(self, 'content', json.dumps(self.to_dict(), separators=(',', ':')).encode())
+
+    def to_dict(self):
+        return {"station": self.station, "time": self.watermark.isoformat(), "values": dict(self.values)}
+
+
+def update_latest_snapshot(station):
+    """
+    Creates a new LatestSnapshot of the station from the latest measurement and publishes it.
+    Args:
+        station: The station.
+
+    Returns: The new snapshot or None if no data is available.
+    """
+    data = run_query(WeatherQuery(station=station))
+    if data is None or data.empty:
+        return None
+
+    row = data.iloc[-1]
+    values = {column: None if pd.isna(row[column]) else float(row[column]) for column in sorted(data.columns)}
+    snapshot = LatestSnapshot(station, data.index[-1], values)
+    latest_snapshots[station] = snapshot
+    return snapshot
+
+
+def get_latest_snapshot(station):
+    """
+    Returns the LatestSnapshot of the station without querying the database unless no snapshot exists yet.
+    Args:
+        station: The station.
+
+    Returns: The snapshot or None if the station is unknown or has no data.
+    """
+    if station not in config.stations:
+        return None
+
+    snapshot = latest_snapshots.get(station, None)
+    if snapshot is None:
+        snapshot = update_latest_snapshot(station)
+    return snapshot
+
+
+def warm_window_store():
+    """
+    Loads the latest window_store_days days of all stations from the database into the window store.
+
+    Returns: None
+    """
+    stop_time = datetime.datetime.utcnow()
+    start_time = stop_time - datetime.timedelta(days=window_store_days)
+
+    for station in config.stations:
+        query = WeatherQuery(station=station, start_time=start_time, stop_time=stop_time)
+        data = wd.execute_query(config=config, station=station, query_string=query.create_query_string())
+        window_store.warm(station, data, pd.Timestamp(start_time, tz="UTC"))
+
 
 def import_latest_data_periodic():
     """
-    Wrapper function for the periodic read of the latest data from the API of the weather_data.py script.
+    Supervisor loop for the periodic read of the latest data from the API of the weather_data.py script.
     Updates the service status accordingly.
-    Restarts the periodic read if it fails.
+    Restarts the periodic read if it fails. The restart delay grows exponentially with jitter while the periodic read
+    keeps failing and is reset once a run lasted longer than the maximum delay.
 
     Returns: None
     """
-    try:
-        logger.info("Periodic read started.")
-        ServiceStatus.is_live = True
+    failures = 0
+    while True:
+        started = time.monotonic()
+        try:
+            logger.info("Periodic read started.")
+            ServiceStatus.is_live = True
 
-        wd.import_latest_data(config, periodic_read=True)
-        logger.info("Periodic read finished.")
+            wd.import_latest_data(config, periodic_read=True)
+            logger.info("Periodic read finished.")
 
-    except Exception as e:
-        ServiceStatus.is_live = False
-        logger.error("Periodic read failed.")
-        logger.error(e)
+        except Exception as e:
+            ServiceStatus.is_live = False
+            logger.error("Periodic read failed.")
+            logger.error(e)
+
+        if time.monotonic() - started > periodic_read_restart_max_delay:
+            failures = 0
+        failures += 1
 
-    logger.debug("Restarting periodic read in 3s..")
-    time.sleep(3)
+        delay = resilience.backoff_delay(failures, periodic_read_restart_base_delay, periodic_read_restart_max_delay)
+        logger.debug(f"Restarting periodic read in {delay:.0f}s..")
+        time.sleep(delay)
 
-    import_latest_data_periodic()
 
 def run_query(weather_query, convert_timezone=True, timezone="Europe/Zurich"):
     """
     Wrapper function for the query_string function of the weather_data.py script.
     Converts the timezone of the result if passed as parameter.
+    The query_string is answered from the window store if possible. Long-range aggregated queries are routed to the
+    rollups. Otherwise, results are cached until new data of the station is written. The time range of the query_string is snapped to the granularity of the measurements, so
+    that repeated queries within the same interval share the cache entry.
 
     Args:
         weather_query: The query_string object to run the query_string for.
@@ -233,19 +630,99 @@ def run_query(weather_query, convert_timezone=True, timezone="Europe/Zurich"):
     Returns: The result of the query_string as a DataFrame or None if the query_string failed.
     """
     try:
-        df = wd.execute_query(config=config, station=weather_query.station, query_string=weather_query.create_query_string())
+        weather_query = weather_query.snap_to_granularity(query_time_granularity)
+
+        # Answer from the window store if it covers the requested time range
+        df = query_window_store(weather_query)
+        if df is not None:
+            if convert_timezone and timezone is not None:
+                df.index = df.index.tz_convert(timezone)
+            return df
+
+        if rollups_enabled:
+            weather_query = weather_query.route_to_rollup(rollups.resolutions, rollup_min_time_range)
 
-        # Convert DF index to specified timezone if requested
-        if df is not None and convert_timezone and timezone is not None:
-            df.index = df.index.tz_convert(timezone)
-            
-        return df
+        query_string = weather_query.create_query_string()
+        cache_key = (weather_query.station, query_string, convert_timezone, timezone)
+
+        df = query_cache.get(cache_key)
+        if df is not None:
+            return df
+
+        df = query_flights.do(cache_key, lambda: execute_cached_query(weather_query, query_string, cache_key,
+                                                                      convert_timezone, timezone))
+
+        # The result is shared by all callers of the flight
+        return df.copy() if df is not None else None
     except Exception as e:
         logger.error("run_query failed.")
         logger.error(e)
 
     return None
 
+
+def execute_cached_query(weather_query, query_string, cache_key, convert_timezone, timezone):
+    """
+    Executes the query_string on the database and stores the result in the query cache. Like all database queries, it
+    waits for one of the db_max_concurrent_queries slots of the config.
+    Args:
+        weather_query: The weather_query of the query_string.
+        query_string: The query_string to execute.
+        cache_key: The key of the result in the query cache.
+        convert_timezone: Whether to convert the timezone of the data or not.
+        timezone: The timezone to convert the data to.
+
+    Returns: The result of the query_string as a DataFrame or None if the query_string failed.
+    """
+    generation = query_cache.generation(weather_query.station)
+    df = wd.execute_query(config=config, station=weather_query.station, query_string=query_string,
+                          series=weather_query.get_series_name())
+
+    # Convert DF index to specified timezone if requested
+    if df is not None and convert_timezone and timezone is not None:
+        df.index = df.index.tz_convert(timezone)
+
+    if df is not None:
+        query_cache.put(cache_key, df, generation)
+
+    return df
+
+
+def query_window_store(weather_query):
+    """
+    Runs the weather_query against the window store.
+    Args:
+        weather_query: The weather_query to run.
+
+    Returns: The result as a DataFrame with UTC index or None if the window store does not cover the weather_query.
+    """
+    if (weather_query.start_time is None) != (weather_query.stop_time is None) or weather_query.aggregation is not None:
+        return None
+
+    fields = None
+    if weather_query.measurements is not None:
+        fields = [measurement.value for measurement in weather_query.measurements]
+
+    return window_store.query(weather_query.station, fields, weather_query.start_time, weather_query.stop_time)
+
+
+def get_query_cache_stats():
+    """
+    Returns the hit and miss counters of the query cache.
+    Returns: A dictionary with the number of hits, misses and entries and the hit rate.
+    """
+    return query_cache.get_stats()
+
+
+def get_watermark(station):
+    """
+    Returns the time of the last entry of the given station, which advances whenever new data of the station is
+    written.
+    Returns: The time of the last entry (naive UTC) or None.
+    """
+    return wd.get_last_entry_time(config, station)
+
+
 def get_stations():
     """
     Returns the stations that are available in the database.
@@ -256,13 +733,16 @@ def get_stations():
 def health_check():
     """
     Runs a weather_query on the database connection to check if the database is available and data can be retrieved.
-    Updated the service status accordingly.
+    Updated the service status accordingly. The weather_query bypasses the query cache and the window store, which
+    keep answering while the database is down.
 
     Returns: Boolean indicating if the database is available.
     """
     try:
         query = WeatherQuery(station=config.stations[0], measurements=[Measurement.Air_temp])
-        data = run_query(query)
+        data = wd.execute_query(config=config, station=query.station, query_string=query.create_query_string())
+        if data is not None:
+            data.index = data.index.tz_convert("Europe/Zurich")
 
         if data is not None and len(data) > 0:
             ServiceStatus.last_fetch = data.index[-1]
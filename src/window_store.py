@@ -0,0 +1,173 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+
+class StationWindow:
+    """
+    Columnar ring buffer holding the latest measurements of a single station.
+
+    The timestamps (UTC, as datetime64[ns]) and the values of all fields are stored in NumPy arrays of a fixed
+    capacity. Appending overwrites the oldest rows once the buffer is full.
+    """
+
+    def __init__(self, fields, capacity):
+        self.fields = list(fields)
+        self.field_index = {field: i for i, field in enumerate(self.fields)}
+        self.capacity = capacity
+        self.times = np.zeros(capacity, dtype='datetime64[ns]')
+        self.values = np.full((capacity, len(self.fields)), np.nan)
+        # Fields with at least one value, like the field keys of the measurement in InfluxDB
+        self.written = np.zeros(len(self.fields), dtype=bool)
+        self.start = 0
+        self.size = 0
+        # All measurements at or after this time are held by the buffer
+        self.covered_from = None
+        self.lock = threading.Lock()
+
+    def append(self, data):
+        """
+        Appends the rows of the given DataFrame which are newer than the newest row in the buffer.
+        Args:
+            data: DataFrame with a UTC DatetimeIndex. Columns which are not fields of the buffer are ignored.
+        """
+        times = data.index.tz_convert('UTC').tz_localize(None).to_numpy(dtype='datetime64[ns]')
+        values = np.full((len(data), len(self.fields)), np.nan)
+        for column in data.columns:
+            if column in self.field_index:
+                values[:, self.field_index[column]] = pd.to_numeric(data[column], errors='coerce').to_numpy(
+                    dtype=np.float64, na_value=np.nan)
+
+        order = np.argsort(times, kind='stable')
+        times, values = times[order], values[order]
+
+        with self.lock:
+            if self.size > 0:
+                newer = times > self.times[(self.start + self.size - 1) % self.capacity]
+                times, values = times[newer], values[newer]
+            times, values = times[-self.capacity:], values[-self.capacity:]
+            if len(times) == 0:
+                return
+
+            positions = (self.start + self.size + np.arange(len(times))) % self.capacity
+            self.times[positions] = times
+            self.values[positions] = values
+            self.written |= ~np.isnan(values).all(axis=0)
+
+            overflow = max(0, self.size + len(times) - self.capacity)
+            self.start = (self.start + overflow) % self.capacity
+            self.size = min(self.capacity, self.size + len(times))
+
+            if overflow > 0 or self.covered_from is None:
+                oldest = self.times[self.start]
+                self.covered_from = oldest if self.covered_from is None else max(self.covered_from, oldest)
+
+    def warm(self, data, covered_from):
+        """
+        Replaces the content of the buffer with the given DataFrame.
+        Args:
+            data: DataFrame with a UTC DatetimeIndex holding all measurements since covered_from.
+            covered_from: The start of the time range which was loaded (UTC).
+        """
+        with self.lock:
+            self.start = 0
+            self.size = 0
+            self.covered_from = None
+
+        if data is not None and not data.empty:
+            self.append(data)
+
+        with self.lock:
+            covered_from = np.datetime64(pd.Timestamp(covered_from).tz_convert('UTC').tz_localize(None), 'ns')
+            if self.size < self.capacity:
+                self.covered_from = covered_from
+            else:
+                self.covered_from = max(covered_from, self.times[self.start])
+
+    def query(self, fields, start=None, stop=None):
+        """
+        Returns the measurements between start and stop (both inclusive) or the latest measurement if no time range
+        is given.
+
+        Like InfluxDB, rows without a value of the requested fields are skipped and all fields only returns the fields
+        with at least one value.
+        Args:
+            fields: The fields to return or None for all fields.
+            start: The start of the time range (UTC) or None.
+            stop: The stop of the time range (UTC) or None.
+
+        Returns: A DataFrame with a UTC DatetimeIndex like the one returned by InfluxDB or None if the buffer does not
+        cover the requested time range or holds no matching rows.
+        """
+        if fields is not None and any(field not in self.field_index for field in fields):
+            return None
+
+        with self.lock:
+            if self.size == 0 or self.covered_from is None:
+                return None
+
+            if fields is None:
+                fields = sorted(field for field in self.fields if self.written[self.field_index[field]])
+            columns = [self.field_index[field] for field in fields]
+
+            order = (self.start + np.arange(self.size)) % self.capacity
+            times = self.times[order]
+
+            if start is not None or stop is not None:
+                start = np.datetime64(pd.Timestamp(start).tz_localize(None), 'ns')
+                stop = np.datetime64(pd.Timestamp(stop).tz_localize(None), 'ns')
+                if start < self.covered_from:
+                    return None
+                order = order[np.searchsorted(times, start, side='left'):np.searchsorted(times, stop, side='right')]
+
+            selection = order[~np.isnan(self.values[order][:, columns]).all(axis=1)]
+            if start is None and stop is None:
+                selection = selection[-1:]
+
+            values = self.values[selection][:, columns]
+            index = pd.DatetimeIndex(self.times[selection]).tz_localize('UTC')
+
+        if len(index) == 0:
+            return None
+
+        return pd.DataFrame(values, index=index, columns=fields)
+
+
+class WindowStore:
+    """
+    In-process store of the latest days of measurements of all stations, see StationWindow.
+    """
+
+    def __init__(self, fields, days=8, interval=pd.Timedelta(minutes=10)):
+        self.fields = list(fields)
+        self.days = days
+        # One additional day as margin for irregular intervals
+        self.capacity = int(pd.Timedelta(days=days + 1) / interval)
+        self.windows = {}
+        self.lock = threading.Lock()
+
+    def get_window(self, station):
+        with self.lock:
+            if station not in self.windows:
+                self.windows[station] = StationWindow(self.fields, self.capacity)
+            return self.windows[station]
+
+    def append(self, station, data):
+        """
+        Appends new measurements of a station. Can be registered as data listener of weather_data.py.
+        """
+        self.get_window(station).append(data)
+
+    def warm(self, station, data, covered_from):
+        self.get_window(station).warm(data, covered_from)
+
+    def query(self, station, fields, start=None, stop=None):
+        """
+        Returns the measurements of the station if the store covers the requested time range, see
+        StationWindow.query.
+        """
+        with self.lock:
+            window = self.windows.get(station, None)
+
+        return window.query(fields, start, stop) if window is not None else None